@@ -0,0 +1,122 @@
+import time
+import random
+import asyncio
+
+import tracing
+from llm_cache import CachedResponse, cache_key
+
+
+def estimate_tokens(text):
+    """Rough token count (about 4 characters per token) used for rate limiting."""
+    return max(1, len(text) // 4)
+
+
+class TokenBucket:
+    """Async token bucket refilled continuously at capacity units per minute."""
+
+    def __init__(self, capacity_per_minute):
+        self.capacity = float(capacity_per_minute)
+        self.tokens = float(capacity_per_minute)
+        self.rate = capacity_per_minute / 60.0
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount=1):
+        # A single request larger than the bucket would never fit; let it through once the bucket is full
+        amount = min(amount, self.capacity)
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+
+class RateLimiter:
+    """Requests-per-minute and tokens-per-minute limits applied together."""
+
+    def __init__(self, requests_per_minute=500, tokens_per_minute=200_000):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, tokens):
+        await self.requests.acquire(1)
+        await self.tokens.acquire(tokens)
+
+
+def is_rate_limit_error(error):
+    """True for 429 responses from the OpenAI client; other errors, even ones mentioning 429, are not retried."""
+    return getattr(error, "status_code", None) == 429 or type(error).__name__ == "RateLimitError"
+
+
+class AsyncLLMClient:
+    """
+    Concurrency- and rate-limited async wrapper around a chat model.
+
+    At most max_concurrency calls are in flight; each call first takes one request and
+    its estimated prompt + completion tokens from the RateLimiter. 429 errors are
+    retried with exponential backoff and jitter. Models without ainvoke() are run in a
+    worker thread. An optional LLMCache is consulted before any network call.
+    """
+
+    def __init__(self, llm, max_concurrency=8, requests_per_minute=500, tokens_per_minute=200_000,
+                 max_retries=6, base_delay=1.0, max_delay=60.0, completion_tokens=1024, cache=None):
+        self.llm = llm
+        self.semaphore = asyncio.Semaphore(max_concurrency)
+        self.limiter = RateLimiter(requests_per_minute, tokens_per_minute)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.completion_tokens = completion_tokens
+        self.cache = cache
+        self.model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+        self.temperature = getattr(llm, "temperature", None)
+        self.rate_limit_retries = 0
+
+    async def _call(self, prompt):
+        if hasattr(self.llm, "ainvoke"):
+            return await self.llm.ainvoke(prompt)
+        return await asyncio.to_thread(self.llm.invoke, prompt)
+
+    async def ainvoke(self, prompt, refresh=False):
+        key = cache_key(self.model, self.temperature, prompt)
+        with tracing.span("llm", model=self.model, cached=False, rate_limit_retries=0) as span:
+            if self.cache is not None and not refresh:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    span["cached"] = True
+                    return CachedResponse(cached)
+
+            attempt = 0
+            while True:
+                async with self.semaphore:
+                    await self.limiter.acquire(estimate_tokens(prompt) + self.completion_tokens)
+                    try:
+                        response = await self._call(prompt)
+                        break
+                    except Exception as e:
+                        if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                            raise
+                        error = e
+                # Back off outside the semaphore so other calls can use the slot
+                attempt += 1
+                self.rate_limit_retries += 1
+                span["rate_limit_retries"] = attempt
+                delay = min(self.max_delay, self.base_delay * 2 ** (attempt - 1)) * (0.5 + random.random() / 2)
+                print(f"Rate limited ({error}); retrying in {delay:.1f}s (attempt {attempt}/{self.max_retries})")
+                await asyncio.sleep(delay)
+
+            content = response.content if hasattr(response, "content") else str(response)
+            span.update(tracing.llm_usage(self.model, prompt, response, content))
+        if self.cache is not None:
+            self.cache.put(key, content, model=self.model)
+        return CachedResponse(content)
+
+    async def apredict(self, prompt, refresh=False):
+        return (await self.ainvoke(prompt, refresh=refresh)).content
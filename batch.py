@@ -0,0 +1,282 @@
+import os
+import glob
+import json
+import time
+import hashlib
+import argparse
+from dataclasses import asdict, dataclass
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+
+import pandas as pd
+from openpyxl.utils import get_column_letter
+
+import tracing
+from column_index import build_column_index
+from formula_eval import evaluate_workbook
+from formula_graph import build_dependency_graph
+from heurestic_final import enhance_table_formulas, extract_tables_with_column_names_and_dependencies
+from manifest import file_hash
+from table_store import CATALOG_NAME, TABLE_SUFFIX, TableWriter
+from workbook_grid import load_workbook_grid
+
+
+WORKBOOK_SUFFIXES = (".xlsx", ".xlsm")
+# Written last into a workbook's output folder; its presence (with the same source hash) marks the workbook done
+DONE_MARKER = ".batch_done.json"
+METADATA_NAME = "metadata.json"
+MISMATCHES_NAME = "formula_mismatches.csv"
+SUMMARY_NAME = "batch_summary.csv"
+
+
+@dataclass
+class WorkbookResult:
+    """Outcome for one workbook: done, skipped (finished by an earlier run) or failed."""
+    source: str
+    output_dir: str
+    status: str
+    sheets: int = 0
+    tables: int = 0
+    formulas: int = 0
+    mismatches: int = 0
+    seconds: float = 0.0
+    error: str = None
+
+
+def find_workbooks(inputs):
+    """Workbook paths from files, directories (searched recursively) and glob patterns; Excel lock files are skipped."""
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*"), recursive=True)
+        elif os.path.exists(item):
+            matches = [item]
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.extend(
+            os.path.abspath(path) for path in matches
+            if path.lower().endswith(WORKBOOK_SUFFIXES) and not os.path.basename(path).startswith("~$")
+        )
+    return sorted(set(paths))
+
+
+def output_dirs(paths, output_root):
+    """One output folder per workbook, named after it; same-named workbooks get a suffix from their path."""
+    names = [os.path.splitext(os.path.basename(path))[0] for path in paths]
+    repeated = {name for name in names if names.count(name) > 1}
+    return {
+        path: os.path.join(output_root, name if name not in repeated
+                           else f"{name}-{hashlib.sha256(path.encode('utf-8')).hexdigest()[:8]}")
+        for path, name in zip(paths, names)
+    }
+
+
+def _read_marker(output_dir):
+    path = os.path.join(output_dir, DONE_MARKER)
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def completed_result(path, output_dir, settings):
+    """The recorded result when an earlier run finished this workbook with the same content and settings."""
+    marker = _read_marker(output_dir)
+    if marker is None or marker["settings"] != settings or marker["hash"] != file_hash(path):
+        return None
+    return WorkbookResult(**{**marker["result"], "status": "skipped"})
+
+
+def _clear_outputs(output_dir):
+    """Remove what an earlier, unfinished run wrote, so no stale tables are left next to new ones."""
+    for path in [os.path.join(output_dir, name) for name in (DONE_MARKER, METADATA_NAME, MISMATCHES_NAME)]:
+        if os.path.exists(path):
+            os.remove(path)
+    for entry in os.scandir(output_dir):
+        if entry.is_dir():
+            for file in os.scandir(entry.path):
+                if file.name == CATALOG_NAME or file.name.endswith(TABLE_SUFFIX):
+                    os.remove(file.path)
+
+
+def _column_name(value):
+    return None if isinstance(value, float) and value != value else value
+
+
+def _save_tables(workbook, tables_with_metadata, output_dir):
+    """Store every table as Arrow files under <output_dir>/<sheet>; returns the JSON-ready metadata."""
+    metadata = {}
+    for sheet_name, tables in tables_with_metadata.items():
+        sheet_folder = os.path.join(output_dir, sheet_name)
+        os.makedirs(sheet_folder, exist_ok=True)
+        writer = TableWriter(sheet_folder, workbook[sheet_name])
+        entries = []
+        for i, table in enumerate(tables, start=1):
+            coordinates = table["Coordinates"]
+            source_range = (f"{_cell(coordinates['StartRow'], coordinates['StartCol'])}:"
+                            f"{_cell(coordinates['EndRow'], coordinates['EndCol'])}")
+            header, *rows = table["TableData"]
+            dataframe = pd.DataFrame(rows, columns=[str(value) if value is not None else None for value in header])
+            path = writer.save(dataframe, f"table_{i}", source_range)
+            entries.append({
+                "file": os.path.basename(path),
+                "range": source_range,
+                "Coordinates": coordinates,
+                "Metadata": [{**column, "ColumnName": _column_name(column["ColumnName"])} for column in table["Metadata"]],
+            })
+        metadata[sheet_name] = entries
+    return metadata
+
+
+def _cell(row, col):
+    return f"{get_column_letter(col)}{row}"
+
+
+def process_workbook(path, output_dir, evaluate=False, detection_settings=None):
+    """
+    Heuristic extraction of one workbook into output_dir: tables as Arrow files with a
+    catalog per sheet, column metadata with enhanced formulas in metadata.json and, with
+    evaluate, a recomputation of the formulas checked against the cached values.
+    Uses no module state, so any number of these can run in separate processes.
+    """
+    start = time.perf_counter()
+    os.makedirs(output_dir, exist_ok=True)
+    _clear_outputs(output_dir)
+    name = os.path.splitext(os.path.basename(path))[0]
+    with tracing.span("workbook", workbook=name):
+        with tracing.span("load"):
+            workbook = load_workbook_grid(path)
+        with tracing.span("dependency_graph") as span:
+            graph = build_dependency_graph(workbook)
+            span["formulas"] = len(graph)
+        with tracing.span("metadata") as span:
+            tables = extract_tables_with_column_names_and_dependencies(
+                path, detection_settings=detection_settings, workbook=workbook, graph=graph)
+            span["tables"] = sum(len(sheet_tables) for sheet_tables in tables.values())
+        with tracing.span("enhance"):
+            enhance_table_formulas(tables, build_column_index(tables))
+        with tracing.span("save"):
+            metadata = {"source": path, "sheets": _save_tables(workbook, tables, output_dir)}
+
+        mismatches = 0
+        if evaluate:
+            with tracing.span("formula_eval"):
+                report = evaluate_workbook(workbook, graph=graph)
+            metadata["formula_check"] = report.summary()
+            mismatches = metadata["formula_check"]["mismatched_cells"]
+            if mismatches:
+                report.mismatch_frame().to_csv(os.path.join(output_dir, MISMATCHES_NAME), index=False)
+
+    with open(os.path.join(output_dir, METADATA_NAME), "w") as f:
+        json.dump(metadata, f, indent=2, default=str)
+    return WorkbookResult(
+        source=path, output_dir=output_dir, status="done", sheets=len(tables),
+        tables=sum(len(sheet_tables) for sheet_tables in tables.values()), formulas=len(graph),
+        mismatches=mismatches, seconds=time.perf_counter() - start,
+    )
+
+
+def _run_one(path, output_dir, settings):
+    """Worker entry point: process a workbook and write its done marker; errors become a failed result."""
+    try:
+        result = process_workbook(path, output_dir, **settings)
+    except Exception as e:
+        return WorkbookResult(source=path, output_dir=output_dir, status="failed", error=f"{type(e).__name__}: {e}")
+    tmp_path = os.path.join(output_dir, f"{DONE_MARKER}.tmp")
+    with open(tmp_path, "w") as f:
+        json.dump({"hash": file_hash(path), "settings": settings, "result": asdict(result)}, f, indent=2)
+    os.replace(tmp_path, os.path.join(output_dir, DONE_MARKER))
+    return result
+
+
+def _format_duration(seconds):
+    minutes, seconds = divmod(int(seconds), 60)
+    return f"{minutes}m{seconds:02d}s" if minutes else f"{seconds}s"
+
+
+def run_batch(inputs, output_root, workers=None, resume=True, evaluate=False, detection_settings=None,
+              trace_path=None):
+    """
+    Process every workbook found in inputs, up to workers (default: one per CPU) at a time.
+
+    Each workbook runs in its own worker process and gets its own folder under
+    output_root; a worker that dies (e.g. killed for memory) fails only its workbook.
+    With resume, workbooks an earlier run finished (same file content and settings) are
+    skipped, so a crashed or interrupted batch picks up where it stopped. Larger files
+    are started first to keep the workers busy to the end. A progress line is printed
+    per workbook and a summary CSV is written to output_root. Returns the WorkbookResult list.
+    """
+    paths = find_workbooks(inputs)
+    folders = output_dirs(paths, output_root)
+    settings = {"evaluate": evaluate, "detection_settings": detection_settings}
+    os.makedirs(output_root, exist_ok=True)
+
+    results, pending = [], []
+    for path in paths:
+        done = completed_result(path, folders[path], settings) if resume else None
+        if done is not None:
+            results.append(done)
+        else:
+            pending.append(path)
+    pending.sort(key=os.path.getsize, reverse=True)
+    print(f"{len(paths)} workbook(s) found, {len(results)} already done, {len(pending)} to process")
+
+    start = time.perf_counter()
+    workers = workers or os.cpu_count() or 1
+    waiting, running, finished = list(reversed(pending)), {}, 0
+    try:
+        while waiting or running:
+            while waiting and len(running) < workers:
+                path = waiting.pop()
+                # A single-worker pool per workbook: a worker that dies breaks only its own pool
+                pool = ProcessPoolExecutor(max_workers=1, initializer=tracing.configure, initargs=(trace_path,))
+                running[pool.submit(_run_one, path, folders[path], settings)] = (path, pool)
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                path, pool = running.pop(future)
+                pool.shutdown()
+                try:
+                    result = future.result()
+                except BrokenProcessPool as e:
+                    # No marker was written, so the workbook is retried on resume
+                    result = WorkbookResult(source=path, output_dir=folders[path], status="failed",
+                                            error=f"worker process died: {e}")
+                results.append(result)
+                finished += 1
+                elapsed = time.perf_counter() - start
+                remaining = elapsed / finished * (len(pending) - finished)
+                detail = result.error if result.status == "failed" else f"{result.tables} table(s), {result.seconds:.1f}s"
+                print(f"[{finished}/{len(pending)}] {result.status}: {os.path.basename(path)} ({detail}) "
+                      f"- {finished / elapsed:.2f} workbook(s)/s, about {_format_duration(remaining)} left")
+    finally:
+        for _, pool in running.values():
+            pool.shutdown(cancel_futures=True)
+
+    summary = pd.DataFrame([asdict(result) for result in results])
+    summary.to_csv(os.path.join(output_root, SUMMARY_NAME), index=False)
+    counts = summary["status"].value_counts().to_dict() if len(summary) else {}
+    print(f"Finished in {_format_duration(time.perf_counter() - start)}: "
+          + ", ".join(f"{counts.get(status, 0)} {status}" for status in ("done", "skipped", "failed"))
+          + f"; summary in {os.path.join(output_root, SUMMARY_NAME)}")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract tables and formula metadata from many workbooks in parallel.")
+    parser.add_argument("inputs", nargs="+", help="Workbook files, directories or glob patterns (e.g. 'data/**/*.xlsx').")
+    parser.add_argument("--output-dir", default=os.getcwd(), help="Root folder; each workbook gets a folder inside.")
+    parser.add_argument("--workers", type=int, default=None, help="Worker processes (default: one per CPU).")
+    parser.add_argument("--no-resume", dest="resume", action="store_false",
+                        help="Reprocess workbooks an earlier run already finished.")
+    parser.add_argument("--evaluate", action="store_true",
+                        help="Also recompute the formulas and report cells that differ from the cached values.")
+    parser.add_argument("--trace", default=tracing.DEFAULT_TRACE_PATH,
+                        help="Write timing spans from all workers to this JSONL file and print a summary at the end.")
+    args = parser.parse_args()
+
+    batch_results = run_batch(args.inputs, args.output_dir, workers=args.workers, resume=args.resume,
+                              evaluate=args.evaluate, trace_path=os.path.abspath(args.trace) if args.trace else None)
+    if args.trace:
+        print(tracing.format_summary(tracing.summarize(args.trace)))
+    if any(result.status == "failed" for result in batch_results):
+        raise SystemExit(1)
@@ -0,0 +1,206 @@
+import io
+import os
+import sys
+import json
+import time
+import asyncio
+import argparse
+import tempfile
+import tracemalloc
+import contextlib
+
+import table_extraction
+from async_llm import AsyncLLMClient
+from code_executor import ScriptExecutor
+from code_store import CodeStore
+from column_index import build_column_index
+from fake_llm import FakeLLM
+from formula_eval import evaluate_workbook
+from formula_graph import build_dependency_graph
+from heurestic_final import enhance_table_formulas, extract_tables_with_column_names_and_dependencies
+from llm_cache import LLMCache
+from pipeline import run_pipeline
+from sheet_chunker import chunk_sheet
+from synthetic_workbook import add_spec_arguments, generate_workbook, spec_from_args
+from workbook_grid import load_workbook_grid
+
+
+def _load(state):
+    state["workbook"] = load_workbook_grid(state["path"])
+    return "cells", sum(len(state["workbook"][name]) for name in state["workbook"].sheetnames)
+
+
+def _dependency_graph(state):
+    state["graph"] = build_dependency_graph(state["workbook"])
+    return "formulas", len(state["graph"])
+
+
+def _metadata(state):
+    state["tables"] = extract_tables_with_column_names_and_dependencies(
+        state["path"], workbook=state["workbook"], graph=state["graph"])
+    return "tables", sum(len(tables) for tables in state["tables"].values())
+
+
+def _enhance(state):
+    return "formulas", enhance_table_formulas(state["tables"], build_column_index(state["tables"]))
+
+
+def _formula_eval(state):
+    report = evaluate_workbook(state["workbook"], graph=state["graph"])
+    return "cells", report.summary()["evaluated_cells"]
+
+
+def _chunk(state):
+    for name in state["workbook"].visible_sheetnames:
+        chunk_sheet(state["workbook"][name])
+    return "sheets", len(state["workbook"].visible_sheetnames)
+
+
+def _pipeline(state):
+    """Extraction and analysis through pipeline.run_pipeline, with a FakeLLM and fresh caches and stores."""
+    work_dir = tempfile.mkdtemp(dir=state["work_dir"])
+    table_extraction.llm_cache = LLMCache(os.path.join(work_dir, "llm_cache.sqlite"))
+    table_extraction.code_store = CodeStore(os.path.join(work_dir, "code_store.sqlite"))
+    client = AsyncLLMClient(FakeLLM(latency=state["llm_latency"], model_name="gpt-4o-mini"),
+                            cache=table_extraction.llm_cache)
+    rows = asyncio.run(run_pipeline([state["path"]], client, os.path.join(work_dir, "results"),
+                                    os.path.join(work_dir, "tables")))
+    table_extraction.llm_cache.close()
+    return "tables", rows
+
+
+# Stages in run order; later stages use what earlier ones left in the shared state
+STAGES = [
+    ("load", _load),
+    ("dependency_graph", _dependency_graph),
+    ("metadata", _metadata),
+    ("enhance", _enhance),
+    ("formula_eval", _formula_eval),
+    ("chunk", _chunk),
+    ("pipeline", _pipeline),
+]
+# Earlier stages whose results a stage reads
+NEEDS = {
+    "dependency_graph": ["load"],
+    "metadata": ["load", "dependency_graph"],
+    "enhance": ["load", "dependency_graph", "metadata"],
+    "formula_eval": ["load", "dependency_graph"],
+    "chunk": ["load"],
+}
+
+
+def run_stages(state, stages, measure_memory=False, quiet=True):
+    """
+    Run the stages once; returns {stage: {"seconds", "unit", "units", "peak_mb"}}.
+    With measure_memory, tracemalloc records each stage's peak Python allocations
+    (worker processes of the pipeline stage are not included).
+    """
+    results = {}
+    for name, stage in STAGES:
+        if name not in stages:
+            continue
+        if measure_memory:
+            tracemalloc.start()
+        output = io.StringIO() if quiet else sys.stdout
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(output):
+            unit, units = stage(state)
+        seconds = time.perf_counter() - start
+        peak_mb = None
+        if measure_memory:
+            peak_mb = tracemalloc.get_traced_memory()[1] / 2 ** 20
+            tracemalloc.stop()
+        results[name] = {"seconds": seconds, "unit": unit, "units": units, "peak_mb": peak_mb}
+    return results
+
+
+def benchmark(path, work_dir, stages=None, repeat=3, llm_latency=0.0, quiet=True):
+    """
+    Best-of-repeat time and units per second of each stage, plus peak memory from a
+    separate tracemalloc run (tracing slows allocation-heavy code, so it isn't timed).
+    """
+    stages = set(stages or [name for name, _ in STAGES])
+    stages.update(*(NEEDS.get(name, []) for name in list(stages)))
+    state = {"path": path, "work_dir": work_dir, "llm_latency": llm_latency}
+    table_extraction.executor = ScriptExecutor()
+    try:
+        runs = [run_stages(state, stages, quiet=quiet) for _ in range(repeat)]
+        memory = run_stages(state, stages, measure_memory=True, quiet=quiet)
+    finally:
+        table_extraction.executor.shutdown()
+
+    report = {}
+    for name in runs[0]:
+        best = min(run[name]["seconds"] for run in runs)
+        units = runs[0][name]["units"]
+        report[name] = {
+            "seconds": best,
+            "unit": runs[0][name]["unit"],
+            "units": units,
+            "per_second": units / best if best else None,
+            "peak_mb": memory[name]["peak_mb"],
+        }
+    return report
+
+
+def regressions(report, baseline, max_regression):
+    """Stages whose time or peak memory grew by more than max_regression (0.2 = 20%) over the baseline."""
+    failures = []
+    for name, result in report.items():
+        previous = baseline.get(name)
+        if previous is None:
+            continue
+        for metric in ("seconds", "peak_mb"):
+            if previous.get(metric) and result[metric] is not None and \
+                    result[metric] > previous[metric] * (1 + max_regression):
+                failures.append(f"{name}: {metric} {result[metric]:.4g} vs baseline {previous[metric]:.4g} "
+                                f"({result[metric] / previous[metric] - 1:+.0%}, limit {max_regression:+.0%})")
+    return failures
+
+
+def format_report(report):
+    lines = [f"{'stage':<18}{'seconds':>10}{'units':>10}  {'unit':<9}{'units/s':>12}{'peak MB':>10}"]
+    for name, result in report.items():
+        per_second = f"{result['per_second']:.1f}" if result["per_second"] is not None else "-"
+        lines.append(f"{name:<18}{result['seconds']:>10.4f}{result['units']:>10}  {result['unit']:<9}"
+                     f"{per_second:>12}{result['peak_mb']:>10.1f}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        description="Time the extraction, metadata, formula and LLM pipeline stages on a synthetic workbook.")
+    add_spec_arguments(parser)
+    parser.add_argument("--workbook", default=None, help="Benchmark this .xlsx instead of generating one.")
+    parser.add_argument("--stages", nargs="*", default=None, choices=[name for name, _ in STAGES],
+                        help="Only run these stages (plus the earlier stages they build on).")
+    parser.add_argument("--repeat", type=int, default=3, help="Timed runs per stage; the fastest is reported.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Simulated seconds per fake LLM call.")
+    parser.add_argument("--json", default=None, help="Write the report to this JSON file.")
+    parser.add_argument("--baseline", default=None, help="JSON report of an earlier run to compare against.")
+    parser.add_argument("--max-regression", type=float, default=0.25,
+                        help="Fail when a stage's time or peak memory exceeds the baseline by this fraction.")
+    parser.add_argument("--verbose", action="store_true", help="Show the output of the stages.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        path = args.workbook
+        if path is None:
+            path = os.path.join(work_dir, "synthetic.xlsx")
+            spec = generate_workbook(path, spec_from_args(args))
+            print(f"Generated {spec}")
+        report = benchmark(os.path.abspath(path), work_dir, args.stages, args.repeat, args.llm_latency,
+                           quiet=not args.verbose)
+    print(format_report(report))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline) as f:
+            failures = regressions(report, json.load(f), args.max_regression)
+        for failure in failures:
+            print(f"REGRESSION {failure}")
+        if failures:
+            sys.exit(1)
+        print(f"No stage regressed by more than {args.max_regression:.0%}.")
@@ -0,0 +1,188 @@
+import io
+import os
+import time
+import signal
+import asyncio
+import traceback
+import contextlib
+import multiprocessing
+from dataclasses import dataclass, field
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Not available on Windows; limits are skipped there
+    resource = None
+
+
+GENERATED_FILENAME = "<generated>"
+
+
+@dataclass
+class ExecutionResult:
+    """Outcome of running one generated script in a worker process."""
+
+    ok: bool
+    stdout: str = ""
+    error_type: str = None
+    error_message: str = None
+    traceback: str = None
+    line: int = None
+    timed_out: bool = False
+    duration: float = 0.0
+    files: list = field(default_factory=list)
+
+    def as_feedback(self):
+        """Short error description to send back to the LLM when asking for a fix."""
+        if self.ok:
+            return ""
+        where = f" at line {self.line}" if self.line else ""
+        text = f"{self.error_type}{where}: {self.error_message}"
+        if self.traceback:
+            text += f"\n{self.traceback}"
+        return text
+
+    def __str__(self):
+        if self.ok:
+            return self.stdout or f"OK ({len(self.files)} file(s) written)"
+        return f"Execution Error: {self.as_feedback()}"
+
+
+def _apply_limits(cpu_seconds, memory_mb):
+    if resource is None:
+        return
+    if cpu_seconds:
+        resource.setrlimit(resource.RLIMIT_CPU, (cpu_seconds, cpu_seconds + 1))
+    if memory_mb:
+        limit = memory_mb * 1024 * 1024
+        resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _generated_frames(exc):
+    """Traceback limited to frames from the generated script, plus its last line number."""
+    frames = [frame for frame in traceback.extract_tb(exc.__traceback__) if frame.filename == GENERATED_FILENAME]
+    line = frames[-1].lineno if frames else getattr(exc, "lineno", None)
+    return "".join(traceback.format_list(frames)), line
+
+
+def _worker(conn, code, sheet, sheet_folder, cpu_seconds, memory_mb):
+    """Child process entry point: apply limits, expose the sheet read-only and exec the code."""
+    _apply_limits(cpu_seconds, memory_mb)
+    stdout = io.StringIO()
+    try:
+        import pandas as pd
+
+        namespace = {"__name__": "__generated__", "sheet": sheet, "sheet_folder": sheet_folder}
+        if sheet is not None:
+            sheet_df = pd.DataFrame(list(sheet.iter_rows(max_row=sheet.max_row)))
+            # Label rows and columns with their Excel numbers so sheet_df.loc[row, col] matches the sheet
+            sheet_df.index = range(1, len(sheet_df) + 1)
+            sheet_df.columns = range(1, len(sheet_df.columns) + 1)
+            namespace["sheet_df"] = sheet_df
+        if sheet_folder:
+            from table_store import TableWriter
+
+            namespace["save_table"] = TableWriter(sheet_folder, sheet).save
+        compiled = compile(code, GENERATED_FILENAME, "exec")
+        with contextlib.redirect_stdout(stdout):
+            exec(compiled, namespace)
+        conn.send({"ok": True, "stdout": stdout.getvalue()})
+    except BaseException as e:
+        formatted, line = _generated_frames(e)
+        conn.send({
+            "ok": False,
+            "stdout": stdout.getvalue(),
+            "error_type": type(e).__name__,
+            "error_message": str(e),
+            "traceback": formatted,
+            "line": line,
+        })
+    finally:
+        conn.close()
+
+
+def _folder_state(folder):
+    """Modification time of every file in folder, to spot files a script created or rewrote."""
+    if not folder or not os.path.isdir(folder):
+        return {}
+    return {entry.name: entry.stat().st_mtime_ns for entry in os.scandir(folder) if entry.is_file()}
+
+
+class ScriptExecutor:
+    """
+    Runs LLM-generated extraction scripts in separate processes.
+
+    Each script gets its own process (so a hung or crashing script can be killed
+    without touching the others), with CPU-time and address-space limits and a
+    wall-clock timeout. Instead of a file path the script receives the already
+    loaded SheetGrid as `sheet` and a pandas copy of its values as `sheet_df`, plus
+    `save_table(df, name, source_range)` to store tables in the sheet folder.
+    At most max_workers scripts run at once.
+    """
+
+    def __init__(self, max_workers=None, cpu_seconds=60, memory_mb=2048, wall_timeout=120):
+        self.max_workers = max_workers or os.cpu_count() or 1
+        self.cpu_seconds = cpu_seconds
+        self.memory_mb = memory_mb
+        self.wall_timeout = wall_timeout
+        self._pool = ThreadPoolExecutor(max_workers=self.max_workers)
+        self._context = multiprocessing.get_context("fork" if hasattr(os, "fork") else "spawn")
+
+    def run(self, code, sheet=None, sheet_folder=None):
+        """Run one script and wait for its ExecutionResult."""
+        before = _folder_state(sheet_folder)
+        parent_conn, child_conn = self._context.Pipe(duplex=False)
+        process = self._context.Process(
+            target=_worker,
+            args=(child_conn, code, sheet, sheet_folder, self.cpu_seconds, self.memory_mb),
+            daemon=True,
+        )
+        start = time.perf_counter()
+        process.start()
+        child_conn.close()
+
+        payload = None
+        # poll() is also true on EOF, i.e. when the child died early; only silence means a timeout
+        wall_timeout_hit = not parent_conn.poll(self.wall_timeout)
+        if not wall_timeout_hit:
+            try:
+                payload = parent_conn.recv()
+            except EOFError:
+                # The child died before reporting, e.g. killed by a resource limit; its exit code tells how
+                payload = None
+        if wall_timeout_hit:
+            process.kill()
+        process.join(timeout=5)
+        if process.is_alive():
+            process.kill()
+            process.join()
+        duration = time.perf_counter() - start
+
+        if payload is None:
+            if wall_timeout_hit:
+                error_type, message = "Timeout", f"No result within the {self.wall_timeout}s wall-clock timeout"
+            elif process.exitcode is not None and process.exitcode < 0:
+                signame = signal.Signals(-process.exitcode).name
+                error_type, message = "Crash", f"Process killed by {signame}"
+                if signame == "SIGXCPU":
+                    error_type, message = "Timeout", f"CPU time limit of {self.cpu_seconds}s exceeded"
+            else:
+                error_type, message = "Crash", f"Process exited with code {process.exitcode} without a result"
+            result = ExecutionResult(ok=False, error_type=error_type, error_message=message,
+                                     timed_out=error_type == "Timeout")
+        else:
+            result = ExecutionResult(**payload)
+        result.duration = duration
+        after = _folder_state(sheet_folder)
+        result.files = sorted(name for name, mtime in after.items() if before.get(name) != mtime)
+        return result
+
+    def submit(self, code, sheet=None, sheet_folder=None):
+        """Run a script on the pool; returns a concurrent.futures.Future."""
+        return self._pool.submit(self.run, code, sheet, sheet_folder)
+
+    async def arun(self, code, sheet=None, sheet_folder=None):
+        return await asyncio.wrap_future(self.submit(code, sheet, sheet_folder))
+
+    def shutdown(self):
+        self._pool.shutdown(wait=True)
@@ -0,0 +1,148 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import pandas as pd
+
+from formula_classes import group_formula_classes
+from table_detection import detect_tables
+from table_store import TABLE_SUFFIX, table_columns
+
+
+DEFAULT_STORE_PATH = os.environ.get("CODE_STORE_PATH", ".code_store.sqlite")
+
+
+def _header_text(value):
+    return " ".join(str(value).split()).lower() if isinstance(value, str) else None
+
+
+def sheet_layout(sheet, detection_settings=None):
+    """
+    Structural description of a SheetGrid, independent of its data rows.
+
+    Per detected table: its top-left corner and width (not its height, so a month
+    with more rows keeps the same layout) and the text of its first row. Plus the
+    merged regions and, per relative R1C1 formula, the columns it is used in.
+    """
+    tables = []
+    for start_row, start_col, end_row, end_col in detect_tables(sheet.occupancy(), **(detection_settings or {})):
+        header = next(sheet.iter_rows(min_row=start_row, max_row=start_row, min_col=start_col, max_col=end_col))
+        tables.append([start_row, start_col, end_col, [_header_text(value) for value in header]])
+    formula_classes = sorted([formula_class.r1c1, formula_class.columns()]
+                             for formula_class in group_formula_classes(sheet))
+    return {"tables": tables, "merged": sorted(sheet.merged_ranges), "formula_classes": formula_classes}
+
+
+def sheet_fingerprint(sheet, detection_settings=None):
+    """sha256 of sheet_layout(): sheets with the same fingerprint can share extraction code."""
+    payload = json.dumps(sheet_layout(sheet, detection_settings), sort_keys=True, default=str)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def output_shapes(sheet_folder, files):
+    """Sorted column lists of the tables (Arrow or CSV) a script wrote; the data rows may differ between sheets."""
+    shapes = []
+    for name in files:
+        path = os.path.join(sheet_folder, name)
+        if not name.endswith((TABLE_SUFFIX, ".csv")) or not os.path.isfile(path):
+            continue
+        try:
+            if name.endswith(TABLE_SUFFIX):
+                columns = table_columns(path)
+            else:
+                columns = pd.read_csv(path, nrows=0).columns.tolist()
+        except (pd.errors.EmptyDataError, pd.errors.ParserError, UnicodeDecodeError, OSError, ValueError):
+            columns = []
+        shapes.append([str(column) for column in columns])
+    return sorted(shapes)
+
+
+class StoredCode:
+    def __init__(self, fingerprint, code, sheet_folder, shapes):
+        self.fingerprint = fingerprint
+        self.code = code
+        self.sheet_folder = sheet_folder
+        self.shapes = shapes
+
+    def adapt(self, sheet_folder):
+        """The stored code with its original output folder replaced by sheet_folder."""
+        return self.code.replace(self.sheet_folder, sheet_folder) if self.sheet_folder else self.code
+
+    def matches(self, shapes):
+        """True when a reused run wrote the same number of tables with the same columns."""
+        return bool(shapes) and shapes == self.shapes
+
+
+class CodeStore:
+    """
+    Persistent SQLite store of extraction code that ran successfully, keyed by sheet_fingerprint().
+
+    Each entry keeps the code, the folder it wrote to (so it can be pointed at another
+    sheet's folder) and the output_shapes() it produced, used to validate reuse.
+    """
+
+    def __init__(self, path=DEFAULT_STORE_PATH):
+        self.path = path
+        self.hits = 0
+        self.misses = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS layouts (
+                fingerprint TEXT PRIMARY KEY,
+                code TEXT NOT NULL,
+                sheet_folder TEXT,
+                shapes TEXT NOT NULL,
+                sheet_name TEXT,
+                created REAL NOT NULL,
+                uses INTEGER NOT NULL DEFAULT 0
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, fingerprint):
+        """Return the StoredCode for a fingerprint, or None."""
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT code, sheet_folder, shapes FROM layouts WHERE fingerprint = ?", (fingerprint,)
+            ).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        return StoredCode(fingerprint, row[0], row[1], json.loads(row[2]))
+
+    def put(self, fingerprint, code, sheet_folder, shapes, sheet_name=None):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO layouts (fingerprint, code, sheet_folder, shapes, sheet_name, created) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (fingerprint, code, sheet_folder, json.dumps(shapes), sheet_name, time.time()),
+            )
+            self._conn.commit()
+
+    def record_use(self, fingerprint):
+        self.hits += 1
+        with self._lock:
+            self._conn.execute("UPDATE layouts SET uses = uses + 1 WHERE fingerprint = ?", (fingerprint,))
+            self._conn.commit()
+
+    def reject(self, fingerprint):
+        """Drop an entry whose code no longer reproduces its expected output."""
+        self.rejected += 1
+        with self._lock:
+            self._conn.execute("DELETE FROM layouts WHERE fingerprint = ?", (fingerprint,))
+            self._conn.commit()
+
+    def stats(self):
+        with self._lock:
+            entries = self._conn.execute("SELECT COUNT(*) FROM layouts").fetchone()[0]
+        return {"reused": self.hits, "misses": self.misses, "rejected": self.rejected, "entries": entries}
+
+    def close(self):
+        self._conn.close()
@@ -0,0 +1,124 @@
+import re
+from bisect import bisect_left, bisect_right
+from collections import namedtuple
+
+from openpyxl.utils import column_index_from_string
+
+
+MAX_ROW = 1048576
+MAX_COL = 16384
+
+# A rectangular reference resolved to its sheet; single cells have min == max
+Reference = namedtuple("Reference", ["sheet", "min_row", "min_col", "max_row", "max_col"])
+
+REFERENCE_PATTERN = re.compile(
+    r"^\$?(?P<c1>[A-Z]{1,3})?\$?(?P<r1>\d+)?(?::\$?(?P<c2>[A-Z]{1,3})?\$?(?P<r2>\d+)?)?$"
+)
+
+
+def parse_reference(reference):
+    """
+    Parse an A1-style reference into (min_row, min_col, max_row, max_col).
+
+    Handles single cells ('B7', '$B$7'), ranges ('A2:A500'), full columns ('A:C')
+    and full rows ('2:5'). Returns None if the text is not a reference.
+    """
+    match = REFERENCE_PATTERN.match(reference.upper())
+    if not match or not (match.group("c1") or match.group("r1")):
+        return None
+    c1, r1, c2, r2 = match.group("c1", "r1", "c2", "r2")
+    if ":" not in reference:
+        if not (c1 and r1):
+            return None
+        c2, r2 = c1, r1
+    # A column without a row (or vice versa) spans the whole sheet in that direction
+    if bool(c1) != bool(c2) or bool(r1) != bool(r2):
+        return None
+    min_col = column_index_from_string(c1) if c1 else 1
+    max_col = column_index_from_string(c2) if c2 else MAX_COL
+    min_row = int(r1) if r1 else 1
+    max_row = int(r2) if r2 else MAX_ROW
+    return min(min_row, max_row), min(min_col, max_col), max(min_row, max_row), max(min_col, max_col)
+
+
+class ColumnIndex:
+    """
+    Interval index answering "which column name covers this cell".
+
+    For every (sheet, column) the row spans of the tables covering that column are kept
+    as sorted start/end lists, so a cell lookup is a binary search rather than a
+    per-cell dictionary entry.
+    """
+
+    def __init__(self):
+        self._columns = {}
+        self._max_col = {}
+
+    @classmethod
+    def from_tables(cls, tables_with_metadata):
+        """Build the index from the output of extract_tables_with_column_names_and_dependencies."""
+        index = cls()
+        for sheet_name, tables in tables_with_metadata.items():
+            for table in tables:
+                coords = table["Coordinates"]
+                for col_idx, meta in enumerate(table["Metadata"], start=coords["StartCol"]):
+                    index.add(sheet_name, col_idx, coords["StartRow"], coords["EndRow"], meta["ColumnName"])
+        index.finalize()
+        return index
+
+    def add(self, sheet_name, col_idx, start_row, end_row, column_name):
+        self._columns.setdefault((sheet_name, col_idx), []).append((start_row, end_row, column_name))
+
+    def finalize(self):
+        """Sort intervals so lookups can binary search; call after the last add()."""
+        for key, intervals in self._columns.items():
+            sheet_name, col_idx = key
+            self._max_col[sheet_name] = max(self._max_col.get(sheet_name, 0), col_idx)
+            if isinstance(intervals, list):
+                intervals.sort(key=lambda interval: interval[0])
+                self._columns[key] = (
+                    [start for start, _, _ in intervals],
+                    [end for _, end, _ in intervals],
+                    [name for _, _, name in intervals],
+                )
+
+    def lookup(self, sheet_name, row, col, default="Unknown"):
+        """Column name covering a single cell."""
+        entry = self._columns.get((sheet_name, col))
+        if entry is None:
+            return default
+        starts, ends, names = entry
+        i = bisect_right(starts, row) - 1
+        if i >= 0 and ends[i] >= row:
+            return names[i]
+        return default
+
+    def lookup_range(self, sheet_name, min_row, min_col, max_row, max_col):
+        """Distinct column names covering any cell of a rectangular range, in column order."""
+        found = []
+        for col_idx in range(min_col, min(max_col, self._max_col.get(sheet_name, 0)) + 1):
+            entry = self._columns.get((sheet_name, col_idx))
+            if entry is None:
+                continue
+            starts, ends, names = entry
+            # Intervals don't overlap, so ends are sorted as well
+            for i in range(bisect_left(ends, min_row), bisect_right(starts, max_row)):
+                if names[i] not in found:
+                    found.append(names[i])
+        return found
+
+    def resolve(self, sheet_name, reference):
+        """Column names for a reference such as 'B7', 'A2:A500' or 'A:A'."""
+        bounds = parse_reference(reference)
+        if bounds is None:
+            return []
+        min_row, min_col, max_row, max_col = bounds
+        if min_row == max_row and min_col == max_col:
+            name = self.lookup(sheet_name, min_row, min_col, default=None)
+            return [] if name is None else [name]
+        return self.lookup_range(sheet_name, min_row, min_col, max_row, max_col)
+
+
+def build_column_index(tables_with_metadata):
+    """Create a per-sheet interval index of cells to column names."""
+    return ColumnIndex.from_tables(tables_with_metadata)
@@ -0,0 +1,115 @@
+import re
+import json
+import time
+import asyncio
+import hashlib
+import threading
+
+
+class FakeRateLimitError(Exception):
+    """Raised by FakeLLM to mimic an HTTP 429 from the API."""
+
+    status_code = 429
+
+
+class FakeMessage:
+    def __init__(self, content):
+        self.content = content
+
+
+def _fake_analysis(text):
+    text = text.lower()
+    is_inventory = int("sku" in text and any(word in text for word in ("qty", "quantity", "on hand", "stock")))
+    return {
+        "is_inventory_planning": is_inventory,
+        "details": {
+            "SKU": "SKU" if is_inventory else None,
+            "Location/Warehouse": None,
+            "Quantity": None,
+            "Total Inventory": None,
+            "Current Inventory": None,
+            "Sales Forecast": None,
+        },
+        "description": "Fake analysis generated offline.",
+    }
+
+
+def default_responder(prompt):
+    """
+    Deterministic answers for the prompts used by the scripts: a JSON analysis for
+    table analysis prompts (one per "Table N:" preview for batched prompts) and, for
+    code generation prompts, a script saving every table range listed in the outline.
+    """
+    if '"results"' in prompt and '"is_inventory_planning"' in prompt:
+        sections = re.split(r"^\s*Table (\d+):\s*$", prompt.split("Task, for EVERY table")[0], flags=re.M)
+        return json.dumps({"results": [
+            {"table_id": int(table_id), **_fake_analysis(preview)}
+            for table_id, preview in zip(sections[1::2], sections[2::2])
+        ]})
+    if '"is_inventory_planning"' in prompt:
+        return json.dumps(_fake_analysis(prompt))
+    if "Python code" in prompt:
+        return f"```python\n{_fake_extraction_code(prompt)}\n```"
+    return "ok"
+
+
+TABLE_RANGE = re.compile(r"^\s*Table (\d+): ([A-Z]{1,3}\d+:[A-Z]{1,3}\d+) \(", re.M)
+
+
+def _fake_extraction_code(prompt):
+    """Extraction script saving every table range listed in the sheet outline, header row first."""
+    ranges = TABLE_RANGE.findall(prompt)
+    if not ranges:
+        digest = hashlib.sha256(prompt.encode("utf-8")).hexdigest()[:8]
+        return f"print('fake extraction {digest}')"
+    return "\n".join([
+        "from openpyxl.utils.cell import range_boundaries",
+        f"for number, source_range in {[(int(number), ref) for number, ref in ranges]!r}:",
+        "    min_col, min_row, max_col, max_row = range_boundaries(source_range)",
+        "    block = sheet_df.loc[min_row:max_row, min_col:max_col]",
+        "    table = block.iloc[1:].reset_index(drop=True)",
+        "    table.columns = [str(value) for value in block.iloc[0].tolist()]",
+        "    save_table(table, f'table_{number}', source_range)",
+    ])
+
+
+class FakeLLM:
+    """
+    Offline stand-in for ChatOpenAI with configurable latency.
+
+    Exposes invoke(), predict() and ainvoke(). Every rate_limit_every-th call raises
+    FakeRateLimitError so retry/backoff paths can be exercised without the network.
+    """
+
+    def __init__(self, responder=None, latency=0.0, rate_limit_every=0, model_name="fake-llm", temperature=0):
+        self.responder = responder or default_responder
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.model_name = model_name
+        self.temperature = temperature
+        self.calls = 0
+        self.prompts = []
+        self._lock = threading.Lock()
+
+    def _respond(self, prompt):
+        with self._lock:
+            self.calls += 1
+            calls = self.calls
+            self.prompts.append(prompt)
+        if self.rate_limit_every and calls % self.rate_limit_every == 0:
+            raise FakeRateLimitError("Error code: 429 - rate limit exceeded")
+        return FakeMessage(self.responder(prompt))
+
+    def invoke(self, prompt):
+        if self.latency:
+            time.sleep(self.latency)
+        return self._respond(prompt)
+
+    def predict(self, prompt):
+        return self.invoke(prompt).content
+
+    async def ainvoke(self, prompt):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return self._respond(prompt)
+
@@ -0,0 +1,217 @@
+import re
+
+import numpy as np
+from openpyxl.utils import column_index_from_string
+
+from column_index import MAX_COL, MAX_ROW, Reference, parse_reference
+
+
+CELL_PART = re.compile(r"(\$?)([A-Z]{1,3})?(\$?)(\d+)?")
+
+# String literals and sheet prefixes are matched first so refs inside them are left alone
+A1_TOKEN = re.compile(
+    r'(?P<string>"(?:[^"]|"")*")'
+    r"|(?P<prefix>(?:'(?:[^']|'')+'|\[[^\]]*\][\w.]*|[A-Za-z_][\w.]*(?::[A-Za-z_][\w.]*)?)!)?"
+    r"(?<![\w.$])(?P<ref>\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?"
+    r"|\$?[A-Z]{1,3}:\$?[A-Z]{1,3}|\$?\d+:\$?\d+)(?![\w(!.])"
+)
+
+
+def _r1c1_part(letter, value, absolute, origin):
+    if absolute:
+        return f"{letter}{value}"
+    offset = value - origin
+    return letter if offset == 0 else f"{letter}[{offset}]"
+
+
+def _convert_cell(part, row, col):
+    """Convert one side of an A1 reference; returns (r1c1_text, spec) where spec holds (value, absolute) pairs."""
+    col_abs, col_letters, row_abs, row_digits = CELL_PART.fullmatch(part).groups()
+    text, spec = "", [None, True, None, True]
+    if row_digits:
+        value = int(row_digits)
+        text += _r1c1_part("R", value, bool(row_abs), row)
+        spec[0:2] = [value if row_abs else value - row, bool(row_abs)]
+    if col_letters:
+        value = column_index_from_string(col_letters)
+        text += _r1c1_part("C", value, bool(col_abs), col)
+        spec[2:4] = [value if col_abs else value - col, bool(col_abs)]
+    return text, spec
+
+
+def reference_specs(reference, row, col):
+    """
+    (start, end) specs of an A1 reference ('B7', '$A$2:A9', 'A:C') seen from (row, col),
+    in the same form as FormulaTemplate.refs; None if the text is not an A1 reference.
+    """
+    if parse_reference(reference) is None:
+        return None
+    specs = [_convert_cell(part, row, col)[1] for part in reference.upper().split(":")]
+    return specs[0], specs[-1]
+
+
+class FormulaTemplate:
+    """
+    Position-independent form of a formula.
+
+    Holds the relative R1C1 text plus, for every A1 reference, its sheet prefix and
+    row/column values flagged as absolute or as offsets from the formula cell, so the
+    references of any cell in a formula class can be computed without re-parsing.
+    """
+
+    def __init__(self, r1c1, refs, opaque):
+        self.r1c1 = r1c1
+        self.refs = refs
+        # 3D refs can't be expressed as a single-sheet Reference, so callers fall back to a full parse
+        self.opaque = opaque
+
+    def references(self, row, col, current_sheet):
+        """References read by this formula when it sits at (row, col) of current_sheet."""
+        resolved = []
+        for sheet, (start, end) in self.refs:
+            bounds = []
+            for value, absolute, origin, full in (
+                (start[0], start[1], row, 1), (start[2], start[3], col, 1),
+                (end[0], end[1], row, MAX_ROW), (end[2], end[3], col, MAX_COL),
+            ):
+                bounds.append(full if value is None else value if absolute else origin + value)
+            min_row, min_col, max_row, max_col = bounds
+            resolved.append(Reference(sheet or current_sheet, min(min_row, max_row), min(min_col, max_col),
+                                      max(min_row, max_row), max(min_col, max_col)))
+        return resolved
+
+
+def formula_template(formula, row, col):
+    """Convert an A1 formula at (row, col) into a FormulaTemplate with relative R1C1 text."""
+    refs, opaque = [], False
+
+    def replace(match):
+        nonlocal opaque
+        if match.group("string"):
+            return match.group(0)
+        prefix = match.group("prefix") or ""
+        sheet = None
+        if prefix:
+            sheet = prefix[:-1]
+            if sheet.startswith("'"):
+                sheet = sheet[1:-1].replace("''", "'")
+            elif ":" in sheet:
+                opaque = True
+        parts = match.group("ref").split(":")
+        converted = [_convert_cell(part, row, col) for part in parts]
+        if len(converted) == 1:
+            converted.append(converted[0])
+        if not (sheet and sheet.startswith("[")):
+            refs.append((sheet, (converted[0][1], converted[1][1])))
+        return prefix + ":".join(text for text, _ in converted[:len(parts)])
+
+    return FormulaTemplate(A1_TOKEN.sub(replace, formula), refs, opaque)
+
+
+def to_r1c1(formula, row, col):
+    """Relative R1C1 text of an A1 formula at (row, col), e.g. '=B5-C5' at C5 -> '=RC[-1]-RC'."""
+    return formula_template(formula, row, col).r1c1
+
+
+class FormulaClass:
+    """
+    A group of cells sharing one relative R1C1 formula.
+
+    runs lists (col, start_row, end_row) stretches of consecutive rows covered by the
+    class; exceptions lists (row, col, content) cells sitting between two runs of the
+    same column that hold a different formula or a hard-coded value.
+    """
+
+    def __init__(self, sheet, template, formula, anchor, rows, cols):
+        self.sheet = sheet
+        self.template = template
+        self.r1c1 = template.r1c1
+        self.formula = formula
+        self.anchor = anchor
+        self.cell_count = len(rows)
+        self.runs = _row_runs(rows, cols)
+        self.exceptions = []
+
+    def columns(self):
+        return sorted({col for col, _, _ in self.runs})
+
+    def to_dict(self, min_row=1, min_col=1, max_row=MAX_ROW, max_col=MAX_COL):
+        """Metadata for the part of the class inside a rectangle, or None if it has no cells there."""
+        runs = [
+            (col, max(start, min_row), min(end, max_row))
+            for col, start, end in self.runs
+            if min_col <= col <= max_col and start <= max_row and end >= min_row
+        ]
+        if not runs:
+            return None
+        return {
+            "R1C1": self.r1c1,
+            "Formula": self.formula,
+            "Anchor": self.anchor,
+            "Cells": sum(end - start + 1 for _, start, end in runs),
+            "Runs": runs,
+            "Exceptions": [
+                exception for exception in self.exceptions
+                if min_row <= exception[0] <= max_row and min_col <= exception[1] <= max_col
+            ],
+        }
+
+
+def _row_runs(rows, cols):
+    """Split cells into (col, start_row, end_row) runs of consecutive rows."""
+    order = np.lexsort((rows, cols))
+    rows, cols = rows[order], cols[order]
+    breaks = np.flatnonzero((np.diff(rows) != 1) | (np.diff(cols) != 0)) + 1
+    starts = np.concatenate(([0], breaks))
+    ends = np.concatenate((breaks - 1, [len(rows) - 1]))
+    return [(int(cols[s]), int(rows[s]), int(rows[e])) for s, e in zip(starts, ends)]
+
+
+def group_formula_classes(sheet, min_row=1, min_col=1, max_row=None, max_col=None):
+    """
+    Group the formula cells of a SheetGrid rectangle into FormulaClass objects.
+
+    Each distinct relative formula is kept once, with the row runs it covers and the
+    cells that break it partway down a column.
+    """
+    rows, cols, formula_ids = sheet.cells_in(min_row, min_col, max_row, max_col)
+    is_formula = formula_ids >= 0
+    f_rows, f_cols, f_ids = rows[is_formula], cols[is_formula], formula_ids[is_formula]
+
+    templates, class_keys = {}, np.empty(len(f_rows), dtype=np.int64)
+    for i, (row, col, formula_id) in enumerate(zip(f_rows.tolist(), f_cols.tolist(), f_ids.tolist())):
+        template = formula_template(sheet.formulas[formula_id], row, col)
+        if template.r1c1 not in templates:
+            templates[template.r1c1] = (len(templates), template, sheet.formulas[formula_id], (row, col))
+        class_keys[i] = templates[template.r1c1][0]
+
+    # Cells of each column sorted by row, for finding what sits between two runs of a class
+    order = np.lexsort((rows, cols))
+    s_rows, s_cols, s_ids = rows[order], cols[order], formula_ids[order]
+
+    by_class = np.argsort(class_keys, kind="stable")
+    bounds = np.searchsorted(class_keys[by_class], np.arange(len(templates) + 1))
+
+    classes = []
+    for key, template, formula, anchor in templates.values():
+        members = by_class[bounds[key]:bounds[key + 1]]
+        formula_class = FormulaClass(sheet.title, template, formula, anchor, f_rows[members], f_cols[members])
+        for (col, _, prev_end), (next_col, next_start, _) in zip(formula_class.runs, formula_class.runs[1:]):
+            if col != next_col:
+                continue
+            col_lo = np.searchsorted(s_cols, col, side="left")
+            col_hi = np.searchsorted(s_cols, col, side="right")
+            col_rows = s_rows[col_lo:col_hi]
+            lo = col_lo + np.searchsorted(col_rows, prev_end, side="right")
+            hi = col_lo + np.searchsorted(col_rows, next_start, side="left")
+            formula_class.exceptions.extend(
+                _exception(sheet, s_rows[i], col, s_ids[i]) for i in range(lo, hi)
+            )
+        classes.append(formula_class)
+    return classes
+
+
+def _exception(sheet, row, col, formula_id):
+    row, col = int(row), int(col)
+    content = sheet.formulas[formula_id] if formula_id >= 0 else sheet.value(row, col)
+    return (row, col, content)
@@ -0,0 +1,1020 @@
+import re
+import argparse
+from collections import Counter, deque
+from dataclasses import dataclass, field
+
+import numpy as np
+import pandas as pd
+from openpyxl.formula.tokenizer import Token
+from openpyxl.utils import get_column_letter
+
+from column_index import MAX_COL, MAX_ROW
+from formula_classes import group_formula_classes, reference_specs
+from formula_graph import split_sheet_prefix, tokenize_formula
+from workbook_grid import EMPTY, STRING, ERROR, load_workbook_grid
+
+
+# Value kinds held by SheetValues; numeric cell types (numbers, booleans, dates) are all NUM
+NUM, TEXT, ERR = 1, 2, 3
+
+# Binary operator precedence, lowest first; every level is left-associative as in Excel
+PRECEDENCE = {"=": 1, "<>": 1, "<": 1, ">": 1, "<=": 1, ">=": 1, "&": 2, "+": 3, "-": 3, "*": 4, "/": 4, "^": 5}
+CRITERIA_OPERATOR = re.compile(r"^(<=|>=|<>|<|>|=)?(.*)$", re.S)
+
+# Absolute and relative tolerance when comparing a computed number with the cached one
+ATOL = 1e-6
+RTOL = 1e-9
+
+
+class Unsupported(Exception):
+    """The formula uses something the evaluator does not implement; its cached values are kept."""
+
+
+class _PerCell(Exception):
+    """Raised when a range moves with the formula cell in a way that can't be vectorized."""
+
+
+def _text_literal(value):
+    return np.array(value, dtype=object)
+
+
+def _to_float(value):
+    if isinstance(value, str):
+        try:
+            return float(value)
+        except ValueError:
+            return np.nan
+    return np.nan if value is None else float(value)
+
+
+def _num(values):
+    """Numeric view of evaluated values; text that is not a number becomes NaN (#VALUE!)."""
+    values = np.asarray(values)
+    if values.dtype != object:
+        return values.astype(float)
+    return np.array([_to_float(v) for v in values.ravel()], dtype=float).reshape(values.shape)
+
+
+def _clean(numbers):
+    """Division by zero and overflow are errors in Excel, held here as NaN."""
+    return np.where(np.isfinite(numbers), numbers, np.nan)
+
+
+def _to_text(value):
+    if isinstance(value, str):
+        return value
+    if value != value:
+        return None
+    return str(int(value)) if float(value).is_integer() else f"{value:.15g}"
+
+
+def _as_values(values):
+    """Values as an array; text stays in an object array (numpy would make a fixed-width string array)."""
+    values = np.asarray(values)
+    return values.astype(object) if values.dtype.kind in "US" else values
+
+
+def _compare_key(value):
+    # Excel orders numbers before text; text compares case-insensitively
+    return (1, value.casefold()) if isinstance(value, str) else (0, float(value))
+
+
+def _compare_values(op, a, b):
+    if not isinstance(a, str) and a != a or not isinstance(b, str) and b != b:
+        return np.nan
+    a, b = _compare_key(a), _compare_key(b)
+    return float({"=": a == b, "<>": a != b, "<": a < b, ">": a > b, "<=": a <= b, ">=": a >= b}[op])
+
+
+def _compare(op, left, right):
+    left, right = np.asarray(left), np.asarray(right)
+    if left.dtype != object and right.dtype != object:
+        left, right = left.astype(float), right.astype(float)
+        result = {"=": np.equal, "<>": np.not_equal, "<": np.less, ">": np.greater,
+                  "<=": np.less_equal, ">=": np.greater_equal}[op](left, right).astype(float)
+        return np.where(np.isnan(left) | np.isnan(right), np.nan, result)
+    compare = np.frompyfunc(lambda a, b: _compare_values(op, a, b), 2, 1)
+    return compare(left, right).astype(float)
+
+
+def _concat(left, right):
+    def join(a, b):
+        a, b = _to_text(a), _to_text(b)
+        return np.nan if a is None or b is None else a + b
+    joined = np.frompyfunc(join, 2, 1)(np.asarray(left, dtype=object), np.asarray(right, dtype=object))
+    # On scalar operands frompyfunc returns a bare str, not an array
+    return np.asarray(joined, dtype=object)
+
+
+def _round(numbers, digits):
+    # Excel rounds halves away from zero
+    scale = 10.0 ** np.trunc(digits)
+    return np.sign(numbers) * np.floor(np.abs(numbers) * scale + 0.5) / scale
+
+
+def _lookup_key(value):
+    """Key under which a value matches in exact lookups and criteria: numbers by value, text case-insensitively."""
+    if isinstance(value, str):
+        return value.casefold()
+    return None if value != value else float(value)
+
+
+class SheetValues:
+    """
+    Dense, mutable value grid of one sheet used while evaluating.
+
+    Starts from the cached values of the SheetGrid; formula cells are overwritten
+    with computed values as their classes are evaluated. Summed-area tables for
+    moving SUM/COUNT/AVERAGE ranges are built on demand and dropped on every write.
+    """
+
+    def __init__(self, sheet):
+        self.name = sheet.title
+        types, self.numbers, self.texts = sheet.dense_values()
+        self.kinds = np.zeros(types.shape, dtype=np.int8)
+        self.kinds[~np.isnan(self.numbers)] = NUM
+        self.kinds[types == STRING] = TEXT
+        self.kinds[types == ERROR] = ERR
+        self.n_rows, self.n_cols = types.shape
+        self._prefix = None
+
+    def gather(self, rows, cols):
+        """Values at (rows, cols): float where every cell is numeric or empty (as 0), object if text is present."""
+        rows, cols = np.broadcast_arrays(np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64))
+        inside = (rows >= 1) & (rows <= self.n_rows) & (cols >= 1) & (cols <= self.n_cols)
+        if not inside.any():
+            return np.zeros(rows.shape)
+        r, c = np.where(inside, rows - 1, 0), np.where(inside, cols - 1, 0)
+        kinds = np.where(inside, self.kinds[r, c], EMPTY)
+        values = np.where(kinds == NUM, self.numbers[r, c], np.where(kinds == EMPTY, 0.0, np.nan))
+        text = kinds == TEXT
+        if text.any():
+            values = values.astype(object)
+            values[text] = np.asarray(self.texts[r, c], dtype=object)[text]
+        return values
+
+    def raw(self, rows, cols):
+        """(kinds, numbers, texts) at in-sheet positions, without the empty-as-zero conversion."""
+        r, c = rows - 1, cols - 1
+        return self.kinds[r, c], self.numbers[r, c], self.texts[r, c]
+
+    def block(self, min_row, min_col, max_row, max_col):
+        """(kinds, numbers, texts) of a rectangle clipped to the sheet."""
+        max_row, max_col = min(max_row, self.n_rows), min(max_col, self.n_cols)
+        rows, cols = slice(min_row - 1, max(max_row, min_row - 1)), slice(min_col - 1, max(max_col, min_col - 1))
+        return self.kinds[rows, cols], self.numbers[rows, cols], self.texts[rows, cols]
+
+    def write(self, rows, cols, values):
+        r, c = rows - 1, cols - 1
+        values = np.asarray(values)
+        if values.dtype != object:
+            self.numbers[r, c] = values
+            self.kinds[r, c] = np.where(np.isnan(values), ERR, NUM)
+            self.texts[r, c] = None
+        else:
+            for i, j, value in zip(r.tolist(), c.tolist(), values.tolist()):
+                if isinstance(value, str):
+                    self.kinds[i, j], self.numbers[i, j], self.texts[i, j] = TEXT, np.nan, value
+                else:
+                    value = float(value)
+                    self.kinds[i, j], self.numbers[i, j], self.texts[i, j] = (ERR if value != value else NUM), value, None
+        self._prefix = None
+
+    def prefix_sums(self):
+        """Padded summed-area tables of the numeric cells' values and of their count."""
+        if self._prefix is None:
+            numeric = self.kinds == NUM
+            totals = np.zeros((self.n_rows + 1, self.n_cols + 1))
+            counts = np.zeros((self.n_rows + 1, self.n_cols + 1))
+            totals[1:, 1:] = np.where(numeric, self.numbers, 0.0).cumsum(0).cumsum(1)
+            counts[1:, 1:] = numeric.cumsum(0).cumsum(1)
+            self._prefix = totals, counts
+        return self._prefix
+
+
+class RangeArg:
+    """A reference as seen from every cell of a class; bounds are scalars or per-cell arrays."""
+
+    def __init__(self, store, min_row, min_col, max_row, max_col):
+        self.store = store
+        self.bounds = [np.asarray(b, dtype=np.int64) for b in (min_row, min_col, max_row, max_col)]
+
+    def is_cell(self):
+        min_row, min_col, max_row, max_col = self.bounds
+        return bool(np.all(min_row == max_row) and np.all(min_col == max_col))
+
+    def static(self):
+        """(min_row, min_col, max_row, max_col) when every cell reads the same rectangle, else None."""
+        flat = [b.ravel() for b in self.bounds]
+        if any(len(b) and (b != b[0]).any() for b in flat):
+            return None
+        return tuple(int(b[0]) if len(b) else 0 for b in flat)
+
+    def require_static(self):
+        bounds = self.static()
+        if bounds is None:
+            raise _PerCell()
+        return bounds
+
+    def values(self):
+        if not self.is_cell():
+            raise Unsupported("range used as a single value")
+        return self.store.gather(self.bounds[0], self.bounds[1])
+
+    def block(self):
+        return self.store.block(*self.require_static())
+
+    def lookup_keys(self):
+        """Flattened exact-match keys of a static range (None for empty or error cells)."""
+        kinds, numbers, texts = self.block()
+        keys = np.empty(kinds.size, dtype=object)
+        kinds, numbers, texts = kinds.ravel(), numbers.ravel(), texts.ravel()
+        numeric, text = kinds == NUM, kinds == TEXT
+        keys[numeric] = numbers[numeric].tolist()
+        keys[text] = [t.casefold() for t in texts[text]]
+        keys[kinds == EMPTY] = ""
+        return keys
+
+
+def _criterion(value):
+    """Split a SUMIF-style criterion into (operator, operand, wildcard pattern or None)."""
+    if not isinstance(value, str):
+        return "=", _lookup_key(value), None
+    op, operand = CRITERIA_OPERATOR.match(value).groups()
+    op = op or "="
+    try:
+        return op, float(operand), None
+    except ValueError:
+        pass
+    operand = operand.casefold()
+    if op in ("=", "<>") and re.search(r"(?<!~)[*?]", operand):
+        pattern = "".join(
+            ".*" if part == "*" else "." if part == "?" else re.escape(part[1:] if part.startswith("~") else part)
+            for part in re.findall(r"~.|\*|\?|[^*?~]+|~", operand)
+        )
+        return op, operand, re.compile(pattern, re.S)
+    return op, operand, None
+
+
+def _criterion_mask(store_block, criterion):
+    kinds, numbers, texts = (a.ravel() for a in store_block)
+    op, operand, pattern = criterion
+    if pattern is not None:
+        matched = np.array([t is not None and bool(pattern.fullmatch(t.casefold())) for t in texts], dtype=bool)
+        matched &= kinds == TEXT
+    elif isinstance(operand, float):
+        numeric = kinds == NUM
+        with np.errstate(invalid="ignore"):
+            compared = {"=": np.equal, "<>": np.not_equal, "<": np.less, ">": np.greater,
+                        "<=": np.less_equal, ">=": np.greater_equal}[op](numbers, operand)
+        matched = numeric & compared
+        if op == "<>":
+            matched |= ~numeric
+        return matched
+    else:
+        text = kinds == TEXT
+        folded = np.array([t.casefold() if k == TEXT else "" for t, k in zip(texts, kinds)], dtype=object)
+        if op in ("=", "<>"):
+            equal = (folded == operand) & (text | (kinds == EMPTY))
+            matched = equal if op == "=" else ~equal
+        else:
+            matched = text & np.array([_compare_values(op, t, operand) == 1.0 for t in folded], dtype=bool)
+        return matched
+    return matched if op == "=" else ~matched
+
+
+class FormulaEvaluator:
+    """
+    Vectorized evaluator for the formula classes of a WorkbookGrid.
+
+    Each FormulaClass is parsed once at its anchor and evaluated as one NumPy
+    expression over all of its cells: relative references become per-cell row and
+    column arrays, fixed ranges are aggregated or indexed once and broadcast.
+    Classes run in dependency order (a class reading another class's cells runs
+    after it); classes that read their own cells, such as running balances, are
+    evaluated cell by cell in row order. Computed values are written back into the
+    per-sheet value grids, so downstream classes read computed rather than cached
+    values, and each class is compared with its cached values.
+    """
+
+    def __init__(self, workbook, sheet_names=None, formula_classes=None, max_mismatches=20):
+        self.workbook = workbook
+        self.sheet_names = list(sheet_names or workbook.sheetnames)
+        self.defined_names = workbook.defined_names
+        self.max_mismatches = max_mismatches
+        self.stores = {name: SheetValues(workbook[name]) for name in self.sheet_names}
+        self.formula_classes = formula_classes or {name: group_formula_classes(workbook[name])
+                                                   for name in self.sheet_names}
+        self._sheet = None
+        self._rows = self._cols = None
+
+    # Parsing -----------------------------------------------------------------
+
+    def parse(self, formula, row, col):
+        """Expression tree of an A1 formula as seen from (row, col); raises Unsupported."""
+        tokens = [t for t in tokenize_formula(formula) if t.type != Token.WSPACE]
+        if not tokens:
+            raise Unsupported("unparsable formula")
+        self._tokens, self._pos, self._anchor = tokens, 0, (row, col)
+        tree = self._expression(0)
+        if self._pos != len(tokens):
+            raise Unsupported(f"unexpected {tokens[self._pos].value!r}")
+        return tree
+
+    def _peek(self):
+        return self._tokens[self._pos] if self._pos < len(self._tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise Unsupported("formula ends early")
+        self._pos += 1
+        return token
+
+    def _expression(self, min_precedence):
+        left = self._unary()
+        while (token := self._peek()) is not None and token.type == Token.OP_IN:
+            if token.value not in PRECEDENCE:
+                raise Unsupported(f"operator {token.value!r}")
+            precedence = PRECEDENCE[token.value]
+            if precedence < min_precedence:
+                break
+            self._pos += 1
+            left = ("op", token.value, left, self._expression(precedence + 1))
+        return left
+
+    def _unary(self):
+        token = self._peek()
+        if token is not None and token.type == Token.OP_PRE:
+            self._pos += 1
+            operand = self._unary()
+            return ("neg", operand) if token.value == "-" else operand
+        node = self._primary()
+        while (token := self._peek()) is not None and token.type == Token.OP_POST:
+            self._pos += 1
+            node = ("pct", node)
+        return node
+
+    def _primary(self):
+        token = self._next()
+        if token.type == Token.OPERAND:
+            return self._operand(token)
+        if token.type == Token.FUNC and token.subtype == Token.OPEN:
+            name = token.value[:-1].upper()
+            for prefix in ("_XLFN.", "_XLWS."):
+                name = name.removeprefix(prefix)
+            if name not in FUNCTIONS:
+                raise Unsupported(f"function {name}")
+            args = []
+            if self._peek() is not None and self._peek().type == Token.FUNC and self._peek().subtype == Token.CLOSE:
+                self._pos += 1
+                return ("func", name, args)
+            while True:
+                token = self._peek()
+                if token is not None and token.type in (Token.SEP, Token.FUNC) and token.subtype in (Token.ARG, Token.CLOSE):
+                    args.append(("missing",))
+                else:
+                    args.append(self._expression(0))
+                token = self._next()
+                if token.type == Token.SEP and token.subtype == Token.ARG:
+                    continue
+                if token.type == Token.FUNC and token.subtype == Token.CLOSE:
+                    return ("func", name, args)
+                raise Unsupported(f"unexpected {token.value!r}")
+        if token.type == Token.PAREN and token.subtype == Token.OPEN:
+            node = self._expression(0)
+            token = self._next()
+            if token.type != Token.PAREN or token.subtype != Token.CLOSE:
+                raise Unsupported(f"unexpected {token.value!r}")
+            return node
+        raise Unsupported(f"unexpected {token.value!r}")
+
+    def _operand(self, token):
+        if token.subtype == Token.NUMBER:
+            return ("num", float(token.value))
+        if token.subtype == Token.TEXT:
+            return ("str", token.value[1:-1].replace('""', '"'))
+        if token.subtype == Token.LOGICAL:
+            return ("num", 1.0 if token.value.upper() == "TRUE" else 0.0)
+        if token.subtype == Token.ERROR:
+            return ("num", np.nan)
+        return self._reference(token.value, depth=0)
+
+    def _reference(self, operand, depth):
+        sheet, reference = split_sheet_prefix(operand)
+        if "#REF!" in operand or sheet is not None and (sheet.startswith("[") or ":" in sheet):
+            raise Unsupported(f"reference {operand}")
+        if sheet is not None and sheet not in self.stores:
+            raise Unsupported(f"sheet {sheet}")
+        specs = reference_specs(reference, *self._anchor)
+        if specs is not None:
+            return ("ref", sheet, specs[0], specs[1])
+        # Defined names hold absolute references, so they resolve the same from any cell
+        if depth < 5 and reference in self.defined_names and "," not in self.defined_names[reference]:
+            return self._reference(self.defined_names[reference].lstrip("="), depth + 1)
+        raise Unsupported(f"name {reference}")
+
+    # Evaluation --------------------------------------------------------------
+
+    def _bounds(self, node):
+        _, sheet, start, end = node
+        store = self.stores[sheet or self._sheet]
+        rows, cols = self._rows, self._cols
+        coords = []
+        for value, absolute, position, full in (
+            (start[0], start[1], rows, 1), (start[2], start[3], cols, 1),
+            (end[0], end[1], rows, MAX_ROW), (end[2], end[3], cols, MAX_COL),
+        ):
+            coords.append(full if value is None else value if absolute else position + value)
+        min_row, min_col, max_row, max_col = coords
+        return store, np.minimum(min_row, max_row), np.minimum(min_col, max_col), \
+            np.maximum(min_row, max_row), np.maximum(min_col, max_col)
+
+    def _eval(self, node):
+        kind = node[0]
+        if kind == "num":
+            return np.float64(node[1])
+        if kind == "str":
+            return _text_literal(node[1])
+        if kind == "missing":
+            return np.float64(0.0)
+        if kind == "ref":
+            return RangeArg(*self._bounds(node))
+        if kind == "neg":
+            return -_num(self._value(node[1]))
+        if kind == "pct":
+            return _num(self._value(node[1])) / 100.0
+        if kind == "func":
+            return FUNCTIONS[node[1]](self, node[2])
+        _, op, left, right = node
+        left, right = self._value(left), self._value(right)
+        if op in ("=", "<>", "<", ">", "<=", ">="):
+            return _compare(op, left, right)
+        if op == "&":
+            return _concat(left, right)
+        left, right = _num(left), _num(right)
+        with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+            if op == "+":
+                return left + right
+            if op == "-":
+                return left - right
+            if op == "*":
+                return left * right
+            if op == "/":
+                return _clean(left / right)
+            return _clean(np.power(left, right))
+
+    def _value(self, node):
+        value = self._eval(node)
+        return value.values() if isinstance(value, RangeArg) else value
+
+    def _range(self, node):
+        value = self._eval(node)
+        if not isinstance(value, RangeArg):
+            raise Unsupported("expected a range")
+        return value
+
+    # Functions ---------------------------------------------------------------
+
+    def _aggregate(self, args):
+        """Per-cell (sum, numeric count, min, max) over every argument."""
+        total, count = np.float64(0.0), np.float64(0.0)
+        low, high = np.float64(np.inf), np.float64(-np.inf)
+        for arg in args:
+            value = self._eval(arg)
+            if isinstance(value, RangeArg):
+                bounds = value.static()
+                if bounds is not None:
+                    kinds, numbers, _ = value.store.block(*bounds)
+                    numbers = numbers[kinds == NUM]
+                    if (kinds == ERR).any():
+                        numbers = np.append(numbers, np.nan)
+                    total, count = total + numbers.sum(), count + np.count_nonzero(kinds == NUM)
+                    if len(numbers):
+                        low, high = np.minimum(low, numbers.min()), np.maximum(high, numbers.max())
+                    continue
+                # A range that moves with the cell: sums and counts come from summed-area tables
+                sums, counts = value.store.prefix_sums()
+                store = value.store
+                min_row, min_col = np.clip(value.bounds[0], 1, store.n_rows + 1), np.clip(value.bounds[1], 1, store.n_cols + 1)
+                max_row, max_col = np.clip(value.bounds[2], 0, store.n_rows), np.clip(value.bounds[3], 0, store.n_cols)
+                empty = (max_row < min_row) | (max_col < min_col)
+                max_row, max_col = np.maximum(max_row, min_row - 1), np.maximum(max_col, min_col - 1)
+
+                def rect(table):
+                    return (table[max_row, max_col] - table[min_row - 1, max_col]
+                            - table[max_row, min_col - 1] + table[min_row - 1, min_col - 1])
+
+                total = total + np.where(empty, 0.0, rect(sums))
+                count = count + np.where(empty, 0.0, rect(counts))
+            else:
+                numbers = _num(value)
+                total, count = total + numbers, count + 1
+                low, high = np.minimum(low, numbers), np.maximum(high, numbers)
+        return total, count, low, high
+
+    def _sum(self, args):
+        return self._aggregate(args)[0]
+
+    def _count(self, args):
+        return self._aggregate(args)[1]
+
+    def _average(self, args):
+        total, count, _, _ = self._aggregate(args)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _clean(total / count)
+
+    def _extreme(self, args, which):
+        moving = [arg for arg in args if arg[0] == "ref" and self._range(arg).static() is None]
+        if moving:
+            raise _PerCell()
+        _, count, low, high = self._aggregate(args)
+        value = low if which == "min" else high
+        return np.where(count == 0, 0.0, value)
+
+    def _min(self, args):
+        return self._extreme(args, "min")
+
+    def _max(self, args):
+        return self._extreme(args, "max")
+
+    def _conditional(self, value_range, pairs, how):
+        """
+        SUMIF(S)/COUNTIF(S)/AVERAGEIF(S) over fixed ranges. The criteria of all cells are
+        grouped so each distinct criteria combination is worked out once; plain equality
+        criteria are answered from a single group-by over the criteria ranges.
+        """
+        ranges = [criteria_range for criteria_range, _ in pairs]
+        blocks = [r.block() for r in ranges]
+        shape = blocks[0][0].shape
+        if any(block[0].shape != shape for block in blocks):
+            raise Unsupported("criteria ranges of different sizes")
+        if value_range is not None:
+            # Like Excel, the value range takes the criteria range's size from its top-left cell
+            min_row, min_col, _, _ = value_range.require_static()
+            value_kinds, value_numbers, _ = value_range.store.block(
+                min_row, min_col, min_row + shape[0] - 1, min_col + shape[1] - 1)
+            if value_kinds.shape != shape:
+                value_kinds = np.pad(value_kinds, [(0, shape[0] - value_kinds.shape[0]), (0, shape[1] - value_kinds.shape[1])])
+                value_numbers = np.pad(value_numbers, [(0, shape[0] - value_numbers.shape[0]),
+                                                       (0, shape[1] - value_numbers.shape[1])], constant_values=np.nan)
+            numeric = (value_kinds == NUM).ravel()
+            numbers = np.where(numeric, value_numbers.ravel(), 0.0)
+        else:
+            numeric = np.ones(int(np.prod(shape)), dtype=bool)
+            numbers = np.zeros(int(np.prod(shape)))
+
+        criteria = [np.asarray(self._value(criterion), dtype=object) for _, criterion in pairs]
+        n = len(self._rows)
+        criteria = [np.broadcast_to(c, (n,)) for c in criteria]
+        combos = list(zip(*(c.tolist() for c in criteria)))
+        parsed = {combo: tuple(_criterion(value) for value in combo) for combo in set(combos)}
+
+        results = {}
+        simple = [combo for combo, crits in parsed.items() if all(op == "=" and p is None for op, _, p in crits)]
+        if simple:
+            keys = pd.DataFrame({i: r.lookup_keys() for i, r in enumerate(ranges)})
+            keys["total"], keys["count"], keys["rows"] = numbers, numeric.astype(float), 1.0
+            groups = keys.groupby(list(range(len(ranges))), sort=False, dropna=False)[["total", "count", "rows"]].sum()
+            table = {(key if isinstance(key, tuple) else (key,)): row for key, row in
+                     zip(groups.index, groups.itertuples(index=False, name=None))}
+            for combo in simple:
+                results[combo] = table.get(tuple(operand for _, operand, _ in parsed[combo]), (0.0, 0.0, 0.0))
+        for combo, crits in parsed.items():
+            if combo in results:
+                continue
+            mask = np.ones(int(np.prod(shape)), dtype=bool)
+            for block, crit in zip(blocks, crits):
+                mask &= _criterion_mask(block, crit)
+            results[combo] = (numbers[mask].sum(), numeric[mask].sum(), mask.sum())
+
+        totals = np.array([results[combo][0] for combo in combos], dtype=float)
+        if how == "sum":
+            return totals
+        if how == "count":
+            return np.array([results[combo][2] for combo in combos], dtype=float)
+        counts = np.array([results[combo][1] for combo in combos], dtype=float)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return _clean(totals / counts)
+
+    def _sumif(self, args, how="sum"):
+        criteria_range = self._range(args[0])
+        value_range = self._range(args[2]) if len(args) > 2 and args[2][0] != "missing" else criteria_range
+        return self._conditional(value_range, [(criteria_range, args[1])], how)
+
+    def _averageif(self, args):
+        return self._sumif(args, "average")
+
+    def _countif(self, args):
+        return self._conditional(None, [(self._range(args[0]), args[1])], "count")
+
+    def _ifs_pairs(self, args):
+        if len(args) % 2:
+            raise Unsupported("odd number of criteria arguments")
+        return [(self._range(args[i]), args[i + 1]) for i in range(0, len(args), 2)]
+
+    def _sumifs(self, args, how="sum"):
+        return self._conditional(self._range(args[0]), self._ifs_pairs(args[1:]), how)
+
+    def _averageifs(self, args):
+        return self._sumifs(args, "average")
+
+    def _countifs(self, args):
+        return self._conditional(None, self._ifs_pairs(args), "count")
+
+    def _match_positions(self, lookup, keys, numbers, match_type):
+        """0-based positions of lookup values in a 1-D range (-1 when not found)."""
+        lookup = np.asarray(lookup, dtype=object)
+        if match_type == 0:
+            first = {}
+            for i, key in enumerate(keys.tolist()):
+                if key is not None and key not in first:
+                    first[key] = i
+            flat = [first.get(_lookup_key(value), -1) for value in lookup.ravel().tolist()]
+            return np.array(flat, dtype=np.int64).reshape(lookup.shape)
+        if match_type != 1:
+            raise Unsupported("descending approximate match")
+        # Approximate match assumes the range is sorted ascending, as Excel does
+        positions = np.flatnonzero(~np.isnan(numbers))
+        found = np.searchsorted(numbers[positions], _num(lookup), side="right") - 1
+        return np.where(found >= 0, positions[np.maximum(found, 0)], -1)
+
+    def _vlookup(self, args):
+        lookup = self._value(args[0])
+        table = self._range(args[1])
+        column = _num(self._value(args[2]))
+        if not np.all(np.isfinite(column)):
+            raise Unsupported("VLOOKUP column index is an error")
+        column = column.astype(np.int64)
+        exact = len(args) > 3 and args[3][0] != "missing" and not np.all(_num(self._value(args[3])) != 0)
+        min_row, min_col, max_row, max_col = table.require_static()
+        first = RangeArg(table.store, min_row, min_col, max_row, min_col)
+        kinds, numbers, _ = first.block()
+        found = self._match_positions(lookup, first.lookup_keys(), np.where(kinds == NUM, numbers, np.nan).ravel(),
+                                      0 if exact else 1)
+        ok = (found >= 0) & (column >= 1) & (column <= max_col - min_col + 1)
+        values = table.store.gather(min_row + np.maximum(found, 0), min_col + column - 1)
+        return np.where(ok, values, np.nan)
+
+    def _match(self, args):
+        lookup = self._value(args[0])
+        lookup_range = self._range(args[1])
+        match_type = int(_num(self._value(args[2])).ravel()[0]) if len(args) > 2 and args[2][0] != "missing" else 1
+        min_row, min_col, max_row, max_col = lookup_range.require_static()
+        if min_row != max_row and min_col != max_col:
+            raise Unsupported("MATCH over a 2-D range")
+        kinds, numbers, _ = lookup_range.block()
+        found = self._match_positions(lookup, lookup_range.lookup_keys(),
+                                      np.where(kinds == NUM, numbers, np.nan).ravel(), match_type)
+        return np.where(found >= 0, found + 1.0, np.nan)
+
+    def _index(self, args):
+        table = self._range(args[0])
+        min_row, min_col, max_row, max_col = table.require_static()
+        row = _num(self._value(args[1]))
+        col = _num(self._value(args[2])) if len(args) > 2 and args[2][0] != "missing" else None
+        if col is None:
+            if min_col == max_col:
+                col = np.float64(1.0)
+            elif min_row == max_row:
+                row, col = np.float64(1.0), row
+            else:
+                raise Unsupported("INDEX without a column on a 2-D range")
+        ok = (row >= 1) & (col >= 1) & (row <= max_row - min_row + 1) & (col <= max_col - min_col + 1)
+        rows = min_row + np.where(ok, row, 1).astype(np.int64) - 1
+        cols = min_col + np.where(ok, col, 1).astype(np.int64) - 1
+        return np.where(ok, table.store.gather(rows, cols), np.nan)
+
+    def _if(self, args):
+        condition = _num(self._value(args[0]))
+        then = self._value(args[1]) if len(args) > 1 and args[1][0] != "missing" else np.float64(0.0)
+        otherwise = self._value(args[2]) if len(args) > 2 and args[2][0] != "missing" else np.float64(0.0)
+        return np.where(np.isnan(condition), np.nan, np.where(condition != 0, then, otherwise))
+
+    def _iferror(self, args):
+        value = self._value(args[0])
+        fallback = self._value(args[1])
+        if np.asarray(value).dtype == object:
+            failed = np.frompyfunc(lambda v: not isinstance(v, str) and v != v, 1, 1)(value).astype(bool)
+        else:
+            failed = np.isnan(value)
+        return np.where(failed, fallback, value)
+
+    def _and(self, args):
+        values = [_num(self._value(arg)) != 0 for arg in args]
+        return np.logical_and.reduce(np.broadcast_arrays(*values)).astype(float)
+
+    def _or(self, args):
+        values = [_num(self._value(arg)) != 0 for arg in args]
+        return np.logical_or.reduce(np.broadcast_arrays(*values)).astype(float)
+
+    def _not(self, args):
+        return (_num(self._value(args[0])) == 0).astype(float)
+
+    def _abs(self, args):
+        return np.abs(_num(self._value(args[0])))
+
+    def _round_function(self, args):
+        digits = _num(self._value(args[1])) if len(args) > 1 else np.float64(0.0)
+        return _round(_num(self._value(args[0])), digits)
+
+    def _sumproduct(self, args):
+        arrays = []
+        for arg in args:
+            value = self._range(arg)
+            kinds, numbers, _ = value.block()
+            arrays.append(np.where(kinds == NUM, numbers, 0.0))
+        if any(a.shape != arrays[0].shape for a in arrays):
+            raise Unsupported("SUMPRODUCT ranges of different sizes")
+        return np.float64(np.prod(arrays, axis=0).sum())
+
+    # Classes -----------------------------------------------------------------
+
+    def _positions(self, formula_class):
+        rows = np.concatenate([np.arange(start, end + 1) for _, start, end in formula_class.runs])
+        cols = np.concatenate([np.full(end - start + 1, col) for col, start, end in formula_class.runs])
+        return rows.astype(np.int64), cols.astype(np.int64)
+
+    def _refs(self, tree):
+        if tree[0] == "ref":
+            yield tree
+        elif tree[0] == "op":
+            yield from self._refs(tree[2])
+            yield from self._refs(tree[3])
+        elif tree[0] in ("neg", "pct"):
+            yield from self._refs(tree[1])
+        elif tree[0] == "func":
+            for arg in tree[2]:
+                yield from self._refs(arg)
+
+    def _read_boxes(self, sheet_name, tree, rows, cols):
+        """(sheet, min_row, min_col, max_row, max_col) covering every cell each reference reads."""
+        self._sheet, self._rows, self._cols = sheet_name, rows, cols
+        boxes = []
+        for ref in self._refs(tree):
+            store, min_row, min_col, max_row, max_col = self._bounds(ref)
+            boxes.append((store.name, int(np.min(min_row)), int(np.min(min_col)),
+                          int(np.max(max_row)), int(np.max(max_col))))
+        return boxes
+
+    def _order(self, entries):
+        """
+        Topological order of the class entries; classes on a dependency cycle are
+        appended in sheet order and flagged. Returns (order, cyclic ids, self-reading ids).
+        """
+        run_sheet, run_col, run_start, run_end, run_owner = [], [], [], [], []
+        for i, entry in enumerate(entries):
+            for col, start, end in entry["class"].runs:
+                run_sheet.append(entry["sheet"])
+                run_col.append(col)
+                run_start.append(start)
+                run_end.append(end)
+                run_owner.append(i)
+        run_sheet, run_col = np.array(run_sheet, dtype=object), np.array(run_col)
+        run_start, run_end, run_owner = np.array(run_start), np.array(run_end), np.array(run_owner)
+
+        dependents = [set() for _ in entries]
+        indegree = np.zeros(len(entries), dtype=np.int64)
+        self_reading = set()
+        for i, entry in enumerate(entries):
+            upstream = set()
+            for sheet, min_row, min_col, max_row, max_col in entry["boxes"]:
+                hit = ((run_sheet == sheet) & (run_col >= min_col) & (run_col <= max_col)
+                       & (run_start <= max_row) & (run_end >= min_row))
+                upstream.update(run_owner[hit].tolist())
+            if i in upstream:
+                self_reading.add(i)
+                upstream.discard(i)
+            for j in upstream:
+                dependents[j].add(i)
+            indegree[i] = len(upstream)
+
+        ready = deque(np.flatnonzero(indegree == 0).tolist())
+        order = []
+        while ready:
+            i = ready.popleft()
+            order.append(i)
+            for j in dependents[i]:
+                indegree[j] -= 1
+                if indegree[j] == 0:
+                    ready.append(j)
+        cyclic = [i for i in range(len(entries)) if indegree[i] > 0]
+        return order + cyclic, set(cyclic), self_reading
+
+    def _evaluate_cells(self, tree, sheet_name, rows, cols, write):
+        """Evaluate a class one cell at a time in row order, optionally writing each result at once."""
+        results = np.empty(len(rows), dtype=object)
+        for i in np.lexsort((cols, rows)).tolist():
+            self._sheet, self._rows, self._cols = sheet_name, rows[i:i + 1], cols[i:i + 1]
+            value = np.broadcast_to(_as_values(self._value(tree)), (1,))
+            results[i] = value[0]
+            if write:
+                self.stores[sheet_name].write(rows[i:i + 1], cols[i:i + 1], np.asarray(value))
+        if all(not isinstance(v, str) for v in results):
+            return results.astype(float)
+        return results
+
+    def evaluate_class(self, sheet_name, formula_class, tree, self_reading=False):
+        """Computed values for every cell of a class, in the order of _positions()."""
+        rows, cols = self._positions(formula_class)
+        if self_reading:
+            return self._evaluate_cells(tree, sheet_name, rows, cols, write=True)
+        self._sheet, self._rows, self._cols = sheet_name, rows, cols
+        try:
+            values = self._value(tree)
+        except _PerCell:
+            return self._evaluate_cells(tree, sheet_name, rows, cols, write=False)
+        values = _as_values(values)
+        return np.array(np.broadcast_to(values, rows.shape), dtype=values.dtype)
+
+    def _compare_cached(self, result, store, rows, cols, cached, computed):
+        kinds, numbers, texts = cached
+        computed = np.asarray(computed)
+        if computed.dtype != object:
+            computed_numbers = computed
+            computed_text = np.zeros(len(rows), dtype=bool)
+        else:
+            computed_text = np.array([isinstance(v, str) for v in computed.tolist()], dtype=bool)
+            computed_numbers = np.array([np.nan if isinstance(v, str) else float(v) for v in computed.tolist()])
+        computed_error = ~computed_text & np.isnan(computed_numbers)
+
+        missing = kinds == EMPTY
+        with np.errstate(invalid="ignore"):
+            same_number = (kinds == NUM) & ~computed_text & np.isclose(numbers, computed_numbers, rtol=RTOL, atol=ATOL)
+        same_error = (kinds == ERR) & computed_error
+        same_text = np.zeros(len(rows), dtype=bool)
+        both_text = (kinds == TEXT) & computed_text
+        if both_text.any():
+            same_text[both_text] = texts[both_text] == computed[both_text]
+        matched = same_number | same_error | same_text
+        mismatched = ~matched & ~missing
+
+        result.matched = int(matched.sum())
+        result.missing = int(missing.sum())
+        result.mismatched = int(mismatched.sum())
+        for i in np.flatnonzero(mismatched)[:self.max_mismatches].tolist():
+            cached_value = float(numbers[i]) if kinds[i] == NUM else texts[i]
+            computed_value = computed[i] if computed.dtype == object else float(computed[i])
+            result.samples.append(Mismatch(store.name, int(rows[i]), int(cols[i]), result.formula,
+                                           cached_value, computed_value))
+
+    def run(self):
+        """Evaluate every formula class in dependency order and return an EvaluationReport."""
+        report = EvaluationReport()
+        entries = []
+        for sheet_name in self.sheet_names:
+            for formula_class in self.formula_classes.get(sheet_name, []):
+                result = ClassResult(sheet_name, formula_class.r1c1, formula_class.formula, formula_class.cell_count)
+                report.classes.append(result)
+                try:
+                    tree = self.parse(formula_class.formula, *formula_class.anchor)
+                except Unsupported as e:
+                    result.status, result.detail = "unsupported", str(e)
+                    continue
+                rows, cols = self._positions(formula_class)
+                entries.append({"sheet": sheet_name, "class": formula_class, "tree": tree, "result": result,
+                                "boxes": self._read_boxes(sheet_name, tree, rows, cols)})
+
+        order, cyclic, self_reading = self._order(entries)
+        for i in order:
+            entry = entries[i]
+            sheet_name, formula_class, result = entry["sheet"], entry["class"], entry["result"]
+            store = self.stores[sheet_name]
+            rows, cols = self._positions(formula_class)
+            cached = store.raw(rows, cols)
+            try:
+                with np.errstate(divide="ignore", invalid="ignore", over="ignore"):
+                    computed = self.evaluate_class(sheet_name, formula_class, entry["tree"], i in self_reading)
+                store.write(rows, cols, computed)
+                self._compare_cached(result, store, rows, cols, cached, computed)
+            except Unsupported as e:
+                result.status, result.detail = "unsupported", str(e)
+                continue
+            except (ValueError, TypeError, IndexError, OverflowError) as e:
+                result.status, result.detail = "failed", f"{type(e).__name__}: {e}"
+                continue
+            result.evaluated = len(rows)
+            result.status = "mismatch" if result.mismatched else "ok"
+            if i in cyclic:
+                result.detail = "on a dependency cycle; evaluated once in sheet order"
+            report.mismatches.extend(result.samples)
+        return report
+
+    def value(self, sheet_name, row, col):
+        """Current value of a cell: computed for evaluated formula cells, cached otherwise."""
+        return self.stores[sheet_name].gather(np.array([row]), np.array([col]))[0]
+
+
+FUNCTIONS = {
+    "SUM": FormulaEvaluator._sum,
+    "COUNT": FormulaEvaluator._count,
+    "AVERAGE": FormulaEvaluator._average,
+    "MIN": FormulaEvaluator._min,
+    "MAX": FormulaEvaluator._max,
+    "SUMIF": FormulaEvaluator._sumif,
+    "SUMIFS": FormulaEvaluator._sumifs,
+    "COUNTIF": FormulaEvaluator._countif,
+    "COUNTIFS": FormulaEvaluator._countifs,
+    "AVERAGEIF": FormulaEvaluator._averageif,
+    "AVERAGEIFS": FormulaEvaluator._averageifs,
+    "VLOOKUP": FormulaEvaluator._vlookup,
+    "INDEX": FormulaEvaluator._index,
+    "MATCH": FormulaEvaluator._match,
+    "IF": FormulaEvaluator._if,
+    "IFERROR": FormulaEvaluator._iferror,
+    "AND": FormulaEvaluator._and,
+    "OR": FormulaEvaluator._or,
+    "NOT": FormulaEvaluator._not,
+    "ABS": FormulaEvaluator._abs,
+    "ROUND": FormulaEvaluator._round_function,
+    "SUMPRODUCT": FormulaEvaluator._sumproduct,
+}
+
+
+@dataclass
+class Mismatch:
+    sheet: str
+    row: int
+    col: int
+    formula: str
+    cached: object
+    computed: object
+
+    @property
+    def cell(self):
+        return f"{get_column_letter(self.col)}{self.row}"
+
+
+@dataclass
+class ClassResult:
+    """Outcome for one formula class: ok, mismatch, unsupported or failed."""
+    sheet: str
+    r1c1: str
+    formula: str
+    cells: int
+    status: str = "pending"
+    detail: str = ""
+    evaluated: int = 0
+    matched: int = 0
+    mismatched: int = 0
+    missing: int = 0
+    samples: list = field(default_factory=list)
+
+
+@dataclass
+class EvaluationReport:
+    classes: list = field(default_factory=list)
+    mismatches: list = field(default_factory=list)
+
+    def summary(self):
+        statuses = Counter(result.status for result in self.classes)
+        unsupported = Counter(result.detail for result in self.classes if result.status == "unsupported")
+        return {
+            "classes": len(self.classes),
+            "formula_cells": sum(result.cells for result in self.classes),
+            "evaluated_cells": sum(result.evaluated for result in self.classes),
+            "matched_cells": sum(result.matched for result in self.classes),
+            "mismatched_cells": sum(result.mismatched for result in self.classes),
+            "missing_cached_values": sum(result.missing for result in self.classes),
+            "classes_by_status": dict(statuses),
+            "unsupported": dict(unsupported.most_common()),
+        }
+
+    def mismatch_frame(self):
+        """One row per reported mismatch (at most max_mismatches per class)."""
+        return pd.DataFrame(
+            [(m.sheet, m.cell, m.formula, m.cached, m.computed) for m in self.mismatches],
+            columns=["sheet", "cell", "formula", "cached", "computed"],
+        )
+
+
+def evaluate_workbook(workbook, sheet_names=None, graph=None, max_mismatches=20):
+    """
+    Recompute the formulas of a WorkbookGrid and check them against the cached values.
+
+    Pass the DependencyGraph from formula_graph.build_dependency_graph to reuse the
+    formula classes it already grouped.
+    """
+    formula_classes = graph.formula_classes if graph is not None else None
+    evaluator = FormulaEvaluator(workbook, sheet_names, formula_classes, max_mismatches)
+    return evaluator.run()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recompute a workbook's formulas and compare them with the cached values.")
+    parser.add_argument("workbook", help="Path of the .xlsx file.")
+    parser.add_argument("--sheets", nargs="*", default=None, help="Only evaluate these sheets.")
+    parser.add_argument("--max-mismatches", type=int, default=20, help="Mismatching cells listed per formula class.")
+    parser.add_argument("--mismatches-csv", default=None, help="Write the listed mismatches to this CSV.")
+    args = parser.parse_args()
+
+    report = evaluate_workbook(load_workbook_grid(args.workbook), args.sheets, max_mismatches=args.max_mismatches)
+    for key, value in report.summary().items():
+        print(f"{key}: {value}")
+    for result in report.classes:
+        if result.status != "ok":
+            print(f"[{result.status}] {result.sheet} {result.formula} ({result.cells} cells) {result.detail}".rstrip())
+            for mismatch in result.samples:
+                print(f"    {mismatch.cell}: cached={mismatch.cached!r} computed={mismatch.computed!r}")
+    if args.mismatches_csv:
+        report.mismatch_frame().to_csv(args.mismatches_csv, index=False)
@@ -0,0 +1,235 @@
+import re
+from array import array
+from collections import deque
+
+import numpy as np
+from openpyxl.formula import Tokenizer
+from openpyxl.formula.tokenizer import Token, TokenizerError
+
+from column_index import Reference, parse_reference
+from formula_classes import group_formula_classes
+
+
+def split_sheet_prefix(operand):
+    """Split "'My Sheet'!A1:B2" into ("My Sheet", "A1:B2"); the sheet is None when absent."""
+    if "!" not in operand:
+        return None, operand
+    prefix, reference = operand.rsplit("!", 1)
+    if prefix.startswith("'") and prefix.endswith("'"):
+        prefix = prefix[1:-1].replace("''", "'")
+    return prefix, reference
+
+
+def tokenize_formula(formula):
+    """Tokenize an Excel formula with openpyxl's tokenizer; returns [] for unparsable text."""
+    if not formula or not formula.startswith("="):
+        return []
+    try:
+        return Tokenizer(formula).items
+    except TokenizerError:
+        return []
+
+
+def extract_references(formula, current_sheet, defined_names=None, sheetnames=None):
+    """
+    Return the Reference objects a formula reads from.
+
+    Handles quoted sheet names, absolute refs, ranges, full rows/columns, 3D refs
+    (Sheet1:Sheet3!A1, when sheetnames is given) and defined names. External
+    workbook refs, structured table refs and #REF! errors are skipped.
+    """
+    references = []
+    for token in tokenize_formula(formula):
+        if token.type != Token.OPERAND or token.subtype != Token.RANGE:
+            continue
+        references.extend(_resolve_operand(token.value, current_sheet, defined_names, sheetnames, depth=0))
+    return references
+
+
+def _resolve_operand(operand, current_sheet, defined_names, sheetnames, depth):
+    sheet, reference = split_sheet_prefix(operand)
+    if sheet is not None and sheet.startswith("["):
+        return []
+    if "#REF!" in operand:
+        return []
+
+    sheets = [sheet or current_sheet]
+    if sheet and ":" in sheet and sheetnames:
+        first, last = sheet.split(":", 1)
+        if first in sheetnames and last in sheetnames:
+            i, j = sheetnames.index(first), sheetnames.index(last)
+            sheets = sheetnames[min(i, j):max(i, j) + 1]
+
+    bounds = parse_reference(reference)
+    if bounds is not None:
+        return [Reference(s, *bounds) for s in sheets]
+
+    # Not an A1 reference: try a defined name, which may itself hold a list of ranges
+    if defined_names and depth < 5 and reference in defined_names:
+        resolved = []
+        for part in defined_names[reference].split(","):
+            resolved.extend(_resolve_operand(part.strip(), current_sheet, defined_names, sheetnames, depth + 1))
+        return resolved
+    return []
+
+
+class DependencyGraph:
+    """
+    Workbook-level, cell- and range-level formula dependency graph.
+
+    Every formula class is parsed once. Formula cells get integer ids, and each
+    reference they read becomes an edge stored in NumPy arrays (target sheet id and
+    bounds), grouped by source cell. The FormulaClass lists of each sheet are kept in
+    formula_classes. Upstream queries use the per-cell edge slice;
+    downstream queries test a cell against all edge rectangles of its sheet at once.
+    """
+
+    def __init__(self, sheetnames):
+        self.sheetnames = list(sheetnames)
+        self._sheet_ids = {name: i for i, name in enumerate(self.sheetnames)}
+        self._cell_ids = {}
+        self._cells = []
+        self.formula_classes = {}
+        self._edge_src, self._edge_sheet = array("i"), array("i")
+        self._edge_bounds = array("i")
+        self._edge_offsets = array("i", [0])
+
+    def add_formula(self, sheet_name, row, col, references):
+        """Register a formula cell and the references it reads; cells must be added once each."""
+        cell_id = len(self._cells)
+        self._cell_ids[(sheet_name, row, col)] = cell_id
+        self._cells.append((sheet_name, row, col))
+        for ref in references:
+            if ref.sheet not in self._sheet_ids:
+                continue
+            self._edge_src.append(cell_id)
+            self._edge_sheet.append(self._sheet_ids[ref.sheet])
+            self._edge_bounds.extend((ref.min_row, ref.min_col, ref.max_row, ref.max_col))
+        self._edge_offsets.append(len(self._edge_src))
+
+    def finalize(self):
+        """Freeze the edge buffers into NumPy arrays; call after the last add_formula()."""
+        self.edge_src = np.frombuffer(self._edge_src, dtype=np.int32)
+        self.edge_sheet = np.frombuffer(self._edge_sheet, dtype=np.int32)
+        self.edge_bounds = np.frombuffer(self._edge_bounds, dtype=np.int32).reshape(-1, 4)
+        self.edge_offsets = np.frombuffer(self._edge_offsets, dtype=np.int32)
+        self.cell_sheets = np.array([self._sheet_ids[sheet] for sheet, _, _ in self._cells], dtype=np.int32)
+        self.cell_rows = np.array([row for _, row, _ in self._cells], dtype=np.int32)
+        self.cell_cols = np.array([col for _, _, col in self._cells], dtype=np.int32)
+        return self
+
+    def __len__(self):
+        return len(self._cells)
+
+    def _edges_of(self, cell_id):
+        return range(int(self.edge_offsets[cell_id]), int(self.edge_offsets[cell_id + 1]))
+
+    def precedents(self, sheet_name, row, col):
+        """References read directly by a formula cell."""
+        cell_id = self._cell_ids.get((sheet_name, row, col))
+        if cell_id is None:
+            return []
+        return [
+            Reference(self.sheetnames[self.edge_sheet[e]], *map(int, self.edge_bounds[e]))
+            for e in self._edges_of(cell_id)
+        ]
+
+    def _formula_cells_in(self, ref):
+        """Ids of formula cells that sit inside a referenced rectangle."""
+        inside = (
+            (self.cell_sheets == self._sheet_ids[ref.sheet])
+            & (self.cell_rows >= ref.min_row) & (self.cell_rows <= ref.max_row)
+            & (self.cell_cols >= ref.min_col) & (self.cell_cols <= ref.max_col)
+        )
+        return np.flatnonzero(inside)
+
+    def _dependents_of(self, sheet_name, row, col):
+        """Ids of formula cells whose references cover a cell."""
+        bounds = self.edge_bounds
+        hit = (
+            (self.edge_sheet == self._sheet_ids[sheet_name])
+            & (bounds[:, 0] <= row) & (bounds[:, 2] >= row)
+            & (bounds[:, 1] <= col) & (bounds[:, 3] >= col)
+        )
+        return np.unique(self.edge_src[hit])
+
+    def upstream(self, sheet_name, row, col, transitive=True):
+        """
+        References feeding a cell. With transitive=True the search continues through
+        formula cells inside each referenced range.
+        """
+        found, seen = [], set()
+        queue = deque([(sheet_name, row, col)])
+        visited = {(sheet_name, row, col)}
+        while queue:
+            for ref in self.precedents(*queue.popleft()):
+                if ref not in seen:
+                    seen.add(ref)
+                    found.append(ref)
+                if not transitive:
+                    continue
+                for cell_id in self._formula_cells_in(ref):
+                    cell = self._cells[cell_id]
+                    if cell not in visited:
+                        visited.add(cell)
+                        queue.append(cell)
+        return found
+
+    def downstream(self, sheet_name, row, col, transitive=True):
+        """Formula cells (sheet, row, col) that read a cell, directly or through other formulas."""
+        if sheet_name not in self._sheet_ids:
+            return []
+        found = []
+        visited = {(sheet_name, row, col)}
+        queue = deque([(sheet_name, row, col)])
+        while queue:
+            for cell_id in self._dependents_of(*queue.popleft()):
+                cell = self._cells[cell_id]
+                if cell in visited:
+                    continue
+                visited.add(cell)
+                found.append(cell)
+                if transitive:
+                    queue.append(cell)
+        return found
+
+    def sheet_dependencies(self, sheet_name, min_row, min_col, max_row, max_col):
+        """Other sheets read by the formula cells inside a rectangle of sheet_name."""
+        inside = self._formula_cells_in(Reference(sheet_name, min_row, min_col, max_row, max_col))
+        if not len(inside):
+            return []
+        sheet_ids = np.unique(self.edge_sheet[np.isin(self.edge_src, inside)])
+        own = self._sheet_ids[sheet_name]
+        return [self.sheetnames[i] for i in sheet_ids if i != own]
+
+
+def build_dependency_graph(workbook, sheet_names=None):
+    """
+    Parse every formula of a WorkbookGrid once into a DependencyGraph.
+
+    Formulas are first grouped into relative R1C1 classes; each class's references
+    are worked out once and shifted to every cell it covers. Classes that use defined
+    names or 3D refs fall back to a full tokenizer parse, cached by formula text.
+    """
+    graph = DependencyGraph(workbook.sheetnames)
+    names = workbook.defined_names
+    name_pattern = re.compile(r"\b(?:" + "|".join(map(re.escape, names)) + r")\b") if names else None
+    parsed = {}
+    for sheet_name in sheet_names or workbook.sheetnames:
+        sheet = workbook[sheet_name]
+        classes = group_formula_classes(sheet)
+        graph.formula_classes[sheet_name] = classes
+        for formula_class in classes:
+            template = formula_class.template
+            full_parse = template.opaque or (name_pattern is not None and name_pattern.search(template.r1c1))
+            for col, start_row, end_row in formula_class.runs:
+                for row in range(start_row, end_row + 1):
+                    if not full_parse:
+                        graph.add_formula(sheet_name, row, col, template.references(row, col, sheet_name))
+                        continue
+                    formula = sheet.formula(row, col)
+                    key = (sheet_name, formula)
+                    if key not in parsed:
+                        parsed[key] = extract_references(formula, sheet_name, names, workbook.sheetnames)
+                    graph.add_formula(sheet_name, row, col, parsed[key])
+    return graph.finalize()
@@ -1,66 +1,30 @@
-import openpyxl
 import re
-from openpyxl.utils import column_index_from_string
 import numpy as np  # For NaN values
 import pandas as pd
 
+from column_index import build_column_index, parse_reference
+from formula_graph import build_dependency_graph
+from table_detection import detect_tables
+from workbook_grid import load_workbook_grid
 
-def extract_tables_with_column_names_and_dependencies(file_path):
+
+def extract_tables_with_column_names_and_dependencies(file_path, detection_settings=None, workbook=None, graph=None):
     """
     Extracts tables with both computed values and metadata, including formulas, column names, and dependencies.
+    Each sheet is read once into a SheetGrid that holds cached values and formulas together.
+    detection_settings are passed to table_detection.detect_tables (gap tolerance and merging).
+    An already loaded WorkbookGrid and DependencyGraph can be passed in to avoid re-parsing.
     """
     def extract_table_bounds(sheet):
-        """Identify individual tables and combine those with the same column range."""
-        table_ranges = []
-        current_table_start = None
-        non_empty_rows = []
-
-        # Identify non-empty rows
-        for row_idx, row in enumerate(sheet.iter_rows(values_only=True), start=1):
-            if any(cell is not None for cell in row):  # Check if row is not empty
-                non_empty_rows.append(row_idx)
-                if current_table_start is None:
-                    current_table_start = row_idx
-            elif current_table_start is not None:
-                # End of a table
-                table_ranges.append((current_table_start, row_idx - 1))
-                current_table_start = None
-
-        # Handle the last table if the sheet ends with data
-        if current_table_start is not None:
-            table_ranges.append((current_table_start, non_empty_rows[-1]))
-
-        # Identify column ranges for each table and combine overlapping ones
-        combined_tables = []
-        for start_row, end_row in table_ranges:
-            start_col = None
-            end_col = None
-            for row in sheet.iter_rows(min_row=start_row, max_row=end_row, values_only=True):
-                non_empty_cols = [idx for idx, cell in enumerate(row, start=1) if cell is not None]
-                if non_empty_cols:
-                    if start_col is None or min(non_empty_cols) < start_col:
-                        start_col = min(non_empty_cols)
-                    if end_col is None or max(non_empty_cols) > end_col:
-                        end_col = max(non_empty_cols)
-
-            # Combine tables with the same column range
-            if combined_tables and combined_tables[-1][1] + 1 >= start_row and \
-                    combined_tables[-1][2] == start_col and combined_tables[-1][3] == end_col:
-                # Extend the row range of the previous table
-                combined_tables[-1] = (combined_tables[-1][0], end_row, start_col, end_col)
-            else:
-                # Add a new table range
-                combined_tables.append((start_row, end_row, start_col, end_col))
-
-        for start_row, end_row, start_col, end_col in combined_tables:
-            yield (start_row, start_col, end_row, end_col)
+        """Identify individual tables, including side-by-side ones, from the sheet's occupancy mask."""
+        yield from detect_tables(sheet.occupancy(), **(detection_settings or {}))
 
     def get_column_name(sheet, start_row, end_row, col_idx):
         """Determine the column name from the first non-None, non-formula cell in the column."""
         for row_idx in range(start_row, end_row + 1):
-            cell = sheet.cell(row=row_idx, column=col_idx)
-            if cell.data_type != 'f' and cell.value is not None:
-                return str(cell.value)
+            value = sheet.value(row_idx, col_idx)
+            if sheet.data_type(row_idx, col_idx) != 'f' and value is not None:
+                return str(value)
         return np.nan
 
     def extract_table_data(sheet, start_row, start_col, end_row, end_col):
@@ -71,52 +35,53 @@ def extract_tables_with_column_names_and_dependencies(file_path):
             table_data.append(list(row))
         return table_data
 
-    def extract_table_metadata(sheet, start_row, start_col, end_row, end_col, workbook):
-        """Extract column metadata for the table."""
+    def extract_table_metadata(sheet, start_row, start_col, end_row, end_col, graph):
+        """Extract column metadata for the table, reading formulas and dependencies from the workbook's formula graph."""
         column_metadata = []
+        formula_rows, formula_cols, formula_ids = sheet.formula_cells(start_row, start_col, end_row, end_col)
 
         for col_idx in range(start_col, end_col + 1):
             column_formula = None
-            dependency_sheets = set()
-
-            for row_idx in range(start_row, end_row + 1):
-                cell = sheet.cell(row=row_idx, column=col_idx)
-                if cell.data_type == 'f' and not column_formula:
-                    column_formula = str(cell.value)
-                    if "#REF!" in column_formula:
-                        continue
-                    for token in column_formula.split("!"):
-                        for sheetname in workbook.sheetnames:
-                            if sheetname in token.strip("="):
-                                dependency_sheets.add(sheetname)
+            dependency_sheets = []
+            formula_classes = []
+
+            in_column = np.flatnonzero(formula_cols == col_idx)
+            if len(in_column):
+                column_formula = sheet.formulas[formula_ids[in_column[0]]]
+                dependency_sheets = graph.sheet_dependencies(sheet.title, start_row, col_idx, end_row, col_idx)
+                # Each distinct relative formula once, with the rows it covers and the cells that break it
+                for formula_class in graph.formula_classes.get(sheet.title, []):
+                    class_info = formula_class.to_dict(start_row, col_idx, end_row, col_idx)
+                    if class_info is not None:
+                        formula_classes.append(class_info)
 
             column_name = get_column_name(sheet, start_row, end_row, col_idx)
 
             column_metadata.append({
                 "ColumnName": column_name,
                 "Formula": column_formula,
-                "Dependencies": list(dependency_sheets),
+                "FormulaClasses": formula_classes,
+                "Dependencies": dependency_sheets,
             })
 
         return column_metadata
 
-    workbook_values = openpyxl.load_workbook(file_path, data_only=True, read_only=False)
-    workbook_formulas = openpyxl.load_workbook(file_path, data_only=False, read_only=False)
-
-    visible_sheet_names = [sheet_name for sheet_name in workbook_values.sheetnames if not workbook_values[sheet_name].sheet_state == 'hidden']
+    if workbook is None:
+        workbook = load_workbook_grid(file_path)
+    if graph is None:
+        graph = build_dependency_graph(workbook)
 
     tables_by_sheet = {}
-    for sheet_name in visible_sheet_names:
-        sheet_values = workbook_values[sheet_name]
-        sheet_formulas = workbook_formulas[sheet_name]
+    for sheet_name in workbook.visible_sheetnames:
+        sheet = workbook[sheet_name]
         tables = []
 
-        for start_row, start_col, end_row, end_col in extract_table_bounds(sheet_values):
+        for start_row, start_col, end_row, end_col in extract_table_bounds(sheet):
             # Extract table data
-            table_data = extract_table_data(sheet_values, start_row, start_col, end_row, end_col)
+            table_data = extract_table_data(sheet, start_row, start_col, end_row, end_col)
 
             # Extract metadata
-            column_metadata = extract_table_metadata(sheet_formulas, start_row, start_col, end_row, end_col, workbook_formulas)
+            column_metadata = extract_table_metadata(sheet, start_row, start_col, end_row, end_col, graph)
 
             tables.append({
                 "Coordinates": {"StartRow": start_row, "StartCol": start_col, "EndRow": end_row, "EndCol": end_col},
@@ -128,82 +93,89 @@ def extract_tables_with_column_names_and_dependencies(file_path):
 
     return tables_by_sheet
 
-def create_cell_to_column_map(tables_with_metadata):
-    """Create a global mapping of cells to column names."""
-    cell_to_column_map = {}
-    for sheet_name, tables in tables_with_metadata.items():
-        for table in tables:
-            coords = table["Coordinates"]
-            metadata = table["Metadata"]
-            for col_idx, meta in enumerate(metadata, start=coords["StartCol"]):
-                for row_idx in range(coords["StartRow"], coords["EndRow"] + 1):
-                    cell_to_column_map[(sheet_name, row_idx, col_idx)] = meta["ColumnName"]
-    return cell_to_column_map
-
-def enhance_formula_with_column_names(formula, cell_to_column_map, current_sheet_name):
-    """Enhance formulas with column names, handling cross-sheet references."""
-    cell_reference_pattern = re.compile(r"(?:(\w+)\!)?([A-Z]+)(\d+)")
+def enhance_formula_with_column_names(formula, column_index, current_sheet_name):
+    """Enhance formulas with column names, handling cross-sheet references and ranges."""
+    cell_reference_pattern = re.compile(
+        r'"(?:[^"]|"")*"'
+        r"|(?:('(?:[^']|'')+'|\w+)\!)?(\$?[A-Z]{1,3}\$?\d+(?::\$?[A-Z]{1,3}\$?\d+)?|\$?[A-Z]{1,3}:\$?[A-Z]{1,3})(?![\w(])"
+    )
 
     def replace_reference(match):
-        sheet_name = match.group(1) or current_sheet_name
-        col_letter = match.group(2)
-        row_number = int(match.group(3))
-
-        try:
-            # Convert column letter to index
-            col_index = column_index_from_string(col_letter)
-        except ValueError:
-            # If the column letter is invalid, leave it as-is
+        if match.group(2) is None:
+            # String literal, leave it as-is
             return match.group(0)
+        sheet_name = match.group(1) or current_sheet_name
+        if sheet_name.startswith("'"):
+            # Quoted sheet name: drop the quotes and unescape doubled ones
+            sheet_name = sheet_name[1:-1].replace("''", "'")
+        reference = match.group(2)
 
-        # Lookup in the precomputed map
-        col_name = cell_to_column_map.get((sheet_name, row_number, col_index), "Unknown")
+        # Lookup in the per-sheet interval index
+        col_names = column_index.resolve(sheet_name, reference)
+        if not col_names:
+            if parse_reference(reference) is None:
+                # Not a cell reference after all, leave it as-is
+                return match.group(0)
+            col_names = ["Unknown"]
 
-        return f"{match.group(0)}({col_name})"
+        return f"{match.group(0)}({', '.join(str(name) for name in col_names)})"
 
     return cell_reference_pattern.sub(replace_reference, formula)
 
-# Load and process the spreadsheet
-file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 1 - Inventory Planning.xlsx'
-# file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 2 - Supply Management.xlsx'
-# file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 3 - Inventory Dashboard _V2.xlsx'
-tables_with_metadata = extract_tables_with_column_names_and_dependencies(file_path)
-cell_to_column_map = create_cell_to_column_map(tables_with_metadata)
-
-# Enhance formulas in all metadata
-for sheet_name, tables in tables_with_metadata.items():
-    for table in tables:
-        for col_meta in table["Metadata"]:
-            if col_meta["Formula"]:
-                col_meta["EnhancedFormula"] = enhance_formula_with_column_names(
-                    col_meta["Formula"], cell_to_column_map, sheet_name
-                )
-
-
-# Display the extracted tables and metadata
-for sheet_name, tables in tables_with_metadata.items():
-    print(f"Sheet: {sheet_name}\n{'-' * 40}")
-    
-    for i, table_info in enumerate(tables):
+def enhance_table_formulas(tables_with_metadata, column_index):
+    """Add an EnhancedFormula to every column formula and formula class; returns how many were enhanced."""
+    enhanced = 0
+    for sheet_name, tables in tables_with_metadata.items():
+        for table in tables:
+            for col_meta in table["Metadata"]:
+                if col_meta["Formula"]:
+                    col_meta["EnhancedFormula"] = enhance_formula_with_column_names(
+                        col_meta["Formula"], column_index, sheet_name
+                    )
+                    enhanced += 1
+                for formula_class in col_meta["FormulaClasses"]:
+                    formula_class["EnhancedFormula"] = enhance_formula_with_column_names(
+                        formula_class["Formula"], column_index, sheet_name
+                    )
+                    enhanced += 1
+    return enhanced
+
+if __name__ == "__main__":
+    # Load and process the spreadsheet
+    file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 1 - Inventory Planning.xlsx'
+    # file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 2 - Supply Management.xlsx'
+    # file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 3 - Inventory Dashboard _V2.xlsx'
+    tables_with_metadata = extract_tables_with_column_names_and_dependencies(file_path)
+    column_index = build_column_index(tables_with_metadata)
+
+    # Enhance formulas in all metadata
+    enhance_table_formulas(tables_with_metadata, column_index)
+
+
+    # Display the extracted tables and metadata
+    for sheet_name, tables in tables_with_metadata.items():
         print(f"Sheet: {sheet_name}\n{'-' * 40}")
-        print(f"  Table {i + 1}:\n{'-' * 20}")
-        
-        # Safely extract and display table data if it exists
-        table_data = table_info.get("TableData", None)
-        if table_data:
-            print("    Table Data (First 6 Rows):")
-            df = pd.DataFrame(table_data)
-            print(df.head(6))  # Show the first 6 rows as a DataFrame
-        else:
-            print("    Table Data: Not available")
-        
-        # Safely extract and display metadata line by line if it exists
-        metadata = table_info.get("Metadata", None)
-        if metadata:
-            print("    Metadata:")
-            for col_meta in metadata:
-                print(f"      {col_meta}")
-        else:
-            print("    Metadata: Not available")
-        
-        print("\n")
+
+        for i, table_info in enumerate(tables):
+            print(f"Sheet: {sheet_name}\n{'-' * 40}")
+            print(f"  Table {i + 1}:\n{'-' * 20}")
+
+            # Safely extract and display table data if it exists
+            table_data = table_info.get("TableData", None)
+            if table_data:
+                print("    Table Data (First 6 Rows):")
+                df = pd.DataFrame(table_data)
+                print(df.head(6))  # Show the first 6 rows as a DataFrame
+            else:
+                print("    Table Data: Not available")
+
+            # Safely extract and display metadata line by line if it exists
+            metadata = table_info.get("Metadata", None)
+            if metadata:
+                print("    Metadata:")
+                for col_meta in metadata:
+                    print(f"      {col_meta}")
+            else:
+                print("    Metadata: Not available")
+
+            print("\n")
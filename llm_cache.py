@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+
+import tracing
+
+
+DEFAULT_CACHE_PATH = os.environ.get("LLM_CACHE_PATH", ".llm_cache.sqlite")
+
+
+def cache_key(model, temperature, prompt):
+    """Content address of an LLM call: sha256 of model, temperature and prompt."""
+    payload = json.dumps({"model": model, "temperature": temperature, "prompt": prompt}, sort_keys=True)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class LLMCache:
+    """
+    Persistent SQLite cache of LLM responses keyed by cache_key().
+
+    Entries older than max_age_seconds are dropped on read and on write; when the
+    stored responses exceed max_bytes the least recently used ones are evicted.
+    """
+
+    def __init__(self, path=DEFAULT_CACHE_PATH, max_bytes=256 * 1024 * 1024, max_age_seconds=30 * 24 * 3600):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age_seconds = max_age_seconds
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS responses (
+                key TEXT PRIMARY KEY,
+                model TEXT,
+                response TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+            """
+        )
+        self._conn.commit()
+
+    def get(self, key):
+        """Return the cached response for key, or None."""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT response, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is not None and self.max_age_seconds is not None and now - row[1] > self.max_age_seconds:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                self._conn.commit()
+                self.evictions += 1
+                row = None
+            if row is None:
+                self.misses += 1
+                return None
+            self._conn.execute("UPDATE responses SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+            return row[0]
+
+    def put(self, key, response, model=None):
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created, last_access) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")), now, now),
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def delete(self, key):
+        with self._lock:
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self, now):
+        if self.max_age_seconds is not None:
+            cursor = self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.max_age_seconds,))
+            self.evictions += max(cursor.rowcount, 0)
+        if self.max_bytes is None:
+            return
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY last_access").fetchall():
+            self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+            self.evictions += 1
+            total -= size
+            if total <= self.max_bytes:
+                break
+
+    def stats(self):
+        """Hit/miss/eviction counters for this process plus the current size of the cache."""
+        with self._lock:
+            entries, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": entries,
+            "bytes": size,
+        }
+
+    def close(self):
+        self._conn.close()
+
+
+class CachedResponse:
+    """Minimal stand-in for a chat message; callers only read .content."""
+
+    def __init__(self, content):
+        self.content = content
+
+
+class CachedLLM:
+    """
+    Wraps a LangChain chat model (or any object with invoke()) with an LLMCache.
+
+    invoke() and predict() mirror the chat model methods used by the scripts. Pass
+    refresh=True to skip the cached answer, e.g. when retrying after a bad response;
+    the fresh answer replaces the cached one.
+    """
+
+    def __init__(self, llm, cache=None):
+        self.llm = llm
+        self.cache = cache if cache is not None else LLMCache()
+        self.model = getattr(llm, "model_name", None) or getattr(llm, "model", None) or type(llm).__name__
+        self.temperature = getattr(llm, "temperature", None)
+
+    def key(self, prompt):
+        return cache_key(self.model, self.temperature, prompt)
+
+    def invoke(self, prompt, refresh=False):
+        key = self.key(prompt)
+        with tracing.span("llm", model=self.model, cached=False) as span:
+            if not refresh:
+                cached = self.cache.get(key)
+                if cached is not None:
+                    span["cached"] = True
+                    return CachedResponse(cached)
+            response = self.llm.invoke(prompt)
+            content = response.content if hasattr(response, "content") else str(response)
+            span.update(tracing.llm_usage(self.model, prompt, response, content))
+        self.cache.put(key, content, model=self.model)
+        return CachedResponse(content)
+
+    def predict(self, prompt, refresh=False):
+        return self.invoke(prompt, refresh=refresh).content
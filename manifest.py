@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+
+
+MANIFEST_NAME = ".manifest.json"
+
+
+def file_hash(path, chunk_size=1 << 20):
+    """sha256 of a file's bytes."""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(chunk_size), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+class Manifest:
+    """
+    Content hashes from the last run over one workbook's output folder.
+
+    "sheets" maps a sheet name to the content hash of its cells and the files its
+    extraction wrote; "tables" maps a "sheet folder/file" key to the hash of the table
+    file that was last analyzed. Entries are only recorded after a step succeeds, so
+    failed sheets and tables are retried on the next run.
+    """
+
+    def __init__(self, folder):
+        self.path = os.path.join(folder, MANIFEST_NAME)
+        self.sheets = {}
+        self.tables = {}
+        if os.path.exists(self.path):
+            with open(self.path) as f:
+                data = json.load(f)
+            self.sheets = data.get("sheets", {})
+            self.tables = data.get("tables", {})
+
+    def save(self):
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"sheets": self.sheets, "tables": self.tables}, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def sheet_changed(self, sheet_name, content_hash, sheet_folder):
+        """True unless the sheet has the recorded hash and all the files it produced still exist."""
+        entry = self.sheets.get(sheet_name)
+        if entry is None or entry["hash"] != content_hash:
+            return True
+        return not all(os.path.exists(os.path.join(sheet_folder, name)) for name in entry["files"])
+
+    def clear_sheet(self, sheet_name, sheet_folder):
+        """Remove the files a sheet's previous extraction wrote, so stale tables don't linger."""
+        entry = self.sheets.pop(sheet_name, None)
+        for name in entry["files"] if entry else []:
+            path = os.path.join(sheet_folder, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def record_sheet(self, sheet_name, content_hash, files):
+        self.sheets[sheet_name] = {"hash": content_hash, "files": sorted(files)}
+        self.save()
+
+    def table_changed(self, key, content_hash):
+        return self.tables.get(key) != content_hash
+
+    def record_table(self, key, content_hash):
+        self.tables[key] = content_hash
+
+    def clear_tables(self):
+        self.tables = {}
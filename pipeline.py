@@ -0,0 +1,214 @@
+import os
+import csv
+import time
+import asyncio
+import argparse
+import tempfile
+from langchain.chat_models import ChatOpenAI
+
+import table_extraction
+import tracing
+from async_llm import AsyncLLMClient
+from code_executor import ScriptExecutor
+from sheet_chunker import DEFAULT_TOKEN_BUDGET
+from table_analysis import (RESULT_COLUMNS, analysis_row, analyze_batch_async, failed_row, list_sheet_tables,
+                            plan_analysis)
+from table_store import read_head
+
+# Marks the end of the table stream for one analysis worker
+DONE = None
+
+
+class ResultsWriter:
+    """Appends analysis rows to one results CSV per workbook as soon as they are ready."""
+
+    def __init__(self, results_dir):
+        self.results_dir = results_dir
+        self.rows = 0
+        self._files = {}
+        os.makedirs(results_dir, exist_ok=True)
+
+    def start(self, workbook_name):
+        path = os.path.join(self.results_dir, f"{workbook_name}.csv")
+        f = open(path, "w", newline="")
+        writer = csv.DictWriter(f, fieldnames=RESULT_COLUMNS)
+        writer.writeheader()
+        f.flush()
+        self._files[workbook_name] = (f, writer)
+        return path
+
+    def write(self, workbook_name, row):
+        f, writer = self._files[workbook_name]
+        writer.writerow(row)
+        f.flush()
+        self.rows += 1
+
+    def close(self):
+        for f, _ in self._files.values():
+            f.close()
+        self._files = {}
+
+
+async def extract_workbook(file_path, tables_dir, client, queue, writer):
+    """
+    Extract every sheet of one workbook concurrently; each sheet's tables are put on the
+    queue as soon as the sheet is done, waiting whenever the analysis stage is behind.
+    """
+    with tracing.span("workbook", workbook=os.path.splitext(os.path.basename(file_path))[0]):
+        await _extract_workbook(file_path, tables_dir, client, queue, writer)
+
+
+async def _extract_workbook(file_path, tables_dir, client, queue, writer):
+    # Loading is CPU-bound; in a thread it doesn't stall the analysis workers
+    base_dir = await asyncio.to_thread(table_extraction.open_workbook, file_path, tables_dir)
+    workbook_name = os.path.basename(base_dir)
+    writer.start(workbook_name)
+
+    async def extract_sheet(sheet_name):
+        try:
+            result = await table_extraction.run_analysis_async(sheet_name, client)
+        except Exception as e:
+            print(f"[{sheet_name}] Extraction failed: {e}")
+            return
+        print('-'*40, f'\nSheet: {sheet_name}\n{result}')
+        sheet_folder = os.path.join(base_dir, sheet_name)
+        for file in list_sheet_tables(sheet_folder):
+            await queue.put((workbook_name, sheet_name, file, os.path.join(sheet_folder, file)))
+
+    await asyncio.gather(*(extract_sheet(sheet_name) for sheet_name in table_extraction.sheet_names))
+
+
+async def next_batch(queue, batch_size, batch_wait):
+    """Up to batch_size queued tables: waits for the first, then takes what arrives within batch_wait."""
+    item = await queue.get()
+    if item is DONE:
+        return [], True
+    batch = [item]
+    while len(batch) < batch_size:
+        try:
+            item = await asyncio.wait_for(queue.get(), timeout=batch_wait)
+        except asyncio.TimeoutError:
+            break
+        if item is DONE:
+            return batch, True
+        batch.append(item)
+    return batch, False
+
+
+async def analysis_worker(queue, client, writer, prefilter=True, batch_size=5, batch_wait=0.5):
+    """Classify queued tables in batches and write each result row as soon as it is known."""
+    done = False
+    while not done:
+        batch, done = await next_batch(queue, batch_size, batch_wait)
+        if not batch:
+            continue
+        workbooks = {workbook_name for workbook_name, *_ in batch}
+        try:
+            with tracing.span("analyze_tables", workbook=workbooks.pop() if len(workbooks) == 1 else None,
+                              tables=len(batch)):
+                dataframes = await asyncio.gather(*(asyncio.to_thread(read_head, path) for *_, path in batch))
+                responses, llm_batches = plan_analysis(dataframes, prefilter, batch_size)
+                results = await asyncio.gather(
+                    *(analyze_batch_async([dataframes[i] for i in llm_batch], client) for llm_batch in llm_batches)
+                )
+                for llm_batch, batch_results in zip(llm_batches, results):
+                    for i, response in zip(llm_batch, batch_results):
+                        responses[i] = response
+        except Exception as e:
+            print(f"Analysis failed for {[file for _, _, file, _ in batch]}: {e}")
+            continue
+        for (workbook_name, sheet_name, file, _), response in zip(batch, responses):
+            if response:
+                writer.write(workbook_name, analysis_row(sheet_name, file, response))
+                print(f"Result: {workbook_name} / {sheet_name} / {file}: "
+                      f"is_inventory_planning={response.is_inventory_planning}")
+            else:
+                print(f"Failed to analyze file: {file}")
+                writer.write(workbook_name, failed_row(sheet_name, file))
+
+
+async def run_pipeline(workbooks, client, results_dir, tables_dir, queue_size=32, analysis_workers=4,
+                       prefilter=True, batch_size=5, batch_wait=0.5):
+    """
+    Extract and analyze workbooks in one process.
+
+    Workbooks are extracted one after another (their sheets concurrently); extracted
+    tables flow through a bounded queue into analysis_workers analysis tasks, so the
+    first results are written while later sheets are still being extracted. A full
+    queue blocks extraction until analysis catches up. A workbook that fails to load
+    or extract is logged and skipped.
+    """
+    queue = asyncio.Queue(maxsize=queue_size)
+    writer = ResultsWriter(results_dir)
+    start = time.perf_counter()
+    workers = [
+        asyncio.create_task(analysis_worker(queue, client, writer, prefilter, batch_size, batch_wait))
+        for _ in range(analysis_workers)
+    ]
+    try:
+        for file_path in workbooks:
+            print("Processing File", file_path)
+            try:
+                await extract_workbook(file_path, tables_dir, client, queue, writer)
+            except Exception as e:
+                # An unreadable workbook is skipped; the others and the analysis workers carry on
+                print(f"Skipping {file_path}: {type(e).__name__}: {e}")
+        for _ in workers:
+            await queue.put(DONE)
+        await asyncio.gather(*workers)
+    finally:
+        writer.close()
+    print(f"Wrote {writer.rows} result row(s) to {results_dir} in {time.perf_counter() - start:.1f}s")
+    return writer.rows
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract and analyze workbooks in one streaming pipeline.")
+    parser.add_argument("workbooks", nargs="+", help="Paths of the .xlsx files to process.")
+    parser.add_argument("--results-dir", default=os.getcwd(), help="Folder for the per-workbook results CSVs.")
+    parser.add_argument("--tables-dir", default=None,
+                        help="Keep the extracted tables in this folder (default: a temporary folder removed at exit).")
+    parser.add_argument("--queue-size", type=int, default=32, help="Extracted tables waiting for analysis.")
+    parser.add_argument("--analysis-workers", type=int, default=4)
+    parser.add_argument("--batch-size", type=int, default=5, help="Table previews per LLM request.")
+    parser.add_argument("--no-prefilter", dest="prefilter", action="store_false",
+                        help="Send every table to the LLM instead of deciding clear cases locally.")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=500, help="Requests per minute limit.")
+    parser.add_argument("--tpm", type=int, default=200_000, help="Tokens per minute limit.")
+    parser.add_argument("--exec-workers", type=int, default=None, help="Generated scripts run at once.")
+    parser.add_argument("--exec-cpu-seconds", type=int, default=60, help="CPU time limit per generated script.")
+    parser.add_argument("--exec-memory-mb", type=int, default=2048, help="Memory limit per generated script.")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help="Token budget for the sheet outline in each prompt.")
+    parser.add_argument("--no-code-reuse", dest="reuse_code", action="store_false",
+                        help="Always generate new code instead of reusing code stored for the same sheet layout.")
+    parser.add_argument("--full", dest="incremental", action="store_false",
+                        help="Re-extract every sheet, even those unchanged since the last run.")
+    parser.add_argument("--trace", default=tracing.DEFAULT_TRACE_PATH,
+                        help="Write timing, token and cost spans to this JSONL file and print a summary at the end.")
+    args = parser.parse_args()
+    tracing.configure(args.trace)
+
+    table_extraction.chunk_token_budget = args.chunk_tokens
+    table_extraction.reuse_code = args.reuse_code
+    table_extraction.incremental = args.incremental
+    table_extraction.executor = ScriptExecutor(max_workers=args.exec_workers, cpu_seconds=args.exec_cpu_seconds,
+                                               memory_mb=args.exec_memory_mb)
+    client = AsyncLLMClient(ChatOpenAI(model="gpt-4o-mini", temperature=0), max_concurrency=args.max_concurrency,
+                            requests_per_minute=args.rpm, tokens_per_minute=args.tpm, cache=table_extraction.llm_cache)
+
+    with tempfile.TemporaryDirectory() as scratch:
+        asyncio.run(run_pipeline(
+            [os.path.abspath(path) for path in args.workbooks], client, args.results_dir,
+            os.path.abspath(args.tables_dir) if args.tables_dir else scratch,
+            queue_size=args.queue_size, analysis_workers=args.analysis_workers,
+            prefilter=args.prefilter, batch_size=args.batch_size,
+        ))
+
+    table_extraction.executor.shutdown()
+    print("LLM cache stats:", table_extraction.llm_cache.stats())
+    print("Code reuse stats:", table_extraction.code_store.stats())
+    if args.trace:
+        tracing.tracer.close()
+        print(tracing.format_summary(tracing.summarize(args.trace)))
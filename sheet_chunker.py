@@ -0,0 +1,147 @@
+import datetime
+
+import numpy as np
+from openpyxl.utils import get_column_letter
+
+import tracing
+from async_llm import estimate_tokens
+from table_detection import detect_tables
+from workbook_grid import EMPTY, INT, FLOAT
+
+
+DEFAULT_TOKEN_BUDGET = 8000
+
+# Detail levels tried from richest to coarsest until the outline fits the budget:
+# (header rows, tail rows, body rows, max characters per cell, max columns per table)
+LEVELS = [
+    (5, 2, 8, 40, 60),
+    (3, 1, 4, 24, 30),
+    (2, 1, 2, 16, 20),
+    (1, 0, 1, 12, 12),
+    (1, 0, 0, 8, 8),
+]
+
+
+def _range_ref(start_row, start_col, end_row, end_col):
+    return f"{get_column_letter(start_col)}{start_row}:{get_column_letter(end_col)}{end_row}"
+
+
+def _format_value(value, max_chars):
+    if value is None:
+        return ""
+    if isinstance(value, datetime.datetime) and value.time() == datetime.time(0):
+        text = value.date().isoformat()
+    else:
+        text = str(value).replace("\r", " ").replace("\n", " ")
+    if len(text) > max_chars:
+        text = text[:max_chars - 1] + "…"
+    return text
+
+
+def _row_runs(types):
+    """(start offset, length, is_blank) for each run of consecutive rows with the same type layout."""
+    if not len(types):
+        return []
+    # Integers and floats share a layout, so 3 and 4.5 in the same column don't split a run
+    types = np.where(types == FLOAT, INT, types)
+    same = np.all(types[1:] == types[:-1], axis=1)
+    starts = np.flatnonzero(np.concatenate(([True], ~same)))
+    lengths = np.diff(np.append(starts, len(types)))
+    blank = (types[starts] == EMPTY).all(axis=1)
+    return list(zip(starts.tolist(), lengths.tolist(), blank.tolist()))
+
+
+def _render_row(sheet, row, start_col, end_col, max_chars):
+    values = [_format_value(v, max_chars)
+              for v in next(sheet.iter_rows(min_row=row, max_row=row, min_col=start_col, max_col=end_col,
+                                            formulas=True))]
+    while values and not values[-1]:
+        values.pop()
+    return f"{row}: " + ", ".join(values)
+
+
+def _table_lines(sheet, number, box, runs, level):
+    """Outline of one table: header rows, one sample per same-layout run of the body, and the last rows."""
+    header_rows, tail_rows, body_rows, max_chars, max_columns = level
+    start_row, start_col, end_row, end_col = box
+    n_rows, width = end_row - start_row + 1, end_col - start_col + 1
+    shown_end_col = start_col + min(width, max_columns) - 1
+
+    title = (f"Table {number}: {_range_ref(*box)} ({n_rows} rows x {width} columns, "
+             f"values start at column {get_column_letter(start_col)}")
+    if shown_end_col < end_col:
+        title += f", first {shown_end_col - start_col + 1} columns shown"
+    lines = [title + ")"]
+
+    head_end = start_row + min(header_rows, n_rows) - 1
+    tail_start = max(head_end + 1, end_row - tail_rows + 1)
+    for row in range(start_row, head_end + 1):
+        lines.append(_render_row(sheet, row, start_col, shown_end_col, max_chars))
+
+    shown = 0
+    for offset, length, blank in runs:
+        first = max(start_row + offset, head_end + 1)
+        last = min(start_row + offset + length - 1, tail_start - 1)
+        if first > last:
+            continue
+        if blank:
+            lines.append(f"rows {first}-{last}: blank" if last > first else f"row {first}: blank")
+        elif shown >= body_rows:
+            lines.append(f"rows {first}-{tail_start - 1}: {tail_start - first} rows omitted")
+            break
+        else:
+            lines.append(_render_row(sheet, first, start_col, shown_end_col, max_chars))
+            shown += 1
+            if last > first:
+                lines.append(f"rows {first + 1}-{last}: {last - first} more rows with the same layout as row {first}")
+
+    for row in range(tail_start, end_row + 1):
+        lines.append(_render_row(sheet, row, start_col, shown_end_col, max_chars))
+    return lines
+
+
+def chunk_sheet(sheet, token_budget=DEFAULT_TOKEN_BUDGET, detection_settings=None):
+    """
+    Token-budgeted text outline of a SheetGrid for the code-generation prompt.
+
+    Every table found by table_detection.detect_tables is described by its range,
+    its header rows, one sample row per run of same-layout body rows (the rest of
+    the run collapsed into a summary line) and its last rows. Long values are cut.
+    The detail level is lowered until the outline fits token_budget; if even the
+    coarsest level is too large, trailing tables are listed by range only.
+    """
+    if not sheet.max_row:
+        return f"Sheet '{sheet.title}' is empty."
+    with tracing.span("detect") as span:
+        boxes = detect_tables(sheet.occupancy(), **(detection_settings or {}))
+        span["tables"] = len(boxes)
+    runs = [_row_runs(sheet.type_grid(*box)) for box in boxes]
+    intro = (f"Sheet '{sheet.title}': {sheet.max_row} rows x {sheet.max_column} columns, {len(boxes)} table(s). "
+             f"Each line starts with the Excel row number, followed by the comma-separated cell values "
+             f"from the table's first column on.")
+
+    for level in LEVELS:
+        sections = ["\n".join(_table_lines(sheet, i, box, table_runs, level))
+                    for i, (box, table_runs) in enumerate(zip(boxes, runs), start=1)]
+        text = "\n\n".join([intro] + sections)
+        if estimate_tokens(text) <= token_budget:
+            return text
+
+    # Even the coarsest outline is too large: keep whole tables while they fit, then list the rest
+    parts, used = [intro], estimate_tokens(intro)
+    for i, section in enumerate(sections):
+        cost = estimate_tokens(section) + 1
+        if used + cost > token_budget:
+            rest = [f"Table {j}: {_range_ref(*boxes[j - 1])}" for j in range(i + 1, len(boxes) + 1)]
+            listing = []
+            for entry in rest:
+                used += estimate_tokens(entry) + 1
+                if used > token_budget:
+                    listing.append(f"... and {len(rest) - len(listing)} more table(s)")
+                    break
+                listing.append(entry)
+            parts.append("\n".join(listing))
+            break
+        parts.append(section)
+        used += cost
+    return "\n\n".join(parts)
@@ -0,0 +1,165 @@
+import random
+import argparse
+from dataclasses import dataclass
+
+from openpyxl import Workbook
+from openpyxl.utils import get_column_letter
+
+
+LOCATIONS = ["DC-East", "DC-West", "Store 12", "Store 40", "Plant A"]
+DATA_HEADERS = ["Qty On Hand", "Forecast", "Units Sold", "Reorder Point", "Safety Stock", "Open PO Qty",
+                "Lead Time", "Unit Cost"]
+ITEMS_SHEET = "Items"
+
+
+@dataclass
+class WorkbookSpec:
+    """
+    Shape of a synthetic planning workbook.
+
+    Every data sheet holds tables_per_sheet tables, stacked with blank rows between
+    them; with side_by_side, tables are laid out in pairs separated by a blank column.
+    Each table has a SKU and a location column followed by numeric columns, and
+    formula_density of its columns (at least one when above zero, and never so many
+    that fewer than two numeric data columns are left) hold formulas:
+    products, running totals, IFs, SUMIFs and, with cross_sheet, VLOOKUPs into the
+    Items sheet and references to the previous sheet.
+    """
+
+    sheets: int = 3
+    rows: int = 200
+    cols: int = 8
+    tables_per_sheet: int = 2
+    side_by_side: bool = True
+    formula_density: float = 0.3
+    cross_sheet: bool = True
+    skus: int = 500
+    seed: int = 0
+
+
+def _formula(kind, row, first_row, columns, sheet_index, table):
+    """Formula of a given kind for one row of a table; columns maps roles to column letters."""
+    qty, forecast, sku, location = columns["qty"], columns["forecast"], columns["sku"], columns["location"]
+    if kind == "product":
+        return f"={qty}{row}*{forecast}{row}"
+    if kind == "running":
+        own = columns["own"]
+        return f"={qty}{row}" if row == first_row else f"={own}{row - 1}+{qty}{row}"
+    if kind == "if":
+        return f"=IF({qty}{row}>{forecast}{row},{qty}{row}-{forecast}{row},0)"
+    if kind == "sumif":
+        last = table["last_row"]
+        return f"=SUMIF(${location}${first_row}:${location}${last},{location}{row},${qty}${first_row}:${qty}${last})"
+    if kind == "lookup":
+        return f"={qty}{row}*VLOOKUP({sku}{row},{ITEMS_SHEET}!$A$2:$C${table['skus'] + 1},3,FALSE)"
+    # "previous": the same cell of the previous data sheet
+    return f"='Sheet {sheet_index - 1}'!{qty}{row}+{forecast}{row}"
+
+
+def _table_block(spec, rng, sheet_index, first_row, first_col, n_rows):
+    """Rows (lists of cell contents) of one table whose header sits at (first_row, first_col)."""
+    # Formulas combine two data columns (qty and forecast), so at least two are kept
+    n_formulas = 0 if spec.formula_density <= 0 else min(spec.cols - 4, max(1, round(spec.cols * spec.formula_density)))
+    n_data = spec.cols - 2 - n_formulas
+    letters = [get_column_letter(first_col + i) for i in range(spec.cols)]
+    columns = {"sku": letters[0], "location": letters[1], "qty": letters[2], "forecast": letters[min(3, 2 + n_data - 1)]}
+    table = {"last_row": first_row + n_rows, "skus": spec.skus}
+
+    # Cross-sheet kinds come early so they show up even at low formula density
+    kinds = ["product", "previous", "lookup", "running", "sumif", "if"]
+    if not spec.cross_sheet:
+        kinds = [kind for kind in kinds if kind not in ("previous", "lookup")]
+    elif sheet_index == 1:
+        kinds.remove("previous")
+    formula_kinds = [kinds[i % len(kinds)] for i in range(n_formulas)]
+    headers = (["SKU", "Location"] + [DATA_HEADERS[i % len(DATA_HEADERS)] for i in range(n_data)]
+               + [f"{kind.title()} Calc" for kind in formula_kinds])
+
+    block = [headers]
+    for row in range(first_row + 1, first_row + n_rows + 1):
+        values = [f"SKU-{rng.randrange(spec.skus):05d}", rng.choice(LOCATIONS)]
+        values += [rng.randint(0, 500) if i < 2 else round(rng.uniform(1, 100), 2) for i in range(n_data)]
+        for i, kind in enumerate(formula_kinds):
+            columns["own"] = letters[2 + n_data + i]
+            values.append(_formula(kind, row, first_row + 1, columns, sheet_index, table))
+        block.append(values)
+    return block
+
+
+def generate_workbook(path, spec=None, **overrides):
+    """
+    Write a synthetic .xlsx following a WorkbookSpec (keyword arguments override its
+    fields) and return the spec used. Formula cells carry no cached values, as in
+    files saved by tools other than Excel.
+    """
+    spec = spec or WorkbookSpec()
+    for name, value in overrides.items():
+        setattr(spec, name, value)
+    if spec.cols < 3:
+        raise ValueError("tables need at least 3 columns (SKU, location and one number)")
+    if spec.cols < 5 and spec.formula_density > 0:
+        raise ValueError("formulas need at least 5 columns per table (SKU, location, two numbers and a formula)")
+    rng = random.Random(spec.seed)
+    workbook = Workbook(write_only=True)
+
+    items = workbook.create_sheet(ITEMS_SHEET)
+    items.append(["SKU", "Description", "Unit Cost"])
+    for i in range(spec.skus):
+        items.append([f"SKU-{i:05d}", f"Item {i}", round(rng.uniform(0.5, 80), 2)])
+
+    per_row = 2 if spec.side_by_side and spec.tables_per_sheet > 1 else 1
+    bands = -(-spec.tables_per_sheet // per_row)
+    rows_per_table = max(1, spec.rows // bands)
+    for sheet_index in range(1, spec.sheets + 1):
+        grid = {}
+        placed = 0
+        for band in range(bands):
+            first_row = 1 + band * (rows_per_table + 3)
+            for slot in range(min(per_row, spec.tables_per_sheet - placed)):
+                first_col = 1 + slot * (spec.cols + 1)
+                block = _table_block(spec, rng, sheet_index, first_row, first_col, rows_per_table)
+                for offset, values in enumerate(block):
+                    row = grid.setdefault(first_row + offset, {})
+                    for col_offset, value in enumerate(values):
+                        row[first_col + col_offset] = value
+                placed += 1
+
+        sheet = workbook.create_sheet(f"Sheet {sheet_index}")
+        width = max((max(row) for row in grid.values()), default=0)
+        for row_number in range(1, max(grid, default=0) + 1):
+            row = grid.get(row_number, {})
+            sheet.append([row.get(col) for col in range(1, width + 1)])
+    workbook.save(path)
+    return spec
+
+
+def add_spec_arguments(parser):
+    """Command-line options for the WorkbookSpec fields, shared with benchmark.py."""
+    defaults = WorkbookSpec()
+    parser.add_argument("--sheets", type=int, default=defaults.sheets)
+    parser.add_argument("--rows", type=int, default=defaults.rows, help="Data rows per sheet (split across stacked tables).")
+    parser.add_argument("--cols", type=int, default=defaults.cols, help="Columns per table.")
+    parser.add_argument("--tables-per-sheet", type=int, default=defaults.tables_per_sheet)
+    parser.add_argument("--no-side-by-side", dest="side_by_side", action="store_false",
+                        help="Stack all tables vertically instead of in side-by-side pairs.")
+    parser.add_argument("--formula-density", type=float, default=defaults.formula_density,
+                        help="Share of each table's columns holding formulas.")
+    parser.add_argument("--no-cross-sheet", dest="cross_sheet", action="store_false",
+                        help="Leave out VLOOKUPs into the Items sheet and references to the previous sheet.")
+    parser.add_argument("--skus", type=int, default=defaults.skus)
+    parser.add_argument("--seed", type=int, default=defaults.seed)
+
+
+def spec_from_args(args):
+    return WorkbookSpec(**{name: getattr(args, name) for name in WorkbookSpec.__dataclass_fields__})
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Write a synthetic inventory planning workbook.")
+    parser.add_argument("path", help="Output .xlsx path.")
+    add_spec_arguments(parser)
+    args = parser.parse_args()
+
+    spec = spec_from_args(args)
+    generate_workbook(args.path, spec)
+    print(f"Wrote {args.path}: {spec}")
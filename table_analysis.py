@@ -1,9 +1,18 @@
 import os
+import asyncio
+import argparse
 import pandas as pd
 from pydantic import BaseModel, Field, ValidationError
 from langchain.chat_models import ChatOpenAI
 import json
 
+import tracing
+from async_llm import AsyncLLMClient
+from llm_cache import CachedLLM, LLMCache
+from manifest import Manifest, file_hash
+from table_store import CATALOG_NAME, read_catalog, read_head
+from table_prefilter import prefilter_table
+
 
 # Define the structured output schema
 class InventorySheetAnalysis(BaseModel):
@@ -22,6 +31,17 @@ class InventorySheetAnalysis(BaseModel):
     )
 
 
+# One result of a batched request, tied back to its table by table_id
+class InventoryTableAnalysis(InventorySheetAnalysis):
+    table_id: int = Field(..., description="Id of the table preview this result belongs to")
+
+
+class InventoryBatchAnalysis(BaseModel):
+    results: list[InventoryTableAnalysis] = Field(
+        ..., description="One analysis per table preview in the request."
+    )
+
+
 # Function to clean the LLM response
 def clean_response(response: str) -> str:
     if response.startswith("```json"):
@@ -31,11 +51,11 @@ def clean_response(response: str) -> str:
     return response.strip()  # Strip any extra whitespace
 
 
-# Function to analyze a sheet using GPT-4o-mini
-def analyze_sheet(dataframe, llm, retries=10):
+# Prompt asking GPT-4o-mini to classify a 5-row preview of a sheet
+def build_analysis_prompt(dataframe):
     markdown_preview = dataframe.head(5).to_markdown()
 
-    prompt = f"""
+    return f"""
     You are a data analysis expert. Below is a preview of a sheet:
 
     {markdown_preview}
@@ -61,14 +81,46 @@ def analyze_sheet(dataframe, llm, retries=10):
     }}
     """
 
+
+# Function to analyze a sheet using GPT-4o-mini
+def analyze_sheet(dataframe, llm, retries=10):
+    prompt = build_analysis_prompt(dataframe)
+
+    refresh = False
     while retries > 0:
         try:
-            response = llm.predict(prompt)
+            # After a bad response, bypass the cache so the retry gets a fresh answer
+            response = llm.predict(prompt, refresh=refresh)
             cleaned_response = clean_response(response)
             structured_output = InventorySheetAnalysis.model_validate_json(cleaned_response)
             return structured_output
         except ValidationError as ve:
             print(f"Validation Error: {ve}")
+            tracing.increment("retries")
+            refresh = True
+            retries -= 1
+            print(f"Retries left: {retries}")
+            if retries == 0:
+                print("Max retries reached. Skipping this sheet.")
+                return None
+        except Exception as e:
+            print(f"Unexpected Error: {e}")
+            return None
+
+
+# Async variant of analyze_sheet for use with an AsyncLLMClient
+async def analyze_sheet_async(dataframe, client, retries=10):
+    prompt = build_analysis_prompt(dataframe)
+
+    refresh = False
+    while retries > 0:
+        try:
+            response = await client.apredict(prompt, refresh=refresh)
+            return InventorySheetAnalysis.model_validate_json(clean_response(response))
+        except ValidationError as ve:
+            print(f"Validation Error: {ve}")
+            tracing.increment("retries")
+            refresh = True
             retries -= 1
             print(f"Retries left: {retries}")
             if retries == 0:
@@ -79,53 +131,342 @@ def analyze_sheet(dataframe, llm, retries=10):
             return None
 
 
-# Function to process all CSV files in a base folder
-def analyze_csv_files(base_folder, llm):
+# Prompt asking GPT-4o-mini to classify several table previews in one request
+def build_batch_prompt(dataframes):
+    previews = "\n\n".join(
+        f"    Table {table_id}:\n{dataframe.head(5).to_markdown()}" for table_id, dataframe in enumerate(dataframes)
+    )
+
+    return f"""
+    You are a data analysis expert. Below are previews of {len(dataframes)} tables, each labelled with a table id:
+
+{previews}
+
+    Task, for EVERY table:
+    1. Determine if this table is used for inventory planning (1 for Yes, 0 for No).
+    2. If Yes, provide:
+       - 'details': A dictionary mapping column names to these roles: SKU, Location/Warehouse, Quantity, Total Inventory, Current Inventory, Sales Forecast. If no related column exists, set the value to None.
+       - 'description': A brief explanation explaining why this table is for inventory planning.
+
+    Respond strictly in the following JSON format, with one entry per table id:
+    {{
+        "results": [
+            {{
+                "table_id": 0,
+                "is_inventory_planning": 1,
+                "details": {{
+                    "SKU": "Column Name or None",
+                    "Location/Warehouse": "Column Name or None",
+                    "Quantity": "Column Name or None",
+                    "Total Inventory": "Column Name or None",
+                    "Current Inventory": "Column Name or None",
+                    "Sales Forecast": "Column Name or None"
+                }},
+                "description": "Brief explanation"
+            }}
+        ]
+    }}
+    """
+
+
+def _split_batch(batch, count):
+    """Map a parsed batch back to table positions; ids the LLM skipped stay None."""
+    responses = [None] * count
+    for result in batch.results:
+        if 0 <= result.table_id < count and responses[result.table_id] is None:
+            responses[result.table_id] = InventorySheetAnalysis(**result.model_dump(exclude={"table_id"}))
+    return responses
+
+
+# Function to analyze several tables with one GPT-4o-mini request
+def analyze_batch(dataframes, llm, retries=3):
+    with tracing.span("analysis", tables=len(dataframes)):
+        return _analyze_batch(dataframes, llm, retries)
+
+
+def _analyze_batch(dataframes, llm, retries):
+    if len(dataframes) == 1:
+        return [analyze_sheet(dataframe=dataframes[0], llm=llm)]
+    prompt = build_batch_prompt(dataframes)
+
+    responses = [None] * len(dataframes)
+    refresh = False
+    while retries > 0:
+        try:
+            response = llm.predict(prompt, refresh=refresh)
+            responses = _split_batch(InventoryBatchAnalysis.model_validate_json(clean_response(response)),
+                                     len(dataframes))
+            break
+        except ValidationError as ve:
+            print(f"Validation Error: {ve}")
+            tracing.increment("retries")
+            refresh = True
+            retries -= 1
+            print(f"Retries left: {retries}")
+        except Exception as e:
+            print(f"Unexpected Error: {e}")
+            break
+
+    # Tables missing from the batch answer fall back to one request each
+    return [
+        response if response is not None else analyze_sheet(dataframe=dataframe, llm=llm)
+        for dataframe, response in zip(dataframes, responses)
+    ]
+
+
+# Async variant of analyze_batch
+async def analyze_batch_async(dataframes, client, retries=3):
+    with tracing.span("analysis", tables=len(dataframes)):
+        return await _analyze_batch_async(dataframes, client, retries)
+
+
+async def _analyze_batch_async(dataframes, client, retries):
+    if len(dataframes) == 1:
+        return [await analyze_sheet_async(dataframes[0], client)]
+    prompt = build_batch_prompt(dataframes)
+
+    responses = [None] * len(dataframes)
+    refresh = False
+    while retries > 0:
+        try:
+            response = await client.apredict(prompt, refresh=refresh)
+            responses = _split_batch(InventoryBatchAnalysis.model_validate_json(clean_response(response)),
+                                     len(dataframes))
+            break
+        except ValidationError as ve:
+            print(f"Validation Error: {ve}")
+            tracing.increment("retries")
+            refresh = True
+            retries -= 1
+            print(f"Retries left: {retries}")
+        except Exception as e:
+            print(f"Unexpected Error: {e}")
+            break
+
+    missing = [i for i, response in enumerate(responses) if response is None]
+    fallbacks = await asyncio.gather(*(analyze_sheet_async(dataframes[i], client) for i in missing))
+    for i, response in zip(missing, fallbacks):
+        responses[i] = response
+    return responses
+
+
+def plan_analysis(dataframes, prefilter=True, batch_size=5):
+    """
+    Decide clear-cut tables locally and group the rest into LLM batches.
+
+    Returns (responses, batches): responses holds the local InventorySheetAnalysis or
+    None per table, batches lists the table positions to send together.
+    """
+    responses = [None] * len(dataframes)
+    ambiguous = []
+    for i, dataframe in enumerate(dataframes):
+        local = prefilter_table(dataframe) if prefilter else None
+        if local is None:
+            ambiguous.append(i)
+        else:
+            responses[i] = InventorySheetAnalysis(**local)
+    batch_size = max(1, batch_size)
+    batches = [ambiguous[i:i + batch_size] for i in range(0, len(ambiguous), batch_size)]
+    print(f"{len(dataframes) - len(ambiguous)} table(s) decided locally, "
+          f"{len(ambiguous)} sent to the LLM in {len(batches)} request(s)")
+    return responses, batches
+
+
+RESULT_COLUMNS = ["sheet_name", "file", "is_inventory_planning", "description", "SKU", "Location/Warehouse",
+                  "Quantity", "Total Inventory", "Current Inventory", "Sales Forecast"]
+
+
+def analysis_row(sheet_name, file, response):
+    """Flatten an InventorySheetAnalysis into one row of the results CSV."""
+    # Unpack the details dictionary into individual columns
+    details = response.details
+    return {
+        'sheet_name': sheet_name,
+        "file": file,
+        "is_inventory_planning": response.is_inventory_planning,
+        "description": response.description,
+        "SKU": details.get("SKU"),
+        "Location/Warehouse": details.get("Location/Warehouse"),
+        "Quantity": details.get("Quantity"),
+        "Total Inventory": details.get("Total Inventory"),
+        "Current Inventory": details.get("Current Inventory"),
+        "Sales Forecast": details.get("Sales Forecast"),
+    }
+
+
+def failed_row(sheet_name, file):
+    """Placeholder row for a table whose analysis failed, so no earlier result for it survives a merge."""
+    return {**dict.fromkeys(RESULT_COLUMNS), "sheet_name": sheet_name, "file": file,
+            "description": "Analysis failed; the table is analyzed again on the next run."}
+
+
+def collect_rows(tables, responses):
     results = []
+    for (folder, file, _), response in zip(tables, responses):
+        if response:
+            results.append(analysis_row(folder, file, response))
+        else:
+            print(f"Failed to analyze file: {file}")
+            results.append(failed_row(folder, file))
+    return pd.DataFrame(results, columns=RESULT_COLUMNS)
+
 
+def list_sheet_tables(folder_path):
+    """File names of the tables in one sheet folder: the Arrow tables in its catalog, plus any CSV files."""
+    files = []
+    if os.path.exists(os.path.join(folder_path, CATALOG_NAME)):
+        files.extend(entry["file"] for entry in read_catalog(folder_path))
+    files.extend(file for file in os.listdir(folder_path) if file.endswith(".csv"))
+    return files
+
+
+def list_tables(base_folder):
+    """(sheet folder name, file name, path) for every extracted table one level below base_folder."""
+    tables = []
     for folder in os.listdir(base_folder):
         folder_path = os.path.join(base_folder, folder)
         if os.path.isdir(folder_path):
-            for file in os.listdir(folder_path):
-                if file.endswith(".csv"):
-                    file_path = os.path.join(folder_path, file)
-                    print(f"Processing file: {file_path}")
-
-                    df = pd.read_csv(file_path)
-                    response = analyze_sheet(dataframe=df, llm=llm)
-                    if response:
-                        # Unpack the details dictionary into individual columns
-                        details = response.details
-                        results.append(
-                            {
-                                'sheet_name': folder,
-                                "file": file,
-                                "is_inventory_planning": response.is_inventory_planning,
-                                "description": response.description,
-                                "SKU": details.get("SKU"),
-                                "Location/Warehouse": details.get("Location/Warehouse"),
-                                "Quantity": details.get("Quantity"),
-                                "Total Inventory": details.get("Total Inventory"),
-                                "Current Inventory": details.get("Current Inventory"),
-                                "Sales Forecast": details.get("Sales Forecast"),
-                            }
-                        )
-                    else:
-                        print(f"Failed to analyze file: {file}")
-
-    return pd.DataFrame(results)
+            tables.extend((folder, file, os.path.join(folder_path, file)) for file in list_sheet_tables(folder_path))
+    return tables
+
+
+def table_key(folder, file):
+    return f"{folder}/{file}"
+
+
+def changed_tables(tables, manifest):
+    """The tables whose content differs from the manifest's last analyzed version, with their hashes."""
+    hashes = {path: file_hash(path) for _, _, path in tables}
+    changed = [(folder, file, path) for folder, file, path in tables
+               if manifest.table_changed(table_key(folder, file), hashes[path])]
+    print(f"{len(changed)} of {len(tables)} table(s) changed since the last analysis")
+    return changed, hashes
+
+
+def record_tables(tables, responses, hashes, manifest):
+    for (folder, file, path), response in zip(tables, responses):
+        if response:
+            manifest.record_table(table_key(folder, file), hashes[path])
+    manifest.save()
+
+
+def merge_results(previous, updated, tables):
+    """
+    Consolidated results: rows of re-analyzed tables (including failed_row placeholders)
+    replace their previous rows, rows of tables that no longer exist are dropped, and
+    rows follow the order of tables.
+    """
+    order = {(folder, file): i for i, (folder, file, _) in enumerate(tables)}
+    replaced = set(zip(updated["sheet_name"], updated["file"])) if len(updated) else set()
+    if len(previous):
+        keys = list(zip(previous["sheet_name"], previous["file"]))
+        previous = previous[[key in order and key not in replaced for key in keys]]
+    merged = pd.concat([previous, updated], ignore_index=True)
+    if not len(merged):
+        return merged
+    positions = [order[key] for key in zip(merged["sheet_name"], merged["file"])]
+    return merged.iloc[sorted(range(len(merged)), key=positions.__getitem__)].reset_index(drop=True)
+
+
+# Function to process all extracted tables in a base folder; with a manifest only changed tables are analyzed
+def analyze_csv_files(base_folder, llm, prefilter=True, batch_size=5, manifest=None):
+    with tracing.span("analyze_tables", workbook=os.path.basename(base_folder)):
+        return _analyze_csv_files(base_folder, llm, prefilter, batch_size, manifest)
+
+
+def _analyze_csv_files(base_folder, llm, prefilter, batch_size, manifest):
+    tables = list_tables(base_folder)
+    if manifest is not None:
+        tables, hashes = changed_tables(tables, manifest)
+    dataframes = []
+    for _, _, file_path in tables:
+        print(f"Processing file: {file_path}")
+        # Only the first rows are needed for the preview and the local pre-classifier
+        dataframes.append(read_head(file_path))
+
+    responses, batches = plan_analysis(dataframes, prefilter, batch_size)
+    for batch in batches:
+        for i, response in zip(batch, analyze_batch([dataframes[i] for i in batch], llm)):
+            responses[i] = response
+
+    if manifest is not None:
+        record_tables(tables, responses, hashes, manifest)
+    return collect_rows(tables, responses)
+
+
+# Analyze all tables of a base folder concurrently; the client bounds concurrency and rate
+async def analyze_csv_files_async(base_folder, client, prefilter=True, batch_size=5, manifest=None):
+    with tracing.span("analyze_tables", workbook=os.path.basename(base_folder)):
+        return await _analyze_csv_files_async(base_folder, client, prefilter, batch_size, manifest)
+
+
+async def _analyze_csv_files_async(base_folder, client, prefilter, batch_size, manifest):
+    tables = list_tables(base_folder)
+    if manifest is not None:
+        tables, hashes = await asyncio.to_thread(changed_tables, tables, manifest)
+    dataframes = await asyncio.gather(*(asyncio.to_thread(read_head, file_path) for _, _, file_path in tables))
+
+    responses, batches = plan_analysis(dataframes, prefilter, batch_size)
+    batch_results = await asyncio.gather(
+        *(analyze_batch_async([dataframes[i] for i in batch], client) for batch in batches)
+    )
+    for batch, results in zip(batches, batch_results):
+        for i, response in zip(batch, results):
+            responses[i] = response
+
+    if manifest is not None:
+        record_tables(tables, responses, hashes, manifest)
+    return collect_rows(tables, responses)
 
 
 # Main Execution
-llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-# provide paths to the folders containing the csvs
-base_folders = ["/Users/ajay/Documents/Atomic/inventory_analysis_2/Company 1 - Inventory Planning", "/Users/ajay/Documents/Atomic/inventory_analysis_2/Company 2 - Supply Management", "/Users/ajay/Documents/Atomic/inventory_analysis_2/Company 3 - Inventory Dashboard _V2"]
-for base_folder in base_folders:
-    analysis_results_df = analyze_csv_files(base_folder, llm)
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Classify extracted tables as inventory planning or not.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Analyze tables concurrently.")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=500, help="Requests per minute limit (async mode).")
+    parser.add_argument("--tpm", type=int, default=200_000, help="Tokens per minute limit (async mode).")
+    parser.add_argument("--batch-size", type=int, default=5, help="Table previews per LLM request.")
+    parser.add_argument("--no-prefilter", dest="prefilter", action="store_false",
+                        help="Send every table to the LLM instead of deciding clear cases locally.")
+    parser.add_argument("--full", dest="incremental", action="store_false",
+                        help="Re-analyze every table instead of only those changed since the last run.")
+    parser.add_argument("--trace", default=tracing.DEFAULT_TRACE_PATH,
+                        help="Write timing, token and cost spans to this JSONL file and print a summary at the end.")
+    args = parser.parse_args()
+    tracing.configure(args.trace)
+
+    llm_cache = LLMCache()
+    llm = CachedLLM(ChatOpenAI(model="gpt-4o-mini", temperature=0), llm_cache)
+    # provide paths to the folders containing the extracted tables
+    base_folders = ["/Users/ajay/Documents/Atomic/inventory_analysis_2/Company 1 - Inventory Planning", "/Users/ajay/Documents/Atomic/inventory_analysis_2/Company 2 - Supply Management", "/Users/ajay/Documents/Atomic/inventory_analysis_2/Company 3 - Inventory Dashboard _V2"]
+    for base_folder in base_folders:
+        output_file = f"{base_folder.split('/')[-1]}.csv"
+        # Only tables changed since the last run are analyzed; their rows are merged into the existing results
+        manifest = Manifest(base_folder)
+        previous_df = pd.DataFrame()
+        if args.incremental and os.path.exists(output_file):
+            previous_df = pd.read_csv(output_file, dtype={"sheet_name": str, "file": str})
+        else:
+            manifest.clear_tables()
 
-    # Save results to a CSV file
-    output_file = f"{base_folder.split('/')[-1]}.csv"
-    analysis_results_df.to_csv(output_file, index=False)
-    print(f"Results saved to {output_file}")
+        if args.use_async:
+            client = AsyncLLMClient(llm.llm, max_concurrency=args.max_concurrency, requests_per_minute=args.rpm,
+                                    tokens_per_minute=args.tpm, cache=llm_cache)
+            analysis_results_df = asyncio.run(
+                analyze_csv_files_async(base_folder, client, prefilter=args.prefilter, batch_size=args.batch_size,
+                                        manifest=manifest)
+            )
+        else:
+            analysis_results_df = analyze_csv_files(base_folder, llm, prefilter=args.prefilter,
+                                                    batch_size=args.batch_size, manifest=manifest)
+        analysis_results_df = merge_results(previous_df, analysis_results_df, list_tables(base_folder))
 
+        # Save results to a CSV file
+        analysis_results_df.to_csv(output_file, index=False)
+        print(f"Results saved to {output_file}")
 
+    print("LLM cache stats:", llm_cache.stats())
+    if args.trace:
+        tracing.tracer.close()
+        print(tracing.format_summary(tracing.summarize(args.trace)))
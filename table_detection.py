@@ -0,0 +1,148 @@
+import numpy as np
+
+
+def _dilate(mask, row_gap, col_gap):
+    """Grow occupied cells down by row_gap rows and right by col_gap columns so small gaps bridge."""
+    grown = mask.copy()
+    for shift in range(1, row_gap + 1):
+        grown[shift:, :] |= mask[:-shift, :]
+    spread = grown.copy()
+    for shift in range(1, col_gap + 1):
+        spread[:, shift:] |= grown[:, :-shift]
+    return spread
+
+
+def _find(parent, i):
+    while parent[i] != i:
+        parent[i] = parent[parent[i]]
+        i = parent[i]
+    return i
+
+
+def _label_runs(mask):
+    """
+    Label 4-connected regions of a boolean mask.
+
+    Each row is reduced to runs of consecutive True cells with NumPy; runs that
+    overlap a run in the previous row are unioned. Returns the run arrays
+    (row, start_col, end_col exclusive) and a component label per run.
+    """
+    n_rows = mask.shape[0]
+    edges = np.diff(np.pad(mask, ((0, 0), (1, 1))).astype(np.int8), axis=1)
+    run_rows, run_starts = np.nonzero(edges == 1)
+    _, run_ends = np.nonzero(edges == -1)
+    row_ptr = np.searchsorted(run_rows, np.arange(n_rows + 1))
+
+    parent = list(range(len(run_rows)))
+    starts, ends = run_starts.tolist(), run_ends.tolist()
+    for row_idx in range(1, n_rows):
+        prev_i, prev_end = int(row_ptr[row_idx - 1]), int(row_ptr[row_idx])
+        cur_i, cur_end = prev_end, int(row_ptr[row_idx + 1])
+        # Sweep both sorted run lists, unioning overlapping runs
+        while prev_i < prev_end and cur_i < cur_end:
+            if starts[prev_i] < ends[cur_i] and starts[cur_i] < ends[prev_i]:
+                a, b = _find(parent, prev_i), _find(parent, cur_i)
+                if a != b:
+                    parent[max(a, b)] = min(a, b)
+            if ends[prev_i] < ends[cur_i]:
+                prev_i += 1
+            else:
+                cur_i += 1
+
+    labels = np.array([_find(parent, i) for i in range(len(parent))], dtype=np.int64)
+    return run_rows, run_starts, run_ends, labels
+
+
+def _bounding_boxes(mask, dilated):
+    """Bounding boxes (0-based, inclusive) of the occupied cells in each dilated region."""
+    run_rows, run_starts, run_ends, labels = _label_runs(dilated)
+    if not len(labels):
+        return []
+    # Map every occupied cell to the run that contains it
+    cell_rows, cell_cols = np.nonzero(mask)
+    run_keys = run_rows.astype(np.int64) * (mask.shape[1] + 1) + run_starts
+    cell_keys = cell_rows.astype(np.int64) * (mask.shape[1] + 1) + cell_cols
+    cell_runs = np.searchsorted(run_keys, cell_keys, side="right") - 1
+    cell_labels = labels[cell_runs]
+
+    unique_labels, inverse = np.unique(cell_labels, return_inverse=True)
+    n = len(unique_labels)
+    top = np.full(n, np.iinfo(np.int64).max)
+    left = np.full(n, np.iinfo(np.int64).max)
+    bottom = np.full(n, -1)
+    right = np.full(n, -1)
+    np.minimum.at(top, inverse, cell_rows)
+    np.minimum.at(left, inverse, cell_cols)
+    np.maximum.at(bottom, inverse, cell_rows)
+    np.maximum.at(right, inverse, cell_cols)
+    return [list(box) for box in zip(top.tolist(), left.tolist(), bottom.tolist(), right.tolist())]
+
+
+def _overlaps(a, b):
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+
+def _merge_boxes(boxes, merge_row_gap, merge_col_tolerance):
+    """Merge overlapping boxes and vertically stacked boxes that share a column span."""
+    changed = True
+    while changed:
+        changed = False
+        boxes.sort()
+        active, done = [], []
+        for box in boxes:
+            # Boxes sorted by top row: anything ending well above this one can't touch later boxes
+            still_active = []
+            for other in active:
+                if other[2] + merge_row_gap + 1 < box[0]:
+                    done.append(other)
+                else:
+                    still_active.append(other)
+            active = still_active
+            for other in active:
+                stacked = (
+                    0 <= box[0] - other[2] - 1 <= merge_row_gap
+                    and abs(box[1] - other[1]) <= merge_col_tolerance
+                    and abs(box[3] - other[3]) <= merge_col_tolerance
+                )
+                if _overlaps(box, other) or stacked:
+                    other[0], other[1] = min(other[0], box[0]), min(other[1], box[1])
+                    other[2], other[3] = max(other[2], box[2]), max(other[3], box[3])
+                    changed = True
+                    break
+            else:
+                active.append(box)
+        boxes = done + active
+    return boxes
+
+
+def detect_tables(mask, row_gap=0, col_gap=0, merge_row_gap=1, merge_col_tolerance=0, min_cells=1):
+    """
+    Detect rectangular tables in a 2D occupancy mask.
+
+    Args:
+        mask: Boolean array (rows x columns), True where a cell holds a value.
+        row_gap: Empty rows tolerated inside a single table.
+        col_gap: Empty columns tolerated inside a single table; side-by-side tables
+            separated by more empty columns than this are returned separately.
+        merge_row_gap: Tables stacked one below another with at most this many empty
+            rows between them are combined when their column spans match.
+        merge_col_tolerance: Allowed difference in start/end column when combining
+            stacked tables.
+        min_cells: Regions with fewer occupied cells are dropped.
+
+    Returns:
+        List of (start_row, start_col, end_row, end_col) tuples, 1-based and inclusive,
+        ordered top to bottom then left to right.
+    """
+    mask = np.asarray(mask, dtype=bool)
+    if mask.ndim != 2 or not mask.any():
+        return []
+    boxes = _bounding_boxes(mask, _dilate(mask, row_gap, col_gap))
+    boxes = _merge_boxes(boxes, merge_row_gap, merge_col_tolerance)
+
+    tables = []
+    for top, left, bottom, right in sorted(boxes):
+        if min_cells > 1 and mask[top:bottom + 1, left:right + 1].sum() < min_cells:
+            continue
+        tables.append((top + 1, left + 1, bottom + 1, right + 1))
+    return tables
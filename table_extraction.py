@@ -1,82 +1,208 @@
 import os
-import traceback
+import asyncio
+import argparse
 from langchain.chat_models import ChatOpenAI
-from langchain_experimental.tools import PythonREPLTool
-from openpyxl import load_workbook
 import re
 
+import tracing
+from async_llm import AsyncLLMClient
+from code_executor import ScriptExecutor
+from code_store import CodeStore, output_shapes, sheet_fingerprint
+from llm_cache import CachedLLM, LLMCache
+from manifest import Manifest
+from sheet_chunker import DEFAULT_TOKEN_BUDGET, chunk_sheet
+from workbook_grid import load_workbook_grid
 
+# Responses are cached on disk, so unchanged sheets don't hit the API again on re-runs
+llm_cache = LLMCache()
+# Extraction code that ran successfully, keyed by sheet layout, reused for sheets with the same layout
+code_store = CodeStore()
+reuse_code = True
+# asyncio.Locks per layout fingerprint, valid only on the event loop in layout_locks_loop
+layout_locks = {}
+layout_locks_loop = None
+# Per-workbook manifest of sheet content hashes; unchanged sheets are skipped when incremental is set
+manifest = None
+incremental = True
+# Token budget for the sheet outline sent with each code-generation prompt
+chunk_token_budget = DEFAULT_TOKEN_BUDGET
 
-# Function to extract a 50xN chunk from a sheet
+
+# Function to build a token-budgeted outline of a sheet's tables
 def extract_sheet_chunk(sheet_name):
     sheet_name = sheet_name.strip().replace('"', '').replace("'", "")
     if sheet_name not in sheet_names:
         log_message = f"Sheet '{sheet_name}' doesn't exist. Available sheets: {sheet_names}"
         print(log_message)
         return log_message
-    print(f"Fetching 50xN chunk from sheet: {sheet_name}")
-    sheet = workbook[sheet_name]
-    max_cols = sheet.max_column
-    data = [[cell.value for cell in row] for row in sheet.iter_rows(min_row=1, max_row=50, max_col=max_cols)]
-    formatted_chunk = "\n".join([", ".join(map(str, row)) for row in data])
+    print(f"Fetching chunk from sheet: {sheet_name} (budget {chunk_token_budget} tokens)")
+    with tracing.span("chunk", token_budget=chunk_token_budget) as span:
+        formatted_chunk = chunk_sheet(workbook[sheet_name], token_budget=chunk_token_budget)
+        span["chunk_chars"] = len(formatted_chunk)
     print(f"Fetched chunk from sheet '{sheet_name}':\n{formatted_chunk[:500]}...")  # Show first 500 chars for brevity
     return formatted_chunk
 
 # Function to analyze a chunk and generate code
 
 
-def analyze_and_generate_code(sheet_name: str, chunk: str, sheet_folder: str) -> str:
-    llm_input = f"""
+def build_code_prompt(sheet_name: str, chunk: str, sheet_folder: str, previous_code: str = None,
+                      error_feedback: str = None) -> str:
+    prompt = f"""
     You are a Python code generator for table extraction.
-    Below is a 50xN chunk of data from the sheet '{sheet_name}' in an Excel file.
+    Below is an outline of the sheet '{sheet_name}' in an Excel file. It lists every detected table with its
+    cell range, header rows, sample rows and last rows. Runs of rows with the same layout are collapsed into a
+    single summary line and long values are cut with '…', so read the full data from `sheet_df`, not the outline.
 
     {chunk}
 
     Tasks:
-    1. Analyze the data to identify all tables present in the chunk. Tables are defined as contiguous blocks of data separated by blank rows or rows with no data.
+    1. Analyze the outline to identify all tables present in the sheet. Tables are defined as contiguous blocks of data separated by blank rows or rows with no data.
     2. Generate Python code that:
-       - Reads data from the provided Excel file ('{file_path}') and specified sheet ('{sheet_name}').
-       - Saves all extracted tables as separate CSV files in the folder '{sheet_folder}'.
-       - Ensures the generated code creates the CSV files in the exact folder specified and avoids creating additional folders elsewhere.
+       - Reads data from the preloaded, read-only pandas DataFrame `sheet_df`, which holds every cell value of the sheet '{sheet_name}'. Its index and columns are the 1-based Excel row and column numbers, so sheet_df.loc[row, col] is the cell at that position. Do not open the Excel file again.
+       - Saves every extracted table by calling the preloaded function `save_table(df, name, source_range)`, where `name` is a short file-safe table name and `source_range` is the Excel range the table came from (e.g. 'A3:E120'). It stores the table as a typed Arrow file with a catalog entry in the folder '{sheet_folder}' (also available as the variable `sheet_folder`).
+       - Does not write CSV or other files and does not create folders elsewhere.
     3. Do not make any assumptions about the meaning or functionality of specific columns unless explicitly mentioned.
     """
-    print(f"Sending data to LLM for analysis and code generation...")
-    llm = ChatOpenAI(model="gpt-4o-mini", temperature=0)
-    try:
-        response = llm.invoke(llm_input)
-        generated_response = response.content  # Extract string content
-        print(f"Full LLM response:\n{generated_response[:500]}...")  # Log full response
-
-        # Extract Python code block using regex
-        match = re.search(r"```python(.*?)```", generated_response, re.DOTALL)
-        if match:
-            generated_code = match.group(1).strip()  # Extract the Python code
-            print(f"Extracted code:\n{generated_code[:500]}...")  # Log extracted code
-            return generated_code
-        else:
-            print("No valid Python code block found in the LLM response.")
-            return "Error: No valid Python code block found."
-    except Exception as e:
-        print(f"Error during code generation: {e}")
-        return f"Error during code generation: {e}"
-
-# Function to execute generated Python code
-def execute_code(code: str) -> str:
-    try:
-        print(f"Executing the following code:\n{code}...")  # Log the extracted code
-        repl_tool = PythonREPLTool()
-        result = repl_tool.run(code)
-        print("Execution result:")
-        print(result)
-        return result
-    except Exception as e:
-        error_message = f"Execution Error: {str(e)}"
-        print(error_message)
-        print(traceback.format_exc())
-        return error_message
+    if previous_code and error_feedback:
+        prompt += f"""
+    The previous attempt below failed. Fix the error and return the complete corrected code.
+
+    ```python
+    {previous_code}
+    ```
+
+    Error:
+    {error_feedback}
+    """
+    return prompt
+
+
+def extract_generated_code(generated_response: str) -> str:
+    print(f"Full LLM response:\n{generated_response[:500]}...")  # Log full response
+
+    # Extract Python code block using regex
+    match = re.search(r"```python(.*?)```", generated_response, re.DOTALL)
+    if match:
+        generated_code = match.group(1).strip()  # Extract the Python code
+        print(f"Extracted code:\n{generated_code[:500]}...")  # Log extracted code
+        return generated_code
+    else:
+        print("No valid Python code block found in the LLM response.")
+        return "Error: No valid Python code block found."
+
+
+def analyze_and_generate_code(sheet_name: str, chunk: str, sheet_folder: str, refresh: bool = False,
+                              previous_code: str = None, error_feedback: str = None) -> str:
+    with tracing.span("codegen", fix=bool(error_feedback)):
+        with tracing.span("prompt") as span:
+            llm_input = build_code_prompt(sheet_name, chunk, sheet_folder, previous_code, error_feedback)
+            span["prompt_chars"] = len(llm_input)
+        print(f"Sending data to LLM for analysis and code generation...")
+        llm = CachedLLM(ChatOpenAI(model="gpt-4o-mini", temperature=0), llm_cache)
+        try:
+            # refresh skips the cached answer so a retry doesn't get the same failing code back
+            response = llm.invoke(llm_input, refresh=refresh)
+            return extract_generated_code(response.content)  # Extract string content
+        except Exception as e:
+            print(f"Error during code generation: {e}")
+            return f"Error during code generation: {e}"
+
+
+async def analyze_and_generate_code_async(client, sheet_name: str, chunk: str, sheet_folder: str,
+                                          refresh: bool = False, previous_code: str = None,
+                                          error_feedback: str = None) -> str:
+    with tracing.span("codegen", fix=bool(error_feedback)):
+        with tracing.span("prompt") as span:
+            llm_input = build_code_prompt(sheet_name, chunk, sheet_folder, previous_code, error_feedback)
+            span["prompt_chars"] = len(llm_input)
+        print(f"[{sheet_name}] Sending data to LLM for analysis and code generation...")
+        try:
+            response = await client.ainvoke(llm_input, refresh=refresh)
+            return extract_generated_code(response.content)
+        except Exception as e:
+            print(f"[{sheet_name}] Error during code generation: {e}")
+            return f"Error during code generation: {e}"
+
+# Function to execute generated Python code in an isolated, resource-limited worker process
+def execute_code(code: str, sheet_name: str, sheet_folder: str):
+    print(f"Executing the following code:\n{code}...")  # Log the extracted code
+    with tracing.span("code_exec") as span:
+        result = executor.run(code, sheet=workbook[sheet_name], sheet_folder=sheet_folder)
+        span.update(ok=result.ok, error_type=result.error_type, files=len(result.files))
+    print("Execution result:")
+    print(result)
+    return result
+
+
+async def execute_code_async(code: str, sheet_name: str, sheet_folder: str):
+    with tracing.span("code_exec") as span:
+        result = await executor.arun(code, sheet=workbook[sheet_name], sheet_folder=sheet_folder)
+        span.update(ok=result.ok, error_type=result.error_type, files=len(result.files))
+    return result
+
+def accept_stored_result(stored, result, sheet_folder):
+    """Check a reused script's output against the stored shapes; remove what it wrote if it doesn't match."""
+    if result.ok and stored.matches(output_shapes(sheet_folder, result.files)):
+        code_store.record_use(stored.fingerprint)
+        return True
+    print("Stored code did not reproduce the expected tables; generating new code.")
+    for name in result.files:
+        os.remove(os.path.join(sheet_folder, name))
+    code_store.reject(stored.fingerprint)
+    return False
+
+
+def remember_code(fingerprint, code, sheet_name, sheet_folder, result):
+    """Store code that ran successfully under the sheet's layout fingerprint."""
+    shapes = output_shapes(sheet_folder, result.files)
+    if shapes:
+        code_store.put(fingerprint, code, sheet_folder, shapes, sheet_name=sheet_name)
+
+
+def open_workbook(file_path, output_root=None):
+    """Load a workbook and point the module state (workbook, sheet_names, base_dir, manifest) at it."""
+    global workbook, sheet_names, base_dir, manifest
+    workbook_name = os.path.splitext(os.path.basename(file_path))[0]  # Get workbook name without extension
+    with tracing.span("load", workbook=workbook_name) as span:
+        workbook = load_workbook_grid(file_path)
+        span["sheets"] = len(workbook.sheetnames)
+    sheet_names = workbook.visible_sheetnames
+
+    # Create a base directory with the workbook name
+    base_dir = os.path.join(output_root or os.getcwd(), workbook_name)
+    os.makedirs(base_dir, exist_ok=True)
+    manifest = Manifest(base_dir)
+    return base_dir
+
+
+def check_manifest(sheet_name, sheet_folder, content_hash=None):
+    """
+    Content hash of the sheet, or None when the manifest says it hasn't changed since the
+    last run and its outputs still exist. The files a changed sheet wrote last time are removed.
+    Pass content_hash when it was already computed (e.g. off the event loop).
+    """
+    if content_hash is None:
+        content_hash = workbook[sheet_name].content_hash()
+    if manifest is None:
+        return content_hash
+    if incremental and not manifest.sheet_changed(sheet_name, content_hash, sheet_folder):
+        return None
+    manifest.clear_sheet(sheet_name, sheet_folder)
+    return content_hash
+
+
+def record_sheet(sheet_name, content_hash, result):
+    if manifest is not None:
+        manifest.record_sheet(sheet_name, content_hash, result.files)
+
 
 # Main execution process
 def run_analysis(sheet_name):
+    with tracing.span("sheet", sheet=sheet_name):
+        return _run_analysis(sheet_name)
+
+
+def _run_analysis(sheet_name):
     print(f"Starting analysis for sheet: {sheet_name}")
     
     # Step 1: Fetch sheet chunk
@@ -89,43 +215,185 @@ def run_analysis(sheet_name):
     sheet_folder = os.path.join(base_dir, sheet_name)
     os.makedirs(sheet_folder, exist_ok=True)
 
-    # Step 3: Analyze and generate code
+    # Step 3: Skip sheets whose cells haven't changed since the last run
+    content_hash = check_manifest(sheet_name, sheet_folder)
+    if content_hash is None:
+        print(f"Sheet '{sheet_name}' is unchanged since the last run; skipping.")
+        tracing.annotate(outcome="unchanged")
+        return "Unchanged since the last run."
+
+    # Step 4: Reuse code that worked for a sheet with the same layout
+    fingerprint = sheet_fingerprint(workbook[sheet_name])
+    stored = code_store.get(fingerprint) if reuse_code else None
+    if stored is not None:
+        print(f"Reusing stored code for layout {fingerprint[:12]}")
+        result = execute_code(stored.adapt(sheet_folder), sheet_name, sheet_folder)
+        if accept_stored_result(stored, result, sheet_folder):
+            record_sheet(sheet_name, content_hash, result)
+            tracing.annotate(outcome="reused")
+            return str(result)
+
+    # Step 5: Analyze and generate code
     print("Analyzing the data and generating Python code...")
     code = analyze_and_generate_code(sheet_name, chunk, sheet_folder)
     if "Error during code generation" in code:
+        tracing.annotate(outcome="codegen_failed")
         return code
 
-    # Step 4: Attempt to execute code with retries
+    # Step 6: Attempt to execute code with retries
     retry = 10
     while retry > 0:
-        result = execute_code(code)
-        if "Execution Error" not in result:
+        result = execute_code(code, sheet_name, sheet_folder)
+        if result.ok:
             print("Code executed successfully!")
-            return result  # Successful execution
+            tracing.annotate(outcome="generated")
+            remember_code(fingerprint, code, sheet_name, sheet_folder, result)
+            record_sheet(sheet_name, content_hash, result)
+            return str(result)  # Successful execution
 
         # Provide feedback and request fixes
-        error_message = f"\n\nError Message: {result}"
+        error_message = result.as_feedback()
         print(f"Retrying... ({10 - retry + 1}/10)")
+        tracing.annotate(retries=10 - retry + 1)
         print(f"Requesting LLM to fix the code. Error: {error_message}")
-        code = analyze_and_generate_code(sheet_name, chunk, sheet_folder)
+        code = analyze_and_generate_code(sheet_name, chunk, sheet_folder, refresh=True,
+                                         previous_code=code, error_feedback=error_message)
         retry -= 1
 
     print("Exceeded maximum retries. Could not execute code successfully.")
+    tracing.annotate(outcome="failed")
     return "Failed after multiple retries."
 
-for file_path in ['/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 1 - Inventory Planning.xlsx', '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 2 - Supply Management.xlsx', '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 3 - Inventory Dashboard _V2.xlsx']:
-    print("Processing File",file_path)
-    # Load Excel Workbook
-    # file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 3 - Inventory Dashboard _V2.xlsx'
-    workbook_name = os.path.splitext(os.path.basename(file_path))[0]  # Get workbook name without extension
-    workbook = load_workbook(file_path, data_only=False, read_only=True)
-    sheet_names = [sheet_name for sheet_name in workbook.sheetnames if not workbook[sheet_name].sheet_state == 'hidden']
+def layout_lock(fingerprint):
+    """
+    Lock serializing the sheets of one layout. Locks are bound to the loop they were
+    first awaited on, so a new loop (the next asyncio.run) starts with fresh ones.
+    """
+    global layout_locks, layout_locks_loop
+    loop = asyncio.get_running_loop()
+    if loop is not layout_locks_loop:
+        layout_locks, layout_locks_loop = {}, loop
+    return layout_locks.setdefault(fingerprint, asyncio.Lock())
 
-    # Create a base directory with the workbook name
-    base_dir = os.path.join(os.getcwd(), workbook_name)
-    os.makedirs(base_dir, exist_ok=True)
 
-    # Run the workflow for each sheet
-    for sheet_to_analyze in sheet_names:
-        print('-'*40, f'\nAnalyzing Sheet: {sheet_to_analyze}')
-        print(run_analysis(sheet_to_analyze))
+# Async variant of run_analysis: the LLM calls and script executions of many sheets overlap
+async def run_analysis_async(sheet_name, client):
+    with tracing.span("sheet", sheet=sheet_name):
+        return await _run_analysis_async(sheet_name, client)
+
+
+async def _run_analysis_async(sheet_name, client):
+    print(f"Starting analysis for sheet: {sheet_name}")
+
+    # Chunking, hashing and fingerprinting are CPU work; threads keep the event loop free for other sheets
+    chunk = await asyncio.to_thread(extract_sheet_chunk, sheet_name)
+    if "doesn't exist" in chunk:
+        print(f"Error: {chunk}")
+        return chunk
+
+    sheet_folder = os.path.join(base_dir, sheet_name)
+    os.makedirs(sheet_folder, exist_ok=True)
+
+    sheet = workbook[sheet_name]
+    content_hash = check_manifest(sheet_name, sheet_folder, await asyncio.to_thread(sheet.content_hash))
+    if content_hash is None:
+        print(f"[{sheet_name}] Unchanged since the last run; skipping.")
+        tracing.annotate(outcome="unchanged")
+        return "Unchanged since the last run."
+
+    # Sheets sharing a layout run one after another, so all but the first reuse its code
+    fingerprint = await asyncio.to_thread(sheet_fingerprint, sheet)
+    async with layout_lock(fingerprint):
+        stored = code_store.get(fingerprint) if reuse_code else None
+        if stored is not None:
+            print(f"[{sheet_name}] Reusing stored code for layout {fingerprint[:12]}")
+            result = await execute_code_async(stored.adapt(sheet_folder), sheet_name, sheet_folder)
+            if accept_stored_result(stored, result, sheet_folder):
+                record_sheet(sheet_name, content_hash, result)
+                tracing.annotate(outcome="reused")
+                return str(result)
+
+        code = await analyze_and_generate_code_async(client, sheet_name, chunk, sheet_folder)
+        if "Error during code generation" in code:
+            tracing.annotate(outcome="codegen_failed")
+            return code
+
+        retry = 10
+        while retry > 0:
+            result = await execute_code_async(code, sheet_name, sheet_folder)
+            if result.ok:
+                print(f"[{sheet_name}] Code executed successfully!")
+                tracing.annotate(outcome="generated")
+                remember_code(fingerprint, code, sheet_name, sheet_folder, result)
+                record_sheet(sheet_name, content_hash, result)
+                return str(result)
+
+            print(f"[{sheet_name}] Retrying... ({10 - retry + 1}/10): {result.error_type}: {result.error_message}")
+            tracing.annotate(retries=10 - retry + 1)
+            code = await analyze_and_generate_code_async(client, sheet_name, chunk, sheet_folder, refresh=True,
+                                                         previous_code=code, error_feedback=result.as_feedback())
+            retry -= 1
+
+    print(f"[{sheet_name}] Exceeded maximum retries. Could not execute code successfully.")
+    tracing.annotate(outcome="failed")
+    return "Failed after multiple retries."
+
+
+async def run_workbook_async(sheets, client):
+    """Analyze all sheets of the current workbook concurrently."""
+    results = await asyncio.gather(*(run_analysis_async(sheet_name, client) for sheet_name in sheets))
+    for sheet_name, result in zip(sheets, results):
+        print('-'*40, f'\nSheet: {sheet_name}')
+        print(result)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Extract tables from workbooks with LLM-generated code.")
+    parser.add_argument("--async", dest="use_async", action="store_true", help="Process sheets concurrently.")
+    parser.add_argument("--max-concurrency", type=int, default=8)
+    parser.add_argument("--rpm", type=int, default=500, help="Requests per minute limit (async mode).")
+    parser.add_argument("--tpm", type=int, default=200_000, help="Tokens per minute limit (async mode).")
+    parser.add_argument("--exec-workers", type=int, default=None, help="Generated scripts run at once.")
+    parser.add_argument("--exec-cpu-seconds", type=int, default=60, help="CPU time limit per generated script.")
+    parser.add_argument("--exec-memory-mb", type=int, default=2048, help="Memory limit per generated script.")
+    parser.add_argument("--chunk-tokens", type=int, default=DEFAULT_TOKEN_BUDGET,
+                        help="Token budget for the sheet outline in each prompt.")
+    parser.add_argument("--no-code-reuse", dest="reuse_code", action="store_false",
+                        help="Always generate new code instead of reusing code stored for the same sheet layout.")
+    parser.add_argument("--full", dest="incremental", action="store_false",
+                        help="Reprocess every sheet, even those unchanged since the last run.")
+    parser.add_argument("--trace", default=tracing.DEFAULT_TRACE_PATH,
+                        help="Write timing, token and cost spans to this JSONL file and print a summary at the end.")
+    args = parser.parse_args()
+    tracing.configure(args.trace)
+    chunk_token_budget = args.chunk_tokens
+    reuse_code = args.reuse_code
+    incremental = args.incremental
+
+    executor = ScriptExecutor(max_workers=args.exec_workers, cpu_seconds=args.exec_cpu_seconds,
+                              memory_mb=args.exec_memory_mb)
+
+    for file_path in ['/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 1 - Inventory Planning.xlsx', '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 2 - Supply Management.xlsx', '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 3 - Inventory Dashboard _V2.xlsx']:
+        print("Processing File",file_path)
+        with tracing.span("workbook", workbook=os.path.splitext(os.path.basename(file_path))[0]):
+            # Load Excel Workbook
+            # file_path = '/Users/ajay/Documents/Atomic/inventory_analysis/Data/Company 3 - Inventory Dashboard _V2.xlsx'
+            open_workbook(file_path)
+
+            # Run the workflow for each sheet
+            if args.use_async:
+                client = AsyncLLMClient(ChatOpenAI(model="gpt-4o-mini", temperature=0),
+                                        max_concurrency=args.max_concurrency, requests_per_minute=args.rpm,
+                                        tokens_per_minute=args.tpm, cache=llm_cache)
+                asyncio.run(run_workbook_async(sheet_names, client))
+                continue
+            for sheet_to_analyze in sheet_names:
+                print('-'*40, f'\nAnalyzing Sheet: {sheet_to_analyze}')
+                print(run_analysis(sheet_to_analyze))
+
+    executor.shutdown()
+    print("LLM cache stats:", llm_cache.stats())
+    print("Code reuse stats:", code_store.stats())
+    if args.trace:
+        tracing.tracer.close()
+        print(tracing.format_summary(tracing.summarize(args.trace)))
@@ -0,0 +1,99 @@
+import re
+
+import pandas as pd
+
+
+ROLES = ["SKU", "Location/Warehouse", "Quantity", "Total Inventory", "Current Inventory", "Sales Forecast"]
+
+# Header keywords per role, matched against lower-cased header words
+ROLE_PATTERNS = {
+    "SKU": re.compile(r"\b(sku|skus|item|item ?(no|number|code|id)|product|part ?(no|number)|material|article|upc|ean|asin)\b"),
+    "Location/Warehouse": re.compile(r"\b(location|loc|warehouse|whse|wh|dc|site|store|plant|branch|facility|region)\b"),
+    "Quantity": re.compile(r"\b(qty|quantity|units|pcs|pieces|order qty|po qty|cases)\b"),
+    "Total Inventory": re.compile(r"\btotal (inventory|stock|on ?hand|units)\b"),
+    "Current Inventory": re.compile(r"\b(on ?hand|soh|stock|inventory|available|avail|ending inv|current inv\w*)\b"),
+    "Sales Forecast": re.compile(r"\b(forecast|fcst|demand|projected sales|projection|sales plan)\b"),
+}
+SKU_VALUE = re.compile(r"^(?=.*\d)(?=.*[A-Za-z])[A-Za-z0-9][A-Za-z0-9\-_./]{2,24}$")
+NOTE_HEADER = re.compile(r"\b(note|notes|comment|comments|instructions|read ?me|legend|disclaimer)\b")
+
+
+def _headers(dataframe):
+    """Candidate header texts: the DataFrame columns plus the first row (headers often land in data)."""
+    headers = [str(col) for col in dataframe.columns]
+    if len(dataframe):
+        headers += [str(value) for value in dataframe.iloc[0].tolist() if isinstance(value, str)]
+    return [h for h in headers if h and not h.startswith("Unnamed") and h.lower() != "nan"]
+
+
+def score_table(dataframe):
+    """
+    Score a table's header and column signals for each inventory role.
+
+    Returns a dict with the matched column per role ("roles"), the number of numeric
+    columns, whether any column looks like SKU codes, and the fill ratio of the preview.
+    """
+    preview = dataframe.head(20)
+    roles = {}
+    for header in _headers(preview):
+        text = re.sub(r"[_\-/]+", " ", header.lower())
+        for role, pattern in ROLE_PATTERNS.items():
+            if role not in roles and pattern.search(text):
+                roles[role] = header
+    # "Total Inventory" headers also match the generic inventory pattern; don't count them twice
+    if roles.get("Current Inventory") == roles.get("Total Inventory"):
+        roles.pop("Current Inventory", None)
+
+    numeric_columns = sum(pd.api.types.is_numeric_dtype(dtype) for dtype in preview.dtypes)
+    sku_like = False
+    for col in preview.columns:
+        values = preview[col].dropna().astype(str)
+        if len(values) >= 3 and values.map(lambda v: bool(SKU_VALUE.match(v))).mean() >= 0.8:
+            sku_like = True
+            break
+    cells = preview.size
+    fill = float(preview.notna().sum().sum()) / cells if cells else 0.0
+    notes = any(NOTE_HEADER.search(h.lower()) for h in _headers(preview))
+    return {"roles": roles, "numeric_columns": numeric_columns, "sku_like": sku_like, "fill": fill, "notes": notes}
+
+
+def prefilter_table(dataframe):
+    """
+    Decide clear cases locally.
+
+    Returns an analysis dict (is_inventory_planning, details, description) when the
+    table is obviously inventory planning or obviously not, or None when the LLM
+    should decide. Most local decisions are negatives (empty tables, notes); a table
+    is only accepted locally on SKU-like codes plus an on-hand, inventory or forecast
+    column.
+    """
+    if dataframe.empty or dataframe.shape[1] < 2 or dataframe.notna().sum().sum() < 4:
+        return _decision(0, {}, "Classified locally: table is empty or too small to hold inventory data.")
+
+    signals = score_table(dataframe)
+    roles = signals["roles"]
+    has_item = "SKU" in roles or signals["sku_like"]
+    quantity_roles = [role for role in ("Quantity", "Total Inventory", "Current Inventory", "Sales Forecast") if role in roles]
+    # A generic item and quantity header also fits expense lists and sales reports, so only SKU-like
+    # code values next to an on-hand, inventory or forecast column count as a clear yes
+    planning_roles = [role for role in ("Total Inventory", "Current Inventory", "Sales Forecast")
+                      if role in roles and roles[role] != roles.get("SKU")]
+
+    if "SKU" in roles and signals["sku_like"] and planning_roles and signals["numeric_columns"] >= 1:
+        found = ", ".join(f"{role} -> {roles[role]}" for role in ["SKU"] + planning_roles)
+        return _decision(1, roles, f"Classified locally: SKU codes with inventory roles ({found}).")
+
+    if not roles and not has_item and signals["numeric_columns"] == 0:
+        reason = "notes or free text" if signals["notes"] else "no item, location or quantity columns and no numeric data"
+        return _decision(0, {}, f"Classified locally: {reason}.")
+    if signals["notes"] and not quantity_roles:
+        return _decision(0, {}, "Classified locally: notes or free text.")
+    return None
+
+
+def _decision(is_inventory, roles, description):
+    return {
+        "is_inventory_planning": is_inventory,
+        "details": {role: roles.get(role) for role in ROLES},
+        "description": description,
+    }
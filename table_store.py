@@ -0,0 +1,132 @@
+import os
+import re
+import json
+
+import pandas as pd
+import pyarrow as pa
+from openpyxl.utils.cell import range_boundaries
+
+from formula_classes import group_formula_classes
+
+
+CATALOG_NAME = "catalog.json"
+TABLE_SUFFIX = ".arrow"
+# Rows per Arrow record batch; reading a preview only touches the first batch
+BATCH_ROWS = 16384
+PREVIEW_ROWS = 20
+
+
+def _column_names(columns):
+    """String column names, with blanks filled in and duplicates suffixed so Arrow accepts them."""
+    names, seen = [], {}
+    for i, column in enumerate(columns):
+        name = "" if column is None or (isinstance(column, float) and pd.isna(column)) else str(column)
+        name = name or f"column_{i + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def to_arrow(dataframe):
+    """
+    Typed Arrow table for a DataFrame. Columns Arrow can't type as a whole (mixed numbers
+    and text, as sheets often hold) are stored as strings with missing values kept null.
+    """
+    arrays = []
+    for _, series in dataframe.items():
+        try:
+            arrays.append(pa.array(series, from_pandas=True))
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            arrays.append(pa.array([None if pd.isna(value) else str(value) for value in series], type=pa.string()))
+    return pa.Table.from_arrays(arrays, names=_column_names(dataframe.columns))
+
+
+def write_arrow(table, path):
+    with pa.OSFile(path, "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table, max_chunksize=BATCH_ROWS)
+
+
+def open_table(path):
+    """Memory-mapped Arrow table: columns are read from the page cache, not copied, until used."""
+    return pa.ipc.open_file(pa.memory_map(path)).read_all()
+
+
+def read_head(path, rows=PREVIEW_ROWS):
+    """First rows of a stored table (or a CSV) as a DataFrame, without reading the rest of the file."""
+    if not path.endswith(TABLE_SUFFIX):
+        return pd.read_csv(path, nrows=rows)
+    with pa.memory_map(path) as source:
+        reader = pa.ipc.open_file(source)
+        batches, count = [], 0
+        for i in range(reader.num_record_batches):
+            if count >= rows:
+                break
+            batch = reader.get_batch(i)
+            batches.append(batch)
+            count += batch.num_rows
+        return pa.Table.from_batches(batches, schema=reader.schema).slice(0, rows).to_pandas()
+
+
+def table_columns(path):
+    """Column names of a stored table from its schema alone."""
+    with pa.memory_map(path) as source:
+        return pa.ipc.open_file(source).schema.names
+
+
+def read_catalog(sheet_folder):
+    path = os.path.join(sheet_folder, CATALOG_NAME)
+    if not os.path.exists(path):
+        return []
+    with open(path) as f:
+        return json.load(f)["tables"]
+
+
+class TableWriter:
+    """
+    Saves the tables of one sheet as Arrow IPC files plus a catalog.
+
+    The catalog (catalog.json in the sheet folder) lists, per table, its file, source
+    range, columns and Arrow types, row count and the formula classes inside the
+    source range. It is rewritten after every save, so it always describes exactly
+    the tables written by the current run.
+    """
+
+    def __init__(self, sheet_folder, sheet=None):
+        self.sheet_folder = sheet_folder
+        self.sheet = sheet
+        self.entries = []
+
+    def _formulas(self, source_range):
+        if self.sheet is None or not source_range:
+            return []
+        min_col, min_row, max_col, max_row = range_boundaries(source_range)
+        bounds = (min_row, min_col, max_row, max_col)
+        return [metadata for formula_class in group_formula_classes(self.sheet, *bounds)
+                if (metadata := formula_class.to_dict(*bounds)) is not None]
+
+    def save(self, dataframe, name, source_range=None):
+        """Write dataframe as <name>.arrow and record it in the catalog; returns the file path."""
+        name = re.sub(r"[^\w\-]+", "_", str(name)).strip("_") or f"table_{len(self.entries) + 1}"
+        table = to_arrow(dataframe)
+        file = f"{name}{TABLE_SUFFIX}"
+        write_arrow(table, os.path.join(self.sheet_folder, file))
+        self.entries = [entry for entry in self.entries if entry["file"] != file]
+        self.entries.append({
+            "name": name,
+            "file": file,
+            "sheet": self.sheet.title if self.sheet is not None else None,
+            "range": source_range,
+            "columns": table.schema.names,
+            "types": [str(field.type) for field in table.schema],
+            "rows": table.num_rows,
+            "formulas": self._formulas(source_range),
+        })
+        tmp_path = os.path.join(self.sheet_folder, f"{CATALOG_NAME}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump({"tables": self.entries}, f, indent=2, default=str)
+        os.replace(tmp_path, os.path.join(self.sheet_folder, CATALOG_NAME))
+        return os.path.join(self.sheet_folder, file)
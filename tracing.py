@@ -0,0 +1,225 @@
+import os
+import json
+import time
+import argparse
+import itertools
+import threading
+import contextvars
+from contextlib import contextmanager
+
+import pandas as pd
+
+
+# Set TRACE_PATH (or pass --trace to the scripts) to write spans; tracing is off otherwise
+DEFAULT_TRACE_PATH = os.environ.get("TRACE_PATH")
+
+# USD per million (prompt, completion) tokens
+MODEL_PRICES = {
+    "gpt-4o-mini": (0.15, 0.60),
+    "gpt-4o": (2.50, 10.00),
+}
+
+# Innermost open span of the current thread or asyncio task; tasks inherit it from their creator
+_current_span = contextvars.ContextVar("current_span", default=None)
+
+
+class Tracer:
+    """
+    Writes timing spans as JSON lines.
+
+    A span records its name, its path from the outermost span ("workbook/sheet/llm"),
+    the workbook and sheet it belongs to (inherited from the enclosing span), wall-clock
+    duration, status and any fields set on it. Spans nest through a context variable,
+    so concurrent sheets under asyncio keep their own parents. Without a path nothing
+    is written and spans only cost a dict.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.run_id = f"{os.getpid()}-{int(time.time())}"
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self._file = open(path, "a") if path else None
+
+    @property
+    def enabled(self):
+        return self._file is not None
+
+    @contextmanager
+    def span(self, name, workbook=None, sheet=None, **fields):
+        """Time a block; yields the span's field dict, which the block may add to."""
+        if not self.enabled:
+            yield fields
+            return
+        parent = _current_span.get()
+        record = {
+            "run": self.run_id,
+            "id": f"{self.run_id}:{next(self._ids)}",
+            "parent": parent["id"] if parent else None,
+            "name": name,
+            "path": f"{parent['path']}/{name}" if parent else name,
+            "workbook": workbook or (parent["workbook"] if parent else None),
+            "sheet": sheet or (parent["sheet"] if parent else None),
+            "fields": fields,
+        }
+        token = _current_span.set(record)
+        start, started = time.perf_counter(), time.time()
+        status, error = "ok", None
+        try:
+            yield fields
+        except BaseException as e:
+            status, error = "error", f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            _current_span.reset(token)
+            record.pop("fields")
+            self.write({**record, "start": started, "duration": time.perf_counter() - start,
+                        "status": status, "error": error, **fields})
+
+    def write(self, record):
+        line = json.dumps(record, default=str)
+        with self._lock:
+            self._file.write(line + "\n")
+            self._file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+tracer = Tracer(DEFAULT_TRACE_PATH)
+
+
+def configure(path):
+    """Send spans to a new JSONL file (None turns tracing off) and return the tracer."""
+    global tracer
+    tracer.close()
+    tracer = Tracer(path)
+    return tracer
+
+
+def span(name, workbook=None, sheet=None, **fields):
+    return tracer.span(name, workbook=workbook, sheet=sheet, **fields)
+
+
+def annotate(**fields):
+    """Set fields on the innermost open span, e.g. retry counts known only at the end of a step."""
+    record = _current_span.get()
+    if record is not None:
+        record["fields"].update(fields)
+
+
+def increment(field, amount=1):
+    """Add to a numeric field of the innermost open span."""
+    record = _current_span.get()
+    if record is not None:
+        record["fields"][field] = record["fields"].get(field, 0) + amount
+
+
+def llm_cost(model, prompt_tokens, completion_tokens):
+    """Estimated USD cost of a call, or None for models without a known price."""
+    prices = MODEL_PRICES.get(model)
+    if prices is None:
+        return None
+    return (prompt_tokens * prices[0] + completion_tokens * prices[1]) / 1_000_000
+
+
+def llm_usage(model, prompt, response, content):
+    """
+    Token counts and cost of an answered LLM call. Uses the usage the provider reported
+    (LangChain's usage_metadata) and falls back to about 4 characters per token.
+    """
+    usage = getattr(response, "usage_metadata", None) or {}
+    prompt_tokens = usage.get("input_tokens") or max(1, len(prompt) // 4)
+    completion_tokens = usage.get("output_tokens") or max(1, len(content) // 4)
+    return {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "cost_usd": llm_cost(model, prompt_tokens, completion_tokens),
+    }
+
+
+def read_trace(path):
+    """Spans of a JSONL trace as a DataFrame, with self_time (duration minus that of direct children)."""
+    with open(path) as f:
+        spans = pd.DataFrame([json.loads(line) for line in f if line.strip()])
+    if spans.empty:
+        return spans
+    for column in ("prompt_tokens", "completion_tokens", "cost_usd", "retries", "rate_limit_retries"):
+        spans[column] = pd.to_numeric(spans[column], errors="coerce").fillna(0) if column in spans else 0.0
+    spans["cached"] = spans["cached"].fillna(False).astype(bool) if "cached" in spans else False
+    children = spans.groupby("parent")["duration"].sum()
+    # Concurrent children can add up to more than their parent; self time never goes below zero
+    spans["self_time"] = (spans["duration"] - spans["id"].map(children).fillna(0)).clip(lower=0)
+    return spans
+
+
+def summarize(path, top=10):
+    """
+    Summary tables of a trace: time per stage, the hottest span paths by self time,
+    LLM usage per calling stage and the slowest sheets.
+    """
+    spans = read_trace(path)
+    if spans.empty:
+        return {}
+    stages = spans.groupby("name").agg(
+        calls=("id", "size"), total_s=("duration", "sum"), self_s=("self_time", "sum"),
+        mean_s=("duration", "mean"), p95_s=("duration", lambda d: d.quantile(0.95)), max_s=("duration", "max"),
+        errors=("status", lambda s: int((s == "error").sum())), retries=("retries", "sum"),
+    )
+    stages["self_share"] = stages["self_s"] / stages["self_s"].sum()
+    stages = stages.sort_values("self_s", ascending=False)
+
+    hot_paths = spans.groupby("path").agg(calls=("id", "size"), self_s=("self_time", "sum"))
+    hot_paths["self_share"] = hot_paths["self_s"] / hot_paths["self_s"].sum()
+    hot_paths = hot_paths.sort_values("self_s", ascending=False).head(top)
+
+    calls = spans[spans["name"] == "llm"].copy()
+    calls["stage"] = calls["path"].str.rsplit("/", n=2).str[-2].fillna("(top level)")
+    llm = calls.groupby("stage").agg(
+        calls=("id", "size"), cache_hits=("cached", "sum"), prompt_tokens=("prompt_tokens", "sum"),
+        completion_tokens=("completion_tokens", "sum"), cost_usd=("cost_usd", "sum"),
+        rate_limit_retries=("rate_limit_retries", "sum"), total_s=("duration", "sum"),
+    ).sort_values("cost_usd", ascending=False)
+
+    in_sheet = spans[spans["sheet"].notna()]
+    sheets = pd.DataFrame()
+    if not in_sheet.empty:
+        sheet_spans = in_sheet[in_sheet["name"] == "sheet"].groupby(["workbook", "sheet"])
+        sheets = pd.DataFrame({
+            "total_s": sheet_spans["duration"].sum(),
+            "retries": sheet_spans["retries"].sum(),
+            "llm_calls": in_sheet[in_sheet["name"] == "llm"].groupby(["workbook", "sheet"]).size(),
+            "cost_usd": in_sheet.groupby(["workbook", "sheet"])["cost_usd"].sum(),
+        }).fillna(0).sort_values("total_s", ascending=False).head(top)
+
+    return {"stages": stages, "hot_paths": hot_paths, "llm": llm, "sheets": sheets}
+
+
+def format_summary(summary):
+    if not summary:
+        return "No spans recorded."
+    sections = []
+    for title, key in (("Time per stage", "stages"), ("Hot paths (self time)", "hot_paths"),
+                       ("LLM calls by stage", "llm"), ("Slowest sheets", "sheets")):
+        frame = summary[key]
+        if len(frame):
+            sections.append(f"{title}:\n{frame.to_string(float_format=lambda v: f'{v:.4g}')}")
+    llm = summary["llm"]
+    if len(llm):
+        lookups = llm["calls"].sum()
+        sections.append(
+            f"LLM total: {int(lookups)} call(s), {int(llm['cache_hits'].sum())} cache hit(s) "
+            f"({llm['cache_hits'].sum() / lookups:.0%}), {int(llm['prompt_tokens'].sum())} prompt + "
+            f"{int(llm['completion_tokens'].sum())} completion tokens, ${llm['cost_usd'].sum():.4f}"
+        )
+    return "\n\n".join(sections)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Summarize a JSONL trace written with --trace.")
+    parser.add_argument("trace", help="Path of the trace file.")
+    parser.add_argument("--top", type=int, default=10, help="Rows shown for hot paths and sheets.")
+    args = parser.parse_args()
+    print(format_summary(summarize(args.trace, top=args.top)))
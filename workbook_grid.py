@@ -0,0 +1,464 @@
+import zipfile
+import hashlib
+import posixpath
+from array import array
+import xml.etree.ElementTree as ET
+
+import numpy as np
+from openpyxl.formula.translate import Translator
+from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+from openpyxl.utils import get_column_letter
+from openpyxl.utils.cell import coordinate_from_string, column_index_from_string
+from openpyxl.utils.datetime import CALENDAR_WINDOWS_1900, CALENDAR_MAC_1904, from_excel
+
+
+REL_NS = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+WORKSHEET_REL = "/worksheet"
+
+# Cell type codes stored in SheetGrid.types
+EMPTY, INT, FLOAT, STRING, BOOL, ERROR, DATE = range(7)
+DATA_TYPES = {EMPTY: "n", INT: "n", FLOAT: "n", STRING: "s", BOOL: "b", ERROR: "e", DATE: "d"}
+# Marker used by SheetGrid.type_grid for formula cells
+FORMULA_CELL = -1
+
+
+def _local(tag):
+    """Strip the XML namespace from a tag."""
+    return tag.rsplit("}", 1)[-1]
+
+
+def _text_of(elem):
+    """Concatenate every <t> run of a string item, skipping phonetic hints."""
+    parts = []
+    for child in elem:
+        name = _local(child.tag)
+        if name == "t":
+            parts.append(child.text or "")
+        elif name == "r":
+            parts.extend(t.text or "" for t in child if _local(t.tag) == "t")
+    return "".join(parts)
+
+
+def _split_coordinate(coordinate):
+    column_letter, row = coordinate_from_string(coordinate)
+    return row, column_index_from_string(column_letter)
+
+
+class SheetGrid:
+    """
+    Compact, array-backed view of one worksheet.
+
+    Only non-empty cells are stored, sorted by (row, col), as parallel NumPy arrays
+    holding the type code, numeric value, string id and formula id of each cell.
+    Cached values and formula text come from the same pass over the sheet XML.
+    """
+
+    def __init__(self, name, rows, cols, types, numbers, text_ids, formula_ids,
+                 shared_strings, local_strings, formulas, state="visible", epoch=CALENDAR_WINDOWS_1900,
+                 merged_ranges=None):
+        self.title = name
+        self.sheet_state = state
+        self.merged_ranges = merged_ranges or []
+        self.rows = rows
+        self.cols = cols
+        self.types = types
+        self.numbers = numbers
+        self.text_ids = text_ids
+        self.formula_ids = formula_ids
+        self.formulas = formulas
+        self.epoch = epoch
+        self._shared_strings = shared_strings
+        self._local_strings = local_strings
+        self.max_row = int(rows.max()) if len(rows) else 0
+        self.max_column = int(cols.max()) if len(cols) else 0
+        self._stride = self.max_column + 1
+        self._keys = rows.astype(np.int64) * self._stride + cols
+
+    def __len__(self):
+        return len(self.rows)
+
+    @property
+    def nbytes(self):
+        """Bytes used by the cell arrays (excluding the shared string table)."""
+        return sum(a.nbytes for a in (self.rows, self.cols, self.types, self.numbers,
+                                      self.text_ids, self.formula_ids, self._keys))
+
+    def _index(self, row, col):
+        if row < 1 or col < 1 or row > self.max_row or col > self.max_column:
+            return -1
+        key = row * self._stride + col
+        i = int(np.searchsorted(self._keys, key))
+        if i < len(self._keys) and self._keys[i] == key:
+            return i
+        return -1
+
+    def _text(self, text_id):
+        n_shared = len(self._shared_strings)
+        if text_id < n_shared:
+            return self._shared_strings[text_id]
+        return self._local_strings[text_id - n_shared]
+
+    def _value_at(self, i):
+        kind = self.types[i]
+        if kind == INT:
+            return int(self.numbers[i])
+        if kind == FLOAT:
+            return float(self.numbers[i])
+        if kind == STRING or kind == ERROR:
+            return self._text(int(self.text_ids[i]))
+        if kind == BOOL:
+            return bool(self.numbers[i])
+        if kind == DATE:
+            return from_excel(float(self.numbers[i]), self.epoch)
+        return None
+
+    def value(self, row, col):
+        """Cached value of a cell, as openpyxl would return it with data_only=True."""
+        i = self._index(row, col)
+        return None if i < 0 else self._value_at(i)
+
+    def formula(self, row, col):
+        """Formula text of a cell (with the leading '='), or None."""
+        i = self._index(row, col)
+        if i < 0 or self.formula_ids[i] < 0:
+            return None
+        return self.formulas[self.formula_ids[i]]
+
+    def data_type(self, row, col):
+        """openpyxl-style data type: 'f' for formulas, otherwise the cached value type."""
+        i = self._index(row, col)
+        if i < 0:
+            return "n"
+        if self.formula_ids[i] >= 0:
+            return "f"
+        return DATA_TYPES[int(self.types[i])]
+
+    def _row_slice(self, min_row, max_row):
+        lo = int(np.searchsorted(self._keys, min_row * self._stride))
+        hi = int(np.searchsorted(self._keys, (max_row + 1) * self._stride))
+        return lo, hi
+
+    def iter_rows(self, min_row=1, max_row=None, min_col=1, max_col=None, values_only=True, formulas=False):
+        """
+        Yield rows of cached values as tuples, mirroring Worksheet.iter_rows(values_only=True).
+        With formulas=True formula cells yield their formula text instead, like data_only=False.
+        """
+        max_row = self.max_row if max_row is None else max_row
+        max_col = self.max_column if max_col is None else max_col
+        width = max_col - min_col + 1
+        if width <= 0:
+            return
+        lo, hi = self._row_slice(min_row, max_row)
+        idx = np.arange(lo, hi)
+        idx = idx[(self.cols[lo:hi] >= min_col) & (self.cols[lo:hi] <= max_col)]
+        pos = 0
+        for row_idx in range(min_row, max_row + 1):
+            values = [None] * width
+            while pos < len(idx) and self.rows[idx[pos]] == row_idx:
+                i = idx[pos]
+                if formulas and self.formula_ids[i] >= 0:
+                    values[self.cols[i] - min_col] = self.formulas[self.formula_ids[i]]
+                else:
+                    values[self.cols[i] - min_col] = self._value_at(i)
+                pos += 1
+            yield tuple(values)
+
+    def cells_in(self, min_row=1, min_col=1, max_row=None, max_col=None):
+        """Arrays (rows, cols, formula_ids) of all non-empty cells inside a rectangle, in row order."""
+        max_row = self.max_row if max_row is None else max_row
+        max_col = self.max_column if max_col is None else max_col
+        lo, hi = self._row_slice(min_row, max_row)
+        cols = self.cols[lo:hi]
+        keep = (cols >= min_col) & (cols <= max_col)
+        return self.rows[lo:hi][keep], cols[keep], self.formula_ids[lo:hi][keep]
+
+    def formula_cells(self, min_row=1, min_col=1, max_row=None, max_col=None):
+        """Arrays (rows, cols, formula_ids) of the formula cells inside a rectangle, in row order."""
+        rows, cols, formula_ids = self.cells_in(min_row, min_col, max_row, max_col)
+        keep = formula_ids >= 0
+        return rows[keep], cols[keep], formula_ids[keep]
+
+    def iter_formulas(self):
+        """Yield (row, col, formula) for every formula cell."""
+        for i in np.flatnonzero(self.formula_ids >= 0):
+            yield int(self.rows[i]), int(self.cols[i]), self.formulas[self.formula_ids[i]]
+
+    def occupancy(self):
+        """Boolean (max_row, max_column) mask of cells that hold a cached value or a formula."""
+        mask = np.zeros((self.max_row, self.max_column), dtype=bool)
+        filled = (self.types != EMPTY) | (self.formula_ids >= 0)
+        mask[self.rows[filled] - 1, self.cols[filled] - 1] = True
+        return mask
+
+    def content_hash(self):
+        """sha256 of every cell's position, type, value and formula text; unchanged sheets hash the same."""
+        digest = hashlib.sha256()
+        for values in (self.rows, self.cols, self.types, self.numbers):
+            digest.update(np.ascontiguousarray(values).tobytes())
+        texts = [self._text(text_id) if text_id >= 0 else "" for text_id in self.text_ids.tolist()]
+        formulas = [self.formulas[formula_id] if formula_id >= 0 else "" for formula_id in self.formula_ids.tolist()]
+        digest.update("\x00".join(texts).encode("utf-8"))
+        digest.update(b"\x01")
+        digest.update("\x00".join(formulas).encode("utf-8"))
+        return digest.hexdigest()
+
+    def dense_values(self):
+        """
+        Dense (max_row, max_column) arrays of the cached values: type codes, numbers
+        (NaN where the cell holds no number) and strings or error texts (None elsewhere).
+        """
+        shape = (self.max_row, self.max_column)
+        types = np.zeros(shape, dtype=np.int8)
+        numbers = np.full(shape, np.nan)
+        texts = np.full(shape, None, dtype=object)
+        rows, cols = self.rows - 1, self.cols - 1
+        types[rows, cols] = self.types
+        numeric = np.isin(self.types, (INT, FLOAT, BOOL, DATE))
+        numbers[rows[numeric], cols[numeric]] = self.numbers[numeric]
+        textual = (self.types == STRING) | (self.types == ERROR)
+        texts[rows[textual], cols[textual]] = [self._text(text_id) for text_id in self.text_ids[textual].tolist()]
+        return types, numbers, texts
+
+    def type_grid(self, min_row=1, min_col=1, max_row=None, max_col=None):
+        """
+        Dense int8 array of type codes for a rectangle (EMPTY where no cell is stored).
+        Formula cells are marked FORMULA_CELL regardless of their cached value.
+        """
+        max_row = self.max_row if max_row is None else max_row
+        max_col = self.max_column if max_col is None else max_col
+        grid = np.zeros((max(0, max_row - min_row + 1), max(0, max_col - min_col + 1)), dtype=np.int8)
+        lo, hi = self._row_slice(min_row, max_row)
+        cols = self.cols[lo:hi]
+        keep = (cols >= min_col) & (cols <= max_col)
+        codes = np.where(self.formula_ids[lo:hi] >= 0, FORMULA_CELL, self.types[lo:hi]).astype(np.int8)
+        grid[self.rows[lo:hi][keep] - min_row, cols[keep] - min_col] = codes[keep]
+        return grid
+
+
+class WorkbookGrid:
+    """
+    Streaming reader for .xlsx files that builds one SheetGrid per worksheet.
+
+    Each sheet's XML is parsed once, on first access, so values and formulas never
+    need two separate openpyxl object models.
+    """
+
+    def __init__(self, file_path):
+        self.file_path = file_path
+        self._sheets = {}
+        self._paths = {}
+        self._states = {}
+        self.sheetnames = []
+        self.defined_names = {}
+        self.epoch = CALENDAR_WINDOWS_1900
+        with zipfile.ZipFile(file_path) as archive:
+            self._read_workbook(archive)
+            self.shared_strings = self._read_shared_strings(archive)
+            self._date_styles = self._read_date_styles(archive)
+
+    @property
+    def visible_sheetnames(self):
+        return [name for name in self.sheetnames if self._states[name] != "hidden"]
+
+    def __getitem__(self, sheet_name):
+        if sheet_name not in self._sheets:
+            with zipfile.ZipFile(self.file_path) as archive:
+                self._sheets[sheet_name] = self._read_sheet(archive, sheet_name)
+        return self._sheets[sheet_name]
+
+    def __contains__(self, sheet_name):
+        return sheet_name in self._paths
+
+    def _read_workbook(self, archive):
+        targets = {}
+        rels = ET.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+        for rel in rels:
+            if rel.get("Type", "").endswith(WORKSHEET_REL):
+                target = rel.get("Target")
+                if target.startswith("/"):
+                    target = target.lstrip("/")
+                else:
+                    target = posixpath.normpath(posixpath.join("xl", target))
+                targets[rel.get("Id")] = target
+
+        root = ET.fromstring(archive.read("xl/workbook.xml"))
+        for elem in root.iter():
+            name = _local(elem.tag)
+            if name == "workbookPr" and elem.get("date1904") in ("1", "true"):
+                self.epoch = CALENDAR_MAC_1904
+            elif name == "sheet":
+                rel_id = elem.get(f"{{{REL_NS}}}id")
+                if rel_id in targets:
+                    sheet_name = elem.get("name")
+                    self.sheetnames.append(sheet_name)
+                    self._paths[sheet_name] = targets[rel_id]
+                    self._states[sheet_name] = elem.get("state", "visible")
+            elif name == "definedName" and elem.text:
+                # Workbook-scoped names win over sheet-scoped ones with the same name
+                if elem.get("localSheetId") is None or elem.get("name") not in self.defined_names:
+                    self.defined_names[elem.get("name")] = elem.text
+
+    @staticmethod
+    def _read_shared_strings(archive):
+        if "xl/sharedStrings.xml" not in archive.namelist():
+            return []
+        strings = []
+        with archive.open("xl/sharedStrings.xml") as stream:
+            for _, elem in ET.iterparse(stream):
+                if _local(elem.tag) == "si":
+                    strings.append(_text_of(elem))
+                    elem.clear()
+        return strings
+
+    @staticmethod
+    def _read_date_styles(archive):
+        """Return the set of cellXfs indices whose number format is a date format."""
+        if "xl/styles.xml" not in archive.namelist():
+            return frozenset()
+        root = ET.fromstring(archive.read("xl/styles.xml"))
+        custom_formats = {}
+        date_styles = set()
+        for elem in root:
+            name = _local(elem.tag)
+            if name == "numFmts":
+                for fmt in elem:
+                    custom_formats[int(fmt.get("numFmtId"))] = fmt.get("formatCode", "")
+            elif name == "cellXfs":
+                for style_idx, xf in enumerate(elem):
+                    fmt_id = int(xf.get("numFmtId", 0))
+                    fmt = custom_formats.get(fmt_id, BUILTIN_FORMATS.get(fmt_id, "General"))
+                    if is_date_format(fmt):
+                        date_styles.add(style_idx)
+        return frozenset(date_styles)
+
+    def _read_sheet(self, archive, sheet_name):
+        rows, cols = array("i"), array("i")
+        types, numbers = array("b"), array("d")
+        text_ids, formula_ids = array("i"), array("i")
+        formulas, formula_lookup = [], {}
+        local_strings, local_lookup = [], {}
+        shared_formulas = {}
+        merged_ranges = []
+        n_shared = len(self.shared_strings)
+
+        def intern_text(text):
+            if text not in local_lookup:
+                local_lookup[text] = n_shared + len(local_strings)
+                local_strings.append(text)
+            return local_lookup[text]
+
+        def intern_formula(text):
+            if text not in formula_lookup:
+                formula_lookup[text] = len(formulas)
+                formulas.append(text)
+            return formula_lookup[text]
+
+        current_row, current_col = 0, 0
+        with archive.open(self._paths[sheet_name]) as stream:
+            for _, elem in ET.iterparse(stream):
+                tag = _local(elem.tag)
+                if tag == "row":
+                    elem.clear()
+                    continue
+                if tag == "mergeCell":
+                    merged_ranges.append(elem.get("ref"))
+                    continue
+                if tag != "c":
+                    continue
+
+                ref = elem.get("r")
+                if ref:
+                    row_idx, col_idx = _split_coordinate(ref)
+                else:
+                    row_idx, col_idx = current_row or 1, current_col + 1
+                    ref = f"{get_column_letter(col_idx)}{row_idx}"
+                current_row, current_col = row_idx, col_idx
+
+                cell_type = elem.get("t", "n")
+                style_idx = int(elem.get("s", 0))
+                raw_value, formula, inline = None, None, None
+                for child in elem:
+                    name = _local(child.tag)
+                    if name == "v":
+                        raw_value = child.text
+                    elif name == "f":
+                        formula = self._formula_text(child, ref, shared_formulas)
+                    elif name == "is":
+                        inline = _text_of(child)
+                elem.clear()
+
+                kind, number, text_id = EMPTY, 0.0, -1
+                if cell_type == "inlineStr":
+                    if inline is not None:
+                        kind, text_id = STRING, intern_text(inline)
+                elif raw_value is not None:
+                    if cell_type == "s":
+                        kind, text_id = STRING, int(raw_value)
+                    elif cell_type == "str":
+                        kind, text_id = STRING, intern_text(raw_value)
+                    elif cell_type == "b":
+                        kind, number = BOOL, float(raw_value in ("1", "true"))
+                    elif cell_type == "e":
+                        kind, text_id = ERROR, intern_text(raw_value)
+                    elif cell_type == "d":
+                        kind, text_id = STRING, intern_text(raw_value)
+                    else:
+                        if "." in raw_value or "E" in raw_value or "e" in raw_value:
+                            kind, number = FLOAT, float(raw_value)
+                        else:
+                            kind, number = INT, float(raw_value)
+                        if style_idx in self._date_styles:
+                            kind = DATE
+
+                if kind == EMPTY and formula is None:
+                    continue
+                rows.append(row_idx)
+                cols.append(col_idx)
+                types.append(kind)
+                numbers.append(number)
+                text_ids.append(text_id)
+                formula_ids.append(-1 if formula is None else intern_formula(formula))
+
+        rows = np.frombuffer(rows, dtype=np.int32)
+        cols = np.frombuffer(cols, dtype=np.int32)
+        order = np.lexsort((cols, rows))
+        return SheetGrid(
+            sheet_name,
+            rows=rows[order],
+            cols=cols[order],
+            types=np.frombuffer(types, dtype=np.int8)[order],
+            numbers=np.frombuffer(numbers, dtype=np.float64)[order],
+            text_ids=np.frombuffer(text_ids, dtype=np.int32)[order],
+            formula_ids=np.frombuffer(formula_ids, dtype=np.int32)[order],
+            shared_strings=self.shared_strings,
+            local_strings=local_strings,
+            formulas=formulas,
+            state=self._states[sheet_name],
+            epoch=self.epoch,
+            merged_ranges=merged_ranges,
+        )
+
+    @staticmethod
+    def _formula_text(elem, ref, shared_formulas):
+        """Resolve a <f> element to formula text, expanding shared formulas from their master cell."""
+        kind = elem.get("t")
+        text = elem.text
+        if kind == "dataTable":
+            return None
+        if kind == "shared":
+            group = elem.get("si")
+            if text:
+                shared_formulas[group] = (ref, f"={text}")
+                return f"={text}"
+            if group not in shared_formulas:
+                return None
+            origin, master = shared_formulas[group]
+            return Translator(master, origin=origin).translate_formula(ref)
+        if text is None:
+            return None
+        return f"={text}"
+
+
+def load_workbook_grid(file_path):
+    """Open an .xlsx file for single-pass, array-backed reading."""
+    return WorkbookGrid(file_path)